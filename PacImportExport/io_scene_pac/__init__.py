@@ -16,8 +16,10 @@
 # ##### END GPL LICENSE BLOCK #####
 
 import bpy
-from bpy.props import StringProperty, BoolProperty, FloatProperty, EnumProperty
+from bpy.props import StringProperty, BoolProperty, FloatProperty, IntProperty, EnumProperty
 from bpy_extras.io_utils import ExportHelper
+from . import export_tracker
+from . import log
 
 
 bl_info = {
@@ -41,7 +43,21 @@ bl_info = {
         ("bones", "bones/*")
     ],
     "modules": [
+        "log",
+        "build",
+        "dae_archive",
+        "dae_budget",
+        "dae_encoder",
+        "dae_pool",
+        "dae_templates",
         "export_dae",
+        "export_glb",
+        "export_tracker",
+        "file_cache",
+        "mesh_arrays",
+        "scene_ir",
+        "scene_extract",
+        "section_writer",
         "import_pac",
         "export_pac"
     ]
@@ -50,9 +66,51 @@ bl_info = {
 if "bpy" in locals():
     import imp
 
+    if "log" in locals():
+        imp.reload(log)  # noqa
+
+    if "build" in locals():
+        imp.reload(build)  # noqa
+
+    if "dae_archive" in locals():
+        imp.reload(dae_archive)  # noqa
+
+    if "dae_budget" in locals():
+        imp.reload(dae_budget)  # noqa
+
+    if "dae_encoder" in locals():
+        imp.reload(dae_encoder)  # noqa
+
+    if "dae_pool" in locals():
+        imp.reload(dae_pool)  # noqa
+
+    if "dae_templates" in locals():
+        imp.reload(dae_templates)  # noqa
+
+    if "mesh_arrays" in locals():
+        imp.reload(mesh_arrays)  # noqa
+
+    if "scene_ir" in locals():
+        imp.reload(scene_ir)  # noqa
+
+    if "scene_extract" in locals():
+        imp.reload(scene_extract)  # noqa
+
+    if "section_writer" in locals():
+        imp.reload(section_writer)  # noqa
+
     if "export_dae" in locals():
         imp.reload(export_dae)  # noqa
 
+    if "export_glb" in locals():
+        imp.reload(export_glb)  # noqa
+
+    if "export_tracker" in locals():
+        imp.reload(export_tracker)  # noqa
+
+    if "file_cache" in locals():
+        imp.reload(file_cache)  # noqa
+
     if "import_pac" in locals():
         imp.reload(import_pac)  # noqa
 
@@ -110,9 +168,9 @@ class ImportPACOperator(bpy.types.Operator):
         Called when the operator is executed
         """
         if self.filepath:
-            print('-------------ImportPACOperator-------------')
+            log.pactool.info("Import PAC: %s", self.filepath)
             from . import import_pac
-            return import_pac.exec(self.filepath)
+            return import_pac.exec(self.filepath, self)
 
 
 class ExportPACOperator(bpy.types.Operator):
@@ -159,6 +217,13 @@ class ExportPACOperator(bpy.types.Operator):
                     "(otherwise animation will be applied on top of the last pose)",
         default=True,
     )
+    max_evaluated_meshes: IntProperty(
+        name="Max Evaluated Meshes",
+        description="Maximum number of evaluated meshes kept in memory at "
+                    "once, each one is freed as soon as it has been exported",
+        default=4,
+        min=1,
+    )
     use_tangent_arrays: BoolProperty(
         name="Tangent Arrays",
         description="Export Tangent and Binormal arrays "
@@ -170,6 +235,41 @@ class ExportPACOperator(bpy.types.Operator):
         description="Export Triangles instead of Polygons.",
         default=True,
     )
+    use_weld_vertices: BoolProperty(
+        name="Weld Vertices",
+        description="Merge vertices whose attributes differ by less than the "
+                    "weld tolerances (floating point noise from modifiers or "
+                    "tangent calculation).",
+        default=False,
+    )
+    weld_position_epsilon: FloatProperty(
+        name="Position Tolerance",
+        description="Largest position difference welded together",
+        min=0.0000001, max=1.0,
+        precision=6,
+        default=0.0001,
+    )
+    weld_normal_epsilon: FloatProperty(
+        name="Normal Tolerance",
+        description="Largest normal difference welded together",
+        min=0.0, max=1.0,
+        precision=6,
+        default=0.001,
+    )
+    weld_uv_epsilon: FloatProperty(
+        name="UV Tolerance",
+        description="Largest UV difference welded together",
+        min=0.0, max=1.0,
+        precision=6,
+        default=0.0001,
+    )
+    weld_tangent_epsilon: FloatProperty(
+        name="Tangent Tolerance",
+        description="Largest tangent and binormal difference welded together",
+        min=0.0, max=1.0,
+        precision=6,
+        default=0.001,
+    )
 
     use_copy_images: BoolProperty(
         name="Copy Images",
@@ -215,6 +315,18 @@ class ExportPACOperator(bpy.types.Operator):
         description="Export shape keys for selected objects.",
         default=False,
     )
+    use_shape_key_normals: BoolProperty(
+        name="Shape Key Normals",
+        description="Recalculate the normals of every shape key "
+                    "(otherwise the normals of the base mesh are reused).",
+        default=True,
+    )
+    use_shape_key_changed_only: BoolProperty(
+        name="Only Changed Vertices",
+        description="Only recalculate shape key data around the vertices "
+                    "a shape key moves, the rest is copied from the base mesh.",
+        default=False,
+    )
 
     anim_optimize_precision: FloatProperty(
         name="Precision",
@@ -224,6 +336,152 @@ class ExportPACOperator(bpy.types.Operator):
         soft_min=1, soft_max=16,
         default=6.0,
     )
+    float_format: EnumProperty(
+        name="Float Format",
+        description="How numbers are written to the arrays of the file. "
+                    "Matrices and weights are always written exactly",
+        items=(("FIXED", "Fixed", "A fixed number of decimals"),
+               ("SHORTEST", "Shortest",
+                "The fewest digits that read back as the same value"),
+               ),
+        default="FIXED",
+    )
+    float_precision: IntProperty(
+        name="Float Decimals",
+        description="Decimals written by the Fixed float format",
+        min=0, max=17,
+        default=8,
+    )
+    use_fixed_width: BoolProperty(
+        name="Fixed Width Numbers",
+        description="Pad the numbers of each array to the same width",
+        default=False,
+    )
+    use_attribute_precision: BoolProperty(
+        name="Per-Attribute Precision",
+        description="Write positions, normals, UVs, colors, weights and "
+                    "matrices with their own precision instead of the float "
+                    "format's, and report the largest error introduced",
+        default=False,
+    )
+    use_quantize_grid: BoolProperty(
+        name="Snap to Grid",
+        description="Snap values to multiples of their precision instead of "
+                    "only rounding them to its decimals (for steps like "
+                    "1/255, decimal steps round the same either way)",
+        default=False,
+    )
+    position_precision: FloatProperty(
+        name="Position Precision",
+        description="Precision of positions and shape key positions",
+        min=0.0000001, max=1.0,
+        precision=6,
+        default=0.001,
+    )
+    normal_precision: FloatProperty(
+        name="Normal Precision",
+        description="Precision of normals, tangents and binormals",
+        min=0.0000001, max=1.0,
+        precision=6,
+        default=0.0001,
+    )
+    uv_precision: FloatProperty(
+        name="UV Precision",
+        description="Precision of texture coordinates",
+        min=0.0000001, max=1.0,
+        precision=6,
+        default=0.0001,
+    )
+    color_precision: FloatProperty(
+        name="Color Precision",
+        description="Precision of vertex colors",
+        min=0.0000001, max=1.0,
+        precision=6,
+        default=1.0 / 255.0,
+    )
+    weight_precision: FloatProperty(
+        name="Weight Precision",
+        description="Precision of skin weights",
+        min=0.0000001, max=1.0,
+        precision=6,
+        default=1.0 / 255.0,
+    )
+    matrix_digits: IntProperty(
+        name="Matrix Digits",
+        description="Significant digits of node, bone, bind pose and "
+                    "animation matrices",
+        min=1, max=17,
+        default=6,
+    )
+    use_compact_xml: BoolProperty(
+        name="Compact XML",
+        description="Write the document without indentation or line breaks "
+                    "(smaller and faster to write and parse)",
+        default=False,
+    )
+    use_deterministic: BoolProperty(
+        name="Deterministic Output",
+        description="Make ids from object, mesh and material names and "
+                    "export everything in name order, so an unchanged scene "
+                    "is written the same way every time",
+        default=False,
+    )
+    use_timestamps: BoolProperty(
+        name="Timestamps",
+        description="Write the export time as creation and modification "
+                    "date (otherwise SOURCE_DATE_EPOCH, or 1970-01-01)",
+        default=True,
+    )
+    use_parallel_export: BoolProperty(
+        name="Parallel Export",
+        description="Convert large arrays to text in worker processes while "
+                    "the scene is being read",
+        default=False,
+    )
+    export_workers: IntProperty(
+        name="Workers",
+        description="Number of worker processes for parallel export "
+                    "(0 uses one per CPU core)",
+        min=0, max=256,
+        default=0,
+    )
+    use_scene_dump: BoolProperty(
+        name="Write Scene Dump",
+        description="Also write a JSON summary of the exported scene "
+                    "(nodes, meshes, skeletons and tracks) next to the file, "
+                    "for debugging",
+        default=False,
+    )
+    use_size_report: BoolProperty(
+        name="Write Size Report",
+        description="Also write a JSON breakdown of the file size by "
+                    "section, object, attribute and animation clip next to "
+                    "the file",
+        default=False,
+    )
+    use_geometry_cache: BoolProperty(
+        name="Geometry Cache",
+        description="Keep the exported geometry of every mesh in the cache "
+                    "directory set in the add-on preferences, so meshes that "
+                    "did not change are not converted again",
+        default=False,
+    )
+    use_incremental: BoolProperty(
+        name="Incremental Export",
+        description="Reuse the geometry of the objects that did not change "
+                    "since the previous export to the same file, without "
+                    "reading them again (uses the geometry cache)",
+        default=False,
+    )
+    use_build_cache: BoolProperty(
+        name="PAC Build Cache",
+        description="Keep the PAC files the PACtool writes in the cache "
+                    "directory set in the add-on preferences, and copy them "
+                    "instead of running the PACtool when the DAE, the PAC "
+                    "and the skeleton did not change. The DAE is then written "
+                    "without timestamps",
+        default=False,
+    )
 
     use_metadata: BoolProperty(
         name="Use Metadata",
@@ -255,22 +513,17 @@ class ExportPACOperator(bpy.types.Operator):
         Called when the operator is executed
         """
         if self.filepath:
-            print('-------------ExportPACOperator-------------')
+            log.pactool.info("Export PAC: %s", self.filepath)
             
-            keywords = self.as_keywords(ignore=("axis_forward",
-                                                "axis_up",
-                                                "global_scale",
-                                                "check_existing",
-                                                "filter_glob",
-                                                "xna_validate",
-                                                ))
+            from . import export_pac
+            keywords = self.as_keywords(
+                ignore=export_pac.IGNORED_PROPERTIES)
             # remove the filepath key-value pair from the keywords
             if 'filepath' in keywords:
                 keywords.pop('filepath')
             
             # self.filepath: has to be the pacfile to overwrite
             
-            from . import export_pac
             return export_pac.exec(self.filepath, self, context, **keywords)
 
 
@@ -281,7 +534,8 @@ class CE_OT_export_dae(bpy.types.Operator, ExportHelper):
     bl_options = {"PRESET"}
 
     filename_ext = ".dae"
-    filter_glob: StringProperty(default="*.dae", options={"HIDDEN"})
+    filter_glob: StringProperty(
+        default="*.dae;*.dae.gz;*.zae", options={"HIDDEN"})
 
     # List of operator properties, the attributes will be assigned
     # to the class instance from the operator settings before calling
@@ -315,6 +569,13 @@ class CE_OT_export_dae(bpy.types.Operator, ExportHelper):
                     "(otherwise animation will be applied on top of the last pose)",
         default=True,
     )
+    max_evaluated_meshes: IntProperty(
+        name="Max Evaluated Meshes",
+        description="Maximum number of evaluated meshes kept in memory at "
+                    "once, each one is freed as soon as it has been exported",
+        default=4,
+        min=1,
+    )
     use_tangent_arrays: BoolProperty(
         name="Tangent Arrays",
         description="Export Tangent and Binormal arrays "
@@ -326,6 +587,41 @@ class CE_OT_export_dae(bpy.types.Operator, ExportHelper):
         description="Export Triangles instead of Polygons.",
         default=True,
     )
+    use_weld_vertices: BoolProperty(
+        name="Weld Vertices",
+        description="Merge vertices whose attributes differ by less than the "
+                    "weld tolerances (floating point noise from modifiers or "
+                    "tangent calculation).",
+        default=False,
+    )
+    weld_position_epsilon: FloatProperty(
+        name="Position Tolerance",
+        description="Largest position difference welded together",
+        min=0.0000001, max=1.0,
+        precision=6,
+        default=0.0001,
+    )
+    weld_normal_epsilon: FloatProperty(
+        name="Normal Tolerance",
+        description="Largest normal difference welded together",
+        min=0.0, max=1.0,
+        precision=6,
+        default=0.001,
+    )
+    weld_uv_epsilon: FloatProperty(
+        name="UV Tolerance",
+        description="Largest UV difference welded together",
+        min=0.0, max=1.0,
+        precision=6,
+        default=0.0001,
+    )
+    weld_tangent_epsilon: FloatProperty(
+        name="Tangent Tolerance",
+        description="Largest tangent and binormal difference welded together",
+        min=0.0, max=1.0,
+        precision=6,
+        default=0.001,
+    )
 
     use_copy_images: BoolProperty(
         name="Copy Images",
@@ -371,6 +667,18 @@ class CE_OT_export_dae(bpy.types.Operator, ExportHelper):
         description="Export shape keys for selected objects.",
         default=False,
     )
+    use_shape_key_normals: BoolProperty(
+        name="Shape Key Normals",
+        description="Recalculate the normals of every shape key "
+                    "(otherwise the normals of the base mesh are reused).",
+        default=True,
+    )
+    use_shape_key_changed_only: BoolProperty(
+        name="Only Changed Vertices",
+        description="Only recalculate shape key data around the vertices "
+                    "a shape key moves, the rest is copied from the base mesh.",
+        default=False,
+    )
 
     anim_optimize_precision: FloatProperty(
         name="Precision",
@@ -380,6 +688,161 @@ class CE_OT_export_dae(bpy.types.Operator, ExportHelper):
         soft_min=1, soft_max=16,
         default=6.0,
     )
+    float_format: EnumProperty(
+        name="Float Format",
+        description="How numbers are written to the arrays of the file. "
+                    "Matrices and weights are always written exactly",
+        items=(("FIXED", "Fixed", "A fixed number of decimals"),
+               ("SHORTEST", "Shortest",
+                "The fewest digits that read back as the same value"),
+               ),
+        default="FIXED",
+    )
+    float_precision: IntProperty(
+        name="Float Decimals",
+        description="Decimals written by the Fixed float format",
+        min=0, max=17,
+        default=8,
+    )
+    use_fixed_width: BoolProperty(
+        name="Fixed Width Numbers",
+        description="Pad the numbers of each array to the same width",
+        default=False,
+    )
+    use_attribute_precision: BoolProperty(
+        name="Per-Attribute Precision",
+        description="Write positions, normals, UVs, colors, weights and "
+                    "matrices with their own precision instead of the float "
+                    "format's, and report the largest error introduced",
+        default=False,
+    )
+    use_quantize_grid: BoolProperty(
+        name="Snap to Grid",
+        description="Snap values to multiples of their precision instead of "
+                    "only rounding them to its decimals (for steps like "
+                    "1/255, decimal steps round the same either way)",
+        default=False,
+    )
+    position_precision: FloatProperty(
+        name="Position Precision",
+        description="Precision of positions and shape key positions",
+        min=0.0000001, max=1.0,
+        precision=6,
+        default=0.001,
+    )
+    normal_precision: FloatProperty(
+        name="Normal Precision",
+        description="Precision of normals, tangents and binormals",
+        min=0.0000001, max=1.0,
+        precision=6,
+        default=0.0001,
+    )
+    uv_precision: FloatProperty(
+        name="UV Precision",
+        description="Precision of texture coordinates",
+        min=0.0000001, max=1.0,
+        precision=6,
+        default=0.0001,
+    )
+    color_precision: FloatProperty(
+        name="Color Precision",
+        description="Precision of vertex colors",
+        min=0.0000001, max=1.0,
+        precision=6,
+        default=1.0 / 255.0,
+    )
+    weight_precision: FloatProperty(
+        name="Weight Precision",
+        description="Precision of skin weights",
+        min=0.0000001, max=1.0,
+        precision=6,
+        default=1.0 / 255.0,
+    )
+    matrix_digits: IntProperty(
+        name="Matrix Digits",
+        description="Significant digits of node, bone, bind pose and "
+                    "animation matrices",
+        min=1, max=17,
+        default=6,
+    )
+    use_compact_xml: BoolProperty(
+        name="Compact XML",
+        description="Write the document without indentation or line breaks "
+                    "(smaller and faster to write and parse)",
+        default=False,
+    )
+    use_deterministic: BoolProperty(
+        name="Deterministic Output",
+        description="Make ids from object, mesh and material names and "
+                    "export everything in name order, so an unchanged scene "
+                    "is written the same way every time",
+        default=False,
+    )
+    use_timestamps: BoolProperty(
+        name="Timestamps",
+        description="Write the export time as creation and modification "
+                    "date (otherwise SOURCE_DATE_EPOCH, or 1970-01-01)",
+        default=True,
+    )
+    use_parallel_export: BoolProperty(
+        name="Parallel Export",
+        description="Convert large arrays to text in worker processes while "
+                    "the scene is being read",
+        default=False,
+    )
+    export_workers: IntProperty(
+        name="Workers",
+        description="Number of worker processes for parallel export "
+                    "(0 uses one per CPU core)",
+        min=0, max=256,
+        default=0,
+    )
+    use_scene_dump: BoolProperty(
+        name="Write Scene Dump",
+        description="Also write a JSON summary of the exported scene "
+                    "(nodes, meshes, skeletons and tracks) next to the file, "
+                    "for debugging",
+        default=False,
+    )
+    use_size_report: BoolProperty(
+        name="Write Size Report",
+        description="Also write a JSON breakdown of the file size by "
+                    "section, object, attribute and animation clip next to "
+                    "the file",
+        default=False,
+    )
+    use_geometry_cache: BoolProperty(
+        name="Geometry Cache",
+        description="Keep the exported geometry of every mesh in the cache "
+                    "directory set in the add-on preferences, so meshes that "
+                    "did not change are not converted again",
+        default=False,
+    )
+    use_incremental: BoolProperty(
+        name="Incremental Export",
+        description="Reuse the geometry of the objects that did not change "
+                    "since the previous export to the same file, without "
+                    "reading them again (uses the geometry cache)",
+        default=False,
+    )
+    output_format: EnumProperty(
+        name="Output Format",
+        description="File format to write",
+        items=(("DAE", "Collada (.dae)", "Plain Collada document"),
+               ("DAE_GZ", "Compressed Collada (.dae.gz)",
+                "Collada document compressed with gzip"),
+               ("ZAE", "Collada Archive (.zae)",
+                "Zip archive with the Collada document and its images"),
+               ),
+        default="DAE",
+    )
+    compression_level: IntProperty(
+        name="Compression Level",
+        description="Compression level of .dae.gz and .zae files, from "
+                    "fastest (1) to smallest (9)",
+        min=1, max=9,
+        default=6,
+    )
 
     use_metadata: BoolProperty(
         name="Use Metadata",
@@ -389,12 +852,13 @@ class CE_OT_export_dae(bpy.types.Operator, ExportHelper):
 
     @property
     def check_extension(self):
-        return True
+        # export_dae.save sets the extension of compressed formats
+        return self.output_format == "DAE"
 
     def execute(self, context):
         if not self.filepath:
             raise Exception("filepath not set")
-        print('-------------BetterColladaExporterOperator-------------')
+        log.addon.info("Export DAE: %s", self.filepath)
         keywords = self.as_keywords(ignore=("axis_forward",
                                             "axis_up",
                                             "global_scale",
@@ -406,6 +870,297 @@ class CE_OT_export_dae(bpy.types.Operator, ExportHelper):
         return export_dae.save(self, context, **keywords)
 
 
+class CE_OT_export_glb(bpy.types.Operator, ExportHelper):
+    """Selection to GLB / export binary glTF operator"""
+    bl_idname = "export_scene.pac_glb"
+    bl_label = "Export GLB"
+    bl_options = {"PRESET"}
+
+    filename_ext = ".glb"
+    filter_glob: StringProperty(default="*.glb", options={"HIDDEN"})
+
+    # Same scene options as the Collada exporter, glTF is always triangles
+    object_types: EnumProperty(
+        name="Object Types",
+        options={"ENUM_FLAG"},
+        items=(("EMPTY", "Empty", ""),
+               ("CAMERA", "Camera", ""),
+               ("LAMP", "Lamp", ""),
+               ("ARMATURE", "Armature", ""),
+               ("MESH", "Mesh", ""),
+               ("CURVE", "Curve", ""),
+               ),
+        default={"EMPTY", "CAMERA", "ARMATURE", "MESH"},
+    )
+
+    use_export_selected: BoolProperty(
+        name="Selected Objects",
+        description="Export only selected objects (and visible in active "
+                    "layers if that applies).",
+        default=False,
+    )
+    use_exclude_armature_modifier: BoolProperty(
+        name="Exclude Armature Modifier",
+        description="Exclude the armature modifier when applying modifiers "
+                    "(otherwise animation will be applied on top of the last pose)",
+        default=True,
+    )
+    max_evaluated_meshes: IntProperty(
+        name="Max Evaluated Meshes",
+        description="Maximum number of evaluated meshes kept in memory at "
+                    "once, each one is freed as soon as it has been exported",
+        default=4,
+        min=1,
+    )
+    use_tangent_arrays: BoolProperty(
+        name="Tangent Arrays",
+        description="Export tangents (for normalmapping).",
+        default=True,
+    )
+    use_weld_vertices: BoolProperty(
+        name="Weld Vertices",
+        description="Merge vertices whose attributes differ by less than the "
+                    "weld tolerances (floating point noise from modifiers or "
+                    "tangent calculation).",
+        default=False,
+    )
+    weld_position_epsilon: FloatProperty(
+        name="Position Tolerance",
+        description="Largest position difference welded together",
+        min=0.0000001, max=1.0,
+        precision=6,
+        default=0.0001,
+    )
+    weld_normal_epsilon: FloatProperty(
+        name="Normal Tolerance",
+        description="Largest normal difference welded together",
+        min=0.0, max=1.0,
+        precision=6,
+        default=0.001,
+    )
+    weld_uv_epsilon: FloatProperty(
+        name="UV Tolerance",
+        description="Largest UV difference welded together",
+        min=0.0, max=1.0,
+        precision=6,
+        default=0.0001,
+    )
+    weld_tangent_epsilon: FloatProperty(
+        name="Tangent Tolerance",
+        description="Largest tangent and binormal difference welded together",
+        min=0.0, max=1.0,
+        precision=6,
+        default=0.001,
+    )
+    use_active_layers: BoolProperty(
+        name="Active Layers",
+        description="Export only objects on the active layers.",
+        default=False,
+    )
+    use_exclude_ctrl_bones: BoolProperty(
+        name="Exclude Control Bones",
+        description=("Exclude skeleton bones with names beginning with 'ctrl' "
+                     "or bones which are not marked as Deform bones."),
+        default=True,
+    )
+    use_anim: BoolProperty(
+        name="Export Animation",
+        description="Export keyframe animation",
+        default=False,
+    )
+    use_anim_action_all: BoolProperty(
+        name="All Actions",
+        description=("Export all actions for the first armature found "
+                     "as separate animations"),
+        default=False,
+    )
+    use_anim_skip_noexp: BoolProperty(
+        name="Skip (-noexp) Actions",
+        description="Skip exporting of actions whose name end in (-noexp)."
+                    " Useful to skip control animations.",
+        default=True,
+    )
+    use_shape_key_export: BoolProperty(
+        name="Shape Keys",
+        description="Export shape keys as morph targets.",
+        default=False,
+    )
+    use_shape_key_normals: BoolProperty(
+        name="Shape Key Normals",
+        description="Recalculate the normals of every shape key "
+                    "(otherwise the normals of the base mesh are reused).",
+        default=True,
+    )
+    use_shape_key_changed_only: BoolProperty(
+        name="Only Changed Vertices",
+        description="Only recalculate shape key data around the vertices "
+                    "a shape key moves, the rest is copied from the base mesh.",
+        default=False,
+    )
+    use_scene_dump: BoolProperty(
+        name="Write Scene Dump",
+        description="Also write a JSON summary of the exported scene "
+                    "(nodes, meshes, skeletons and tracks) next to the file, "
+                    "for debugging",
+        default=False,
+    )
+    use_compare_dae: BoolProperty(
+        name="Compare With Collada",
+        description="Also write the same scene as Collada to a temporary "
+                    "file and report how long it took and how large it was",
+        default=False,
+    )
+
+    def execute(self, context):
+        if not self.filepath:
+            raise Exception("filepath not set")
+        log.addon.info("Export GLB: %s", self.filepath)
+        keywords = self.as_keywords(ignore=("check_existing",
+                                            "filter_glob",
+                                            ))
+        from . import export_glb
+        return export_glb.save(self, context, **keywords)
+
+
+class BuildPACOperator(bpy.types.Operator):
+    """
+    Builds the stale targets of a PAC targets file, in background Blenders.
+    Blender stays usable meanwhile, Esc cancels the build.
+    """
+
+    bl_idname = "export.pac_build"
+    bl_label = "Build PAC Targets"
+
+    _batch = None
+    _timer = None
+
+    filepath: StringProperty(subtype="FILE_PATH")
+    filter_glob: StringProperty(default="*.json", options={"HIDDEN"})
+
+    jobs: IntProperty(
+        name="Jobs",
+        description="Targets built at the same time (0 builds one per CPU "
+                    "core)",
+        min=0, max=256,
+        default=0,
+    )
+    use_force: BoolProperty(
+        name="Build All",
+        description="Also build the targets that are up to date",
+        default=False,
+    )
+
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        if not self.filepath:
+            return {'CANCELLED'}
+        log.addon.info("Build PAC targets: %s", self.filepath)
+        from . import build
+        try:
+            self._batch = build.Batch(self.filepath, self.jobs,
+                                      self.use_force)
+        except (OSError, ValueError, KeyError) as e:
+            self.report({"ERROR"}, "Can't build {}: {}".format(
+                self.filepath, e))
+            return {'CANCELLED'}
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.25, window=context.window)
+        wm.progress_begin(0, max(len(self._batch.targets), 1))
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self._batch.cancel()
+        elif event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        from . import build
+        finished = self._batch.poll(0)
+        done, total = self._batch.progress()
+        if not finished:
+            context.window_manager.progress_update(done)
+            context.workspace.status_text_set(
+                "Building PAC targets: {} of {} done, Esc to cancel".format(
+                    done, total))
+            return {'PASS_THROUGH'}
+
+        self.end(context)
+        results = self._batch.target_results()
+        self.report({"INFO"}, "PAC targets: " + build.summary(results))
+        if (build.FAILED in results.values() or self._batch.cancelled):
+            return {'CANCELLED'}
+        return {'FINISHED'}
+
+    def cancel(self, context):
+        if (self._batch is None):
+            return
+        self._batch.cancel()
+        while not self._batch.poll():
+            pass
+        self.end(context)
+
+    def end(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        context.workspace.status_text_set(None)
+        self._batch.close()
+
+
+def update_logging(self, context):
+    log.configure(self.log_level, bpy.path.abspath(self.log_file))
+
+
+class PACPreferences(bpy.types.AddonPreferences):
+    """
+    Add-on wide settings, shown in Preferences > Add-ons
+    """
+
+    bl_idname = __name__
+
+    log_level: EnumProperty(
+        name="Log Level",
+        description="Messages below this level are not logged",
+        items=[(level, level.title(), "") for level in log.LEVELS],
+        default="WARNING",
+        update=update_logging,
+    )
+    log_file: StringProperty(
+        name="Log File",
+        description="Also write the log to this file (leave empty to only "
+                    "log to the system console)",
+        subtype="FILE_PATH",
+        default="",
+        update=update_logging,
+    )
+
+    cache_directory: StringProperty(
+        name="Cache Directory",
+        description="Where exports keep data to reuse in later exports "
+                    "(leave empty to use the temporary directory)",
+        subtype="DIR_PATH",
+        default="",
+    )
+    cache_size: IntProperty(
+        name="Cache Size (MiB)",
+        description="The least recently used cache entries are removed "
+                    "above this size, shared by all the caches",
+        min=1,
+        default=512,
+    )
+
+    def draw(self, context):
+        layout = self.layout
+        layout.prop(self, "log_level")
+        layout.prop(self, "log_file")
+        layout.prop(self, "cache_directory")
+        layout.prop(self, "cache_size")
+
+
 def menu_func_dae_export(self, context):
     """
     Gets called when Blender is building the user interface for the File/Export menu
@@ -413,6 +1168,13 @@ def menu_func_dae_export(self, context):
     self.layout.operator(CE_OT_export_dae.bl_idname, text="Better Collada (.dae)")
 
 
+def menu_func_glb_export(self, context):
+    """
+    Gets called when Blender is building the user interface for the File/Export menu
+    """
+    self.layout.operator(CE_OT_export_glb.bl_idname, text="PAC glTF Binary (.glb)")
+
+
 def menu_func_import(self, context):
     """
     Gets called when Blender is building the user interface for the File/Import menu
@@ -427,6 +1189,13 @@ def menu_func_export(self, context):
     self.layout.operator(ExportPACOperator.bl_idname, text="Export PAC")
 
 
+def menu_func_build(self, context):
+    """
+    Gets called when Blender is building the user interface for the File/Export menu
+    """
+    self.layout.operator(BuildPACOperator.bl_idname, text="Build PAC Targets (.json)")
+
+
 def menu_func_clear_console(self, context):
     self.layout.operator(CLEARCONSOLE_OT_clear.bl_idname, text="Clear System Console")
 
@@ -435,14 +1204,27 @@ def menu_func_clear_console(self, context):
 def register():
     from bpy.utils import register_class
 
+    register_class(PACPreferences)
+    preferences = bpy.context.preferences.addons.get(__name__)
+    if preferences is not None:
+        update_logging(preferences.preferences, bpy.context)
+
+    export_tracker.register()
+
     register_class(CE_OT_export_dae)
     bpy.types.TOPBAR_MT_file_export.append(menu_func_dae_export)
 
+    register_class(CE_OT_export_glb)
+    bpy.types.TOPBAR_MT_file_export.append(menu_func_glb_export)
+
     register_class(ImportPACOperator)
     bpy.types.TOPBAR_MT_file_import.append(menu_func_import)
 
     register_class(ExportPACOperator)
     bpy.types.TOPBAR_MT_file_export.append(menu_func_export)
+
+    register_class(BuildPACOperator)
+    bpy.types.TOPBAR_MT_file_export.append(menu_func_build)
     
     register_class(CLEARCONSOLE_OT_clear)
     bpy.types.TOPBAR_MT_file.append(menu_func_clear_console)
@@ -454,15 +1236,25 @@ def unregister():
     unregister_class(CE_OT_export_dae)
     bpy.types.TOPBAR_MT_file_export.remove(menu_func_dae_export)
 
+    unregister_class(CE_OT_export_glb)
+    bpy.types.TOPBAR_MT_file_export.remove(menu_func_glb_export)
+
     unregister_class(ImportPACOperator)
     bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
 
     unregister_class(ExportPACOperator)
     bpy.types.TOPBAR_MT_file_export.remove(menu_func_export)
+
+    unregister_class(BuildPACOperator)
+    bpy.types.TOPBAR_MT_file_export.remove(menu_func_build)
     
     unregister_class(CLEARCONSOLE_OT_clear)
     bpy.types.TOPBAR_MT_file.remove(menu_func_clear_console)
 
+    export_tracker.unregister()
+
+    unregister_class(PACPreferences)
+
 
 if __name__ == "__main__":
     register()
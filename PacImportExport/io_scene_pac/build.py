@@ -0,0 +1,560 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+Batch builds of PAC files from .blend files.
+
+A targets file (JSON) lists what to build, paths are relative to it:
+
+    {
+        "options": {"use_triangles": true},
+        "targets": [
+            {"name": "pbw_body", "blend": "pbw.blend", "scene": "Scene",
+             "collection": "Body", "output": "pac/pbw_body.pac",
+             "pac": "template/pbw_body.pac", "class": "pbw",
+             "options": {"use_weld_vertices": true}}
+        ]
+    }
+
+Only blend and output are required. options are Export PAC operator
+options, on top of its defaults. pac is the PAC whose LODs are replaced,
+the output itself by default; a target whose pac is the output of another
+one is built after it. class defaults to the first three letters of the
+output name, as for the Export PAC operator.
+
+Every target records the digests of what it was built from (the .blend,
+its linked libraries and images, the .pab skeleton, the pactool and the
+input PAC) in <targets file>.state.json, and is only built again when one
+of them, its definition or its output changed. Stale targets are built in
+parallel, each by a background Blender running export_pac.exec. The Build
+PAC Targets operator runs them without blocking Blender, Esc cancels.
+
+From the command line:
+
+    blender -b --python-expr "from io_scene_pac import build; build.main()"
+        -- targets.json [--jobs N] [--force] [target ...]
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from . import file_cache
+from . import log
+
+# Bumped whenever targets must be built again after an update
+BUILD_VERSION = 1
+
+# Target results
+BUILT = "built"
+UP_TO_DATE = "up to date"
+FAILED = "failed"
+SKIPPED = "skipped"
+CANCELLED = "cancelled"
+
+
+class Target:
+    """
+    One PAC to build, with absolute paths
+    """
+
+    __slots__ = ("name", "blend", "scene", "collection", "output", "pac",
+                 "class_abbreviation", "options")
+
+    def __init__(self, name, blend, scene, collection, output, pac,
+                 class_abbreviation, options):
+        self.name = name
+        self.blend = blend
+        self.scene = scene
+        self.collection = collection
+        self.output = output
+        self.pac = pac
+        self.class_abbreviation = class_abbreviation
+        self.options = options
+
+    def spec(self):
+        return {"name": self.name, "blend": self.blend, "scene": self.scene,
+                "collection": self.collection, "output": self.output,
+                "pac": self.pac, "class": self.class_abbreviation,
+                "options": self.options}
+
+    def digest(self):
+        """
+        Digest of the definition of the target
+        """
+        spec = self.spec()
+        spec["options"] = sorted(
+            (key, sorted(value) if isinstance(value, list) else value)
+            for key, value in self.options.items())
+        return file_cache.digest(BUILD_VERSION, sorted(spec.items()))
+
+
+def load_targets(path):
+    """
+    The targets of a targets file, in file order
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    def absolute(name):
+        return os.path.normpath(os.path.join(base, name))
+
+    targets = []
+    for entry in data["targets"]:
+        output = absolute(entry["output"])
+        options = dict(data.get("options", {}))
+        options.update(entry.get("options", {}))
+        targets.append(Target(
+            entry.get("name") or os.path.splitext(os.path.basename(output))[0],
+            absolute(entry["blend"]), entry.get("scene"),
+            entry.get("collection"), output,
+            absolute(entry.get("pac", entry["output"])),
+            entry.get("class") or os.path.basename(output)[:3], options))
+
+    for attr in ("name", "output"):
+        values = [getattr(t, attr) for t in targets]
+        for value in values:
+            if values.count(value) > 1:
+                raise ValueError("Two targets have the {} {}".format(
+                    attr, value))
+    return targets
+
+
+class FileHashes:
+    """
+    Digests of files, only read again when their size or modification time
+    changed. known is kept in the build state between builds.
+    """
+
+    __slots__ = ("known",)
+
+    def __init__(self, known):
+        self.known = known
+
+    def digest(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        entry = self.known.get(path)
+        if (entry is not None and entry[0] == st.st_mtime_ns and
+                entry[1] == st.st_size):
+            return entry[2]
+        value = file_cache.file_digest(path)
+        self.known[path] = [st.st_mtime_ns, st.st_size, value]
+        return value
+
+
+def stale_reason(target, record, hashes):
+    """
+    Why target must be built, or None if it is up to date
+    """
+    if (record is None):
+        return "never built"
+    if (record["target"] != target.digest()):
+        return "definition changed"
+    if not os.path.isfile(target.output):
+        return "output missing"
+    if (hashes.digest(target.output) != record["output"]):
+        return "output changed"
+    for path, value in sorted(record["dependencies"].items()):
+        if (hashes.digest(path) != value):
+            return "{} changed".format(os.path.basename(path))
+    return None
+
+
+def state_path(targets_path):
+    return os.path.abspath(targets_path) + ".state.json"
+
+
+def load_state(targets_path):
+    try:
+        with open(state_path(targets_path), "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    state.setdefault("targets", {})
+    state.setdefault("files", {})
+    return state
+
+
+def save_state(targets_path, state):
+    path = state_path(targets_path)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def worker_command(blender, target, spec_path, result_path):
+    """
+    The command line of a background Blender building target
+    """
+    command = [blender, "-b", "--addons", __package__, target.blend]
+    if target.scene:
+        command += ["-S", target.scene]
+    command += [
+        "--python-exit-code", "1",
+        "--python-expr",
+        "import sys; from {} import build; "
+        "build.work(sys.argv[sys.argv.index('--') + 1:])".format(__package__),
+        "--", spec_path, result_path]
+    return command
+
+
+class Batch:
+    """
+    A build of the stale targets of a targets file, and the ones named in
+    names depend on, by background Blenders in threads. poll() advances it,
+    so it can be driven from a loop or an operator timer.
+    """
+
+    __slots__ = ("targets_path", "targets", "upstream", "force", "blender",
+                 "state", "hashes", "results", "pending", "running", "pool",
+                 "processes", "cancelled")
+
+    def __init__(self, targets_path, jobs=0, force=False, names=None,
+                 blender=None):
+        targets = load_targets(targets_path)
+        if blender is None:
+            import bpy
+            blender = bpy.app.binary_path
+        by_output = {t.output: t for t in targets}
+        upstream = {}
+        for target in targets:
+            producer = by_output.get(target.pac)
+            upstream[target.name] = [] if (
+                producer is None or producer is target) else [producer.name]
+
+        if names:
+            unknown = set(names) - set(t.name for t in targets)
+            if unknown:
+                raise ValueError("Unknown targets: " +
+                                 ", ".join(sorted(unknown)))
+            wanted = set()
+            stack = list(names)
+            while stack:
+                name = stack.pop()
+                if name not in wanted:
+                    wanted.add(name)
+                    stack.extend(upstream[name])
+            targets = [t for t in targets if t.name in wanted]
+
+        self.targets_path = targets_path
+        self.targets = targets
+        self.upstream = upstream
+        self.force = force
+        self.blender = blender
+        self.state = load_state(targets_path)
+        self.hashes = FileHashes(self.state["files"])
+        self.results = {}
+        self.pending = list(targets)
+        self.running = {}
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            jobs or os.cpu_count() or 1)
+        # Worker Blenders by target name, killed by cancel()
+        self.processes = {}
+        self.cancelled = False
+
+    def run_target(self, target):
+        """
+        Builds target in a background Blender, returns the result it wrote
+        """
+        directory = tempfile.mkdtemp(prefix="pac-build-")
+        try:
+            spec_path = os.path.join(directory, "target.json")
+            result_path = os.path.join(directory, "result.json")
+            with open(spec_path, "w", encoding="utf-8") as f:
+                json.dump(target.spec(), f)
+
+            try:
+                process = subprocess.Popen(
+                    worker_command(self.blender, target, spec_path,
+                                   result_path),
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                    universal_newlines=True, errors="replace")
+            except OSError as e:
+                return {"status": FAILED, "dependencies": [],
+                        "output": "Can't run {}: {}".format(self.blender, e)}
+            self.processes[target.name] = process
+            if self.cancelled:
+                process.kill()
+            output = process.communicate()[0]
+            del self.processes[target.name]
+            try:
+                with open(result_path, "r", encoding="utf-8") as f:
+                    result = json.load(f)
+            except (OSError, ValueError):
+                result = {"status": FAILED, "dependencies": []}
+            if (process.returncode != 0):
+                result["status"] = FAILED
+            if (result["status"] != BUILT):
+                result["output"] = output[-4000:]
+            return result
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def start(self):
+        """
+        Starts the targets whose upstream targets have a result
+        """
+        for target in list(self.pending):
+            upstream = self.upstream[target.name]
+            if any(name not in self.results for name in upstream):
+                continue
+            self.pending.remove(target)
+            if any(self.results[name] in (FAILED, SKIPPED, CANCELLED)
+                   for name in upstream):
+                self.results[target.name] = SKIPPED
+                log.addon.warning("%s: skipped, a target it needs failed",
+                                  target.name)
+                continue
+            reason = "forced" if self.force else stale_reason(
+                target, self.state["targets"].get(target.name), self.hashes)
+            if (reason is None):
+                self.results[target.name] = UP_TO_DATE
+                continue
+            log.addon.info("%s: building (%s)", target.name, reason)
+            self.running[self.pool.submit(self.run_target, target)] = target
+
+    def finish(self, target, result):
+        status = result["status"]
+        if (self.cancelled and status != BUILT):
+            status = CANCELLED
+        self.results[target.name] = status
+        if (status == BUILT):
+            self.state["targets"][target.name] = {
+                "target": target.digest(),
+                "output": self.hashes.digest(target.output),
+                "dependencies": {
+                    path: self.hashes.digest(path)
+                    for path in result["dependencies"]},
+            }
+            log.addon.info("%s: built", target.name)
+        else:
+            if (status == FAILED):
+                log.addon.error("%s: failed\n%s", target.name,
+                                result.get("output", ""))
+            self.state["targets"].pop(target.name, None)
+        save_state(self.targets_path, self.state)
+
+    def poll(self, timeout=None):
+        """
+        Starts what can be built and waits up to timeout seconds (None
+        waits) for a running target. True once every target has a result.
+        """
+        self.start()
+        if not self.running:
+            # Only targets that need each other are left
+            for target in self.pending:
+                self.results[target.name] = FAILED
+                log.addon.error("%s: dependency cycle", target.name)
+            self.pending = []
+            return True
+
+        done, not_done = concurrent.futures.wait(
+            self.running, timeout,
+            return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            self.finish(self.running.pop(future), future.result())
+        return not (self.pending or self.running)
+
+    def cancel(self):
+        """
+        Builds nothing more and kills the running builds, poll() returns
+        True once they stopped
+        """
+        self.cancelled = True
+        for target in self.pending:
+            self.results[target.name] = CANCELLED
+        self.pending = []
+        for process in list(self.processes.values()):
+            process.kill()
+
+    def close(self):
+        self.pool.shutdown()
+
+    def progress(self):
+        """
+        (targets with a result, targets)
+        """
+        return len(self.results), len(self.targets)
+
+    def target_results(self):
+        """
+        The result of every target by name
+        """
+        return {target.name: self.results[target.name]
+                for target in self.targets}
+
+
+def build(targets_path, jobs=0, force=False, names=None, blender=None):
+    """
+    Builds the stale targets of a targets file, and the ones named in names
+    depend on. Returns the result of every target by name.
+    """
+    batch = Batch(targets_path, jobs, force, names, blender)
+    try:
+        while not batch.poll():
+            pass
+    finally:
+        batch.close()
+    return batch.target_results()
+
+
+def summary(results):
+    counts = {}
+    for status in results.values():
+        counts[status] = counts.get(status, 0) + 1
+    return ", ".join("{} {}".format(count, status)
+                     for status, count in sorted(counts.items()))
+
+
+def main(argv=None):
+    """
+    Command line entry point, arguments come after "--"
+    """
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(
+        prog="build", description="Builds the stale targets of a PAC "
+                                  "targets file")
+    parser.add_argument("targets_file")
+    parser.add_argument("targets", nargs="*",
+                        help="only build these (and what they need)")
+    parser.add_argument("-j", "--jobs", type=int, default=0,
+                        help="parallel builds (default: one per CPU core)")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="build even up to date targets")
+    parser.add_argument("--blender", help="Blender to build with")
+    args = parser.parse_args(argv)
+
+    log.configure("INFO")
+    results = build(args.targets_file, args.jobs, args.force, args.targets,
+                    args.blender)
+    print(summary(results))
+    if FAILED in results.values():
+        sys.exit(1)
+
+
+# Background Blender side
+
+
+class Reporter:
+    """
+    Stands in for the operator, reports go to the log
+    """
+
+    def report(self, report_type, message):
+        if "ERROR" in report_type:
+            log.addon.error(message)
+        elif "WARNING" in report_type:
+            log.addon.warning(message)
+        else:
+            log.addon.info(message)
+
+
+def operator_defaults():
+    """
+    The options of the Export PAC operator, with their default values. These
+    are the keywords the operator passes to export_pac.exec.
+    """
+    import bpy
+    from . import export_pac
+
+    ignored = ("rna_type", "filepath") + export_pac.IGNORED_PROPERTIES
+    options = {}
+    for prop in bpy.ops.export.pac.get_rna_type().properties:
+        if prop.identifier in ignored:
+            continue
+        if prop.type == "ENUM" and prop.is_enum_flag:
+            options[prop.identifier] = set(prop.default_flag)
+        elif getattr(prop, "is_array", False):
+            options[prop.identifier] = tuple(prop.default_array)
+        else:
+            options[prop.identifier] = prop.default
+    return options
+
+
+def dependencies(spec):
+    """
+    The files the open .blend builds a target from
+    """
+    import bpy
+    from . import export_pac
+
+    paths = [bpy.data.filepath]
+    paths.extend(bpy.path.abspath(library.filepath)
+                 for library in bpy.data.libraries)
+    for image in bpy.data.images:
+        if (image.source in {"FILE", "SEQUENCE", "TILED"} and
+                image.packed_file is None and image.filepath):
+            paths.append(bpy.path.abspath(image.filepath,
+                                          library=image.library))
+    paths.extend(export_pac.pactool_paths(spec["class"]))
+    if spec["pac"] != spec["output"]:
+        paths.append(spec["pac"])
+    return sorted(set(os.path.normpath(os.path.abspath(p)) for p in paths))
+
+
+def work(argv):
+    """
+    Builds the target of a spec file in the open .blend and writes the
+    result file
+    """
+    import bpy
+    from . import export_pac
+
+    spec_path, result_path = argv
+    with open(spec_path, "r", encoding="utf-8") as f:
+        spec = json.load(f)
+    log.configure("INFO")
+
+    status = FAILED
+    try:
+        options = operator_defaults()
+        for key, value in spec["options"].items():
+            if key not in options:
+                raise ValueError("Not an Export PAC option: {}".format(key))
+            if isinstance(options[key], set):
+                value = set(value)
+            options[key] = value
+
+        if spec["collection"]:
+            objects = bpy.data.collections[spec["collection"]].all_objects
+            for obj in bpy.context.view_layer.objects:
+                obj.select_set(obj.name in objects)
+            options["use_export_selected"] = True
+
+        os.makedirs(os.path.dirname(spec["output"]), exist_ok=True)
+        if spec["pac"] != spec["output"]:
+            shutil.copyfile(spec["pac"], spec["output"])
+
+        result = export_pac.exec(
+            spec["output"], Reporter(), bpy.context,
+            class_abbreviation=spec["class"], **options)
+        if "FINISHED" in result:
+            status = BUILT
+    except Exception:
+        log.addon.exception("Building %s failed", spec["name"])
+
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump({"status": status, "dependencies": dependencies(spec)}, f)
@@ -0,0 +1,130 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+A minimal streaming zip writer for Collada .zae archives.
+
+zipfile compresses entries itself, but the document is already deflated
+section by section while it is exported, so entries are written here
+directly: a local header, the deflate data and a data descriptor with the
+CRC and sizes, which only need to be known once the data has been written.
+"""
+
+import struct
+import zlib
+
+# Read size when compressing files into the archive
+CHUNK = 1024 * 1024
+
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_DATA_DESCRIPTOR = struct.Struct("<IIII")
+_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_END_RECORD = struct.Struct("<IHHHHIIH")
+
+_VERSION = 20
+# Sizes and CRC follow the data, names are UTF-8
+_FLAGS = 0x0008 | 0x0800
+_DEFLATED = 8
+# 1980-01-01 00:00, so archives of the same scene are identical
+_DOS_TIME = 0
+_DOS_DATE = (1 << 5) | 1
+
+_LIMIT = 0xFFFFFFFF
+
+
+class ZipWriter:
+    """
+    Writes deflated entries to a binary file object, in order
+    """
+
+    __slots__ = ("f", "offset", "entries")
+
+    def __init__(self, f):
+        self.f = f
+        self.offset = 0
+        self.entries = []
+
+    def _write(self, data):
+        self.f.write(data)
+        self.offset += len(data)
+
+    def add_stream(self, name, write):
+        """
+        Adds an entry whose deflate data is written by write(f), which must
+        return the CRC-32 and size of the uncompressed data
+        """
+        encoded = name.encode("utf-8")
+        header_offset = self.offset
+        self._write(_LOCAL_HEADER.pack(
+            0x04034b50, _VERSION, _FLAGS, _DEFLATED, _DOS_TIME, _DOS_DATE,
+            0, 0, 0, len(encoded), 0))
+        self._write(encoded)
+
+        start = self.f.tell()
+        crc, size = write(self.f)
+        compressed_size = self.f.tell() - start
+        self.offset += compressed_size
+        if size > _LIMIT or compressed_size > _LIMIT or self.offset > _LIMIT:
+            raise ValueError(
+                "\"{}\" is too large for a .zae archive (4 GiB)".format(name))
+
+        self._write(_DATA_DESCRIPTOR.pack(
+            0x08074b50, crc, compressed_size, size))
+        self.entries.append(
+            (encoded, crc, compressed_size, size, header_offset))
+
+    def add_bytes(self, name, data, level=6):
+        def write(f):
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+            f.write(compressor.compress(data))
+            f.write(compressor.flush())
+            return zlib.crc32(data), len(data)
+
+        self.add_stream(name, write)
+
+    def add_file(self, name, path, level=6):
+        def write(f):
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+            crc = 0
+            size = 0
+            with open(path, "rb") as src:
+                while True:
+                    data = src.read(CHUNK)
+                    if not data:
+                        break
+                    crc = zlib.crc32(data, crc)
+                    size += len(data)
+                    f.write(compressor.compress(data))
+            f.write(compressor.flush())
+            return crc, size
+
+        self.add_stream(name, write)
+
+    def close(self):
+        """
+        Writes the central directory. The file object is not closed.
+        """
+        directory_offset = self.offset
+        for name, crc, compressed_size, size, header_offset in self.entries:
+            self._write(_CENTRAL_HEADER.pack(
+                0x02014b50, _VERSION, _VERSION, _FLAGS, _DEFLATED, _DOS_TIME,
+                _DOS_DATE, crc, compressed_size, size, len(name), 0, 0, 0, 0,
+                0, header_offset))
+            self._write(name)
+        self._write(_END_RECORD.pack(
+            0x06054b50, 0, 0, len(self.entries), len(self.entries),
+            self.offset - directory_offset, directory_offset, 0))
@@ -0,0 +1,232 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+Accounts for the size of an exported Collada document.
+
+The exporter tells the budget about every line it writes, which owner
+(node, mesh, material or animation track) the line belongs to, and which
+attribute the large arrays are. The report breaks the document down by
+section, owner, attribute and animation clip, to find what makes a file
+large without reading it.
+
+Sizes are uncompressed UTF-8 bytes. Arrays encoded by worker processes are
+futures, which are only measured once the report is built.
+"""
+
+import contextlib
+
+# Owner kinds
+DOCUMENT = "document"
+NODE = "node"
+MESH = "mesh"
+MATERIAL = "material"
+TRACK = "track"
+
+
+def _size(text):
+    """
+    Bytes of a str, bytes or future resolving to bytes
+    """
+    if isinstance(text, bytes):
+        return len(text)
+    if isinstance(text, str):
+        # isascii() is a flag lookup, arrays are always ASCII
+        return len(text) if text.isascii() else len(text.encode("utf-8"))
+    return len(text.result())
+
+
+def _human(size):
+    if size < 1048576:
+        return "{:.1f} KiB".format(size / 1024.0)
+    return "{:.1f} MiB".format(size / 1048576.0)
+
+
+class Counter:
+    """
+    Bytes and lines (or values, for attributes) of something written
+    """
+
+    __slots__ = ("size", "count", "sections")
+
+    def __init__(self):
+        self.size = 0
+        self.count = 0
+        self.sections = {}
+
+    def add(self, size, count, section=None):
+        self.size += size
+        self.count += count
+        if (section is not None):
+            self.sections[section] = self.sections.get(section, 0) + size
+
+
+class Budget:
+    """
+    Sizes of the lines written, per section (any hashable key, named
+    through section_names), per owner and per attribute
+    """
+
+    __slots__ = ("section_names", "newline", "stack", "sections", "owners",
+                 "attributes", "pending")
+
+    def __init__(self, section_names, newline):
+        self.section_names = section_names
+        self.newline = len(newline)
+        self.stack = [(DOCUMENT, "", None)]
+        self.sections = {}
+        self.owners = {}
+        self.attributes = {}
+        self.pending = []
+
+    @contextlib.contextmanager
+    def owner(self, kind, name, detail=None):
+        """
+        Charges the lines written inside the with block to an owner. detail
+        further splits owners, such as the tracks of an animation clip.
+        """
+        self.stack.append((kind, name, detail))
+        try:
+            yield
+        finally:
+            self.stack.pop()
+
+    def counter(self, table, key):
+        counter = table.get(key)
+        if counter is None:
+            counter = table[key] = Counter()
+        return counter
+
+    def line(self, section, parts):
+        """
+        Counts a line made of strings and futures
+        """
+        size = self.newline
+        futures = []
+        for part in parts:
+            if isinstance(part, str):
+                size += _size(part)
+            else:
+                futures.append(part)
+
+        section_counter = self.counter(self.sections, section)
+        owner_counter = self.counter(self.owners, self.stack[-1])
+        section_counter.add(size, 1)
+        owner_counter.add(size, 1, section)
+        for future in futures:
+            self.pending.append((future, section_counter, None))
+            self.pending.append((future, owner_counter, section))
+
+    def discard(self, sections):
+        """
+        Forgets sections that were removed from the document
+        """
+        for section in sections:
+            counter = self.sections.pop(section, None)
+            if (counter is None):
+                continue
+            for owner in self.owners.values():
+                owner.size -= owner.sections.pop(section, 0)
+
+    def attribute(self, name, count, values):
+        """
+        Counts count values of an attribute, encoded as values: text, a
+        future or a list of them
+        """
+        counter = self.counter(self.attributes, name)
+        counter.add(0, count)
+        if not isinstance(values, list):
+            values = [values]
+        for part in values:
+            if isinstance(part, str):
+                counter.add(_size(part), 0)
+            else:
+                self.pending.append((part, counter, None))
+
+    def resolve(self):
+        """
+        Adds the sizes of the futures, which must be done
+        """
+        for future, counter, section in self.pending:
+            counter.add(_size(future), 0, section)
+        self.pending = []
+
+    def table(self, counters, count_name="lines", sections=False):
+        rows = {}
+        for key, counter in sorted(counters, key=lambda kv: -kv[1].size):
+            row = {"bytes": counter.size, count_name: counter.count}
+            if (sections and counter.sections):
+                row["sections"] = {
+                    self.section_names[s]: size
+                    for s, size in sorted(counter.sections.items())}
+            rows[key] = row
+        return rows
+
+    def report(self):
+        """
+        Returns the breakdown as JSON serializable values
+        """
+        self.resolve()
+
+        owners = {}
+        clips = {}
+        for owner, counter in self.owners.items():
+            kind, name = owner[:2]
+            if (kind == TRACK):
+                clips.setdefault(name, []).append((owner[2], counter))
+            else:
+                owners.setdefault(kind, []).append((name, counter))
+
+        result = {
+            "bytes": sum(c.size for c in self.sections.values()),
+            "sections": {
+                self.section_names[s]: {"bytes": c.size, "lines": c.count}
+                for s, c in sorted(self.sections.items())},
+        }
+        for kind, key in ((NODE, "nodes"), (MESH, "meshes"),
+                          (MATERIAL, "materials")):
+            result[key] = self.table(owners.get(kind, []), sections=True)
+        # Library tags, asset and scene elements
+        result["other"] = self.table(
+            owners.get(DOCUMENT, []), sections=True).get("", {})
+        result["attributes"] = self.table(
+            self.attributes.items(), "values")
+        result["clips"] = {}
+        for name, tracks in clips.items():
+            result["clips"][name] = {
+                "bytes": sum(c.size for target, c in tracks),
+                "tracks": self.table(tracks),
+            }
+        return result
+
+
+def summary(report, count=3):
+    """
+    One line naming the largest sections, meshes and attributes of a report
+    """
+    def largest(rows):
+        items = sorted(rows.items(), key=lambda kv: -kv[1]["bytes"])
+        return ", ".join("{} {}".format(name, _human(row["bytes"]))
+                         for name, row in items[:count] if row["bytes"])
+
+    parts = ["{} of text".format(_human(report["bytes"]))]
+    for title, key in (("sections", "sections"), ("meshes", "meshes"),
+                       ("attributes", "attributes"), ("clips", "clips")):
+        text = largest(report[key])
+        if text:
+            parts.append("largest {}: {}".format(title, text))
+    return "; ".join(parts)
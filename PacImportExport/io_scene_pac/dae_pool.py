@@ -0,0 +1,132 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+Encodes large arrays in a pool of worker processes.
+
+Turning extracted arrays into text doesn't need bpy, so it can run in other
+processes while the exporter keeps reading the scene. Arrays are pickled to
+the workers, which return the encoded text as futures. The section writer
+puts those futures in place as they complete, so the document is the same
+as when encoding serially.
+
+Workers are spawned, not forked, and can't import this add-on (its
+__init__ needs bpy), so they only import dae_encoder as a top level
+module from the add-on directory.
+"""
+
+import collections
+import concurrent.futures
+import importlib.util
+import multiprocessing
+import os
+import site
+import sys
+
+import numpy as np
+
+from . import dae_encoder
+
+# Arrays with fewer values are encoded right away, the round trip to a
+# worker would cost more than encoding them
+MIN_VALUES = 16384
+
+# Futures in flight per worker before the exporter waits for the oldest
+IN_FLIGHT_PER_WORKER = 8
+
+
+def _worker_module():
+    """
+    Returns dae_encoder loaded as a top level module, which is how its
+    functions are pickled for the workers
+    """
+    module = sys.modules.get("dae_encoder")
+    if module is None:
+        spec = importlib.util.spec_from_file_location(
+            "dae_encoder", dae_encoder.__file__)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["dae_encoder"] = module
+        spec.loader.exec_module(module)
+    return module
+
+
+class EncoderPool:
+    """
+    Same methods as dae_encoder.Encoder, returning either text or, for
+    large arrays, a future resolving to the UTF-8 encoded text
+    """
+
+    __slots__ = ("encoder", "settings", "workers", "executor", "in_flight",
+                 "submitted")
+
+    def __init__(self, encoder, workers=0):
+        self.encoder = encoder
+        self.settings = (encoder.mode, encoder.precision, encoder.fixed_width)
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = None
+        self.in_flight = collections.deque()
+        self.submitted = 0
+
+    def submit(self, kind, values, *args):
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                self.workers, multiprocessing.get_context("spawn"),
+                site.addsitedir,
+                (os.path.dirname(os.path.abspath(dae_encoder.__file__)),))
+
+        # Limit the arrays and text waiting in memory
+        while len(self.in_flight) >= self.workers * IN_FLIGHT_PER_WORKER:
+            self.in_flight.popleft().result()
+
+        future = self.executor.submit(
+            _worker_module().encode, self.settings, kind, values, *args)
+        self.in_flight.append(future)
+        self.submitted += 1
+        return future
+
+    def floats(self, a, precision=None, mode=None):
+        values = np.asarray(a)
+        if values.size < MIN_VALUES:
+            return self.encoder.floats(values, precision, mode)
+        return self.submit("floats", values, precision, mode)
+
+    def exact(self, a):
+        values = np.asarray(a)
+        if values.size < MIN_VALUES:
+            return self.encoder.exact(values)
+        return self.submit("exact", values)
+
+    def ints(self, a):
+        values = np.asarray(a)
+        if values.size < MIN_VALUES:
+            return self.encoder.ints(values)
+        return self.submit("ints", values)
+
+    def matrices(self, mtxs, digits=None):
+        values = np.array([np.array(m) for m in mtxs], dtype=np.float64)
+        if values.size < MIN_VALUES:
+            return self.encoder.matrices(values, digits)
+        return self.submit("matrices", values, digits)
+
+    def matrix(self, mtx, digits=None):
+        return self.encoder.matrix(mtx, digits)
+
+    def shutdown(self, cancel=False):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=cancel)
+            self.executor = None
+        self.in_flight.clear()
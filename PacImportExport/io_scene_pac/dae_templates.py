@@ -0,0 +1,130 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+Templates for the Collada elements that are written over and over: sources
+with their accessor, input sets and animation samplers.
+
+Each template is a list of (depth, text) lines. It is compiled once per
+indentation level into a single format string, so writing a whole source
+costs one format() call. In compact mode templates are compiled without
+tabs or newlines.
+"""
+
+SOURCE = (
+    (0, "<source id=\"{id}\">"),
+    (1, "<{array} id=\"{id}-array\" count=\"{count}\">{values}</{array}>"),
+    (1, "<technique_common>"),
+    (2, "{accessor}"),
+    (1, "</technique_common>"),
+    (0, "</source>"),
+)
+
+ACCESSOR = (
+    (0, "<accessor source=\"{source}\" count=\"{count}\" "
+        "stride=\"{stride}\">"),
+    (1, "{params}"),
+    (0, "</accessor>"),
+)
+
+SAMPLER = (
+    (0, "<sampler id=\"{id}-sampler\">"),
+    (1, "<input semantic=\"INPUT\" source=\"#{id}-input\"/>"),
+    (1, "<input semantic=\"OUTPUT\" source=\"#{id}-transform-output\"/>"),
+    (1, "<input semantic=\"INTERPOLATION\" "
+        "source=\"#{id}-interpolation-output\"/>"),
+    (0, "</sampler>"),
+)
+
+PARAM = "<param name=\"{}\" type=\"{}\"/>"
+
+INPUT = "<input semantic=\"{}\" source=\"#{}\"/>"
+INPUT_OFFSET = "<input semantic=\"{}\" source=\"#{}\" offset=\"{}\"/>"
+INPUT_SET = "<input semantic=\"{}\" source=\"#{}\" offset=\"{}\" set=\"{}\"/>"
+
+
+class Templates:
+    """
+    Compiled templates for one output mode. Methods return the text of an
+    element whose first line is not indented, for writel to indent.
+    """
+
+    __slots__ = ("compact", "tab", "compiled")
+
+    def __init__(self, compact=False):
+        self.compact = compact
+        self.tab = "" if compact else "\t"
+        self.compiled = {}
+
+    def separator(self, indent):
+        """
+        What goes between two lines at the given indentation
+        """
+        if self.compact:
+            return ""
+        return "\n" + self.tab * indent
+
+    def compile(self, template, indent):
+        key = (template, indent)
+        fmt = self.compiled.get(key)
+        if fmt is None:
+            lines = [
+                self.separator(indent + depth) + text
+                for depth, text in template]
+            # The first line is indented by writel
+            lines[0] = template[0][1]
+            fmt = "".join(lines)
+            self.compiled[key] = fmt
+        return fmt
+
+    def accessor(self, indent, source, count, stride, params,
+                 param_type="float"):
+        params = self.separator(indent + 1).join(
+            PARAM.format(p, param_type) for p in params)
+        return self.compile(ACCESSOR, indent).format(
+            source=source, count=count, stride=stride, params=params)
+
+    def source(self, indent, source_id, values, count, stride, params,
+               param_type="float", array="float_array"):
+        """
+        A source of count elements of stride values each. values is the
+        already encoded text of the array.
+        """
+        accessor = self.accessor(
+            indent + 2, "#{}-array".format(source_id), count, stride, params,
+            param_type)
+        return self.compile(SOURCE, indent).format(
+            id=source_id, array=array, count=count * stride, values=values,
+            accessor=accessor)
+
+    def inputs(self, indent, inputs):
+        """
+        A list of (semantic, source id, offset or None, set or None)
+        """
+        lines = []
+        for semantic, source, offset, input_set in inputs:
+            if offset is None:
+                lines.append(INPUT.format(semantic, source))
+            elif input_set is None:
+                lines.append(INPUT_OFFSET.format(semantic, source, offset))
+            else:
+                lines.append(
+                    INPUT_SET.format(semantic, source, offset, input_set))
+        return self.separator(indent).join(lines)
+
+    def sampler(self, indent, anim_id):
+        return self.compile(SAMPLER, indent).format(id=anim_id)
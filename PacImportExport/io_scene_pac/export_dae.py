@@ -25,13 +25,27 @@ http://www.khronos.org/collada/
 """
 
 import os
+import sys
 import time
+import contextlib
 import math
+import re
 import shutil
+import tempfile
+import json
 import bpy
-import bmesh
-from mathutils import Vector, Matrix
-from bpy_extras import node_shader_utils
+import numpy as np
+from . import dae_archive
+from . import dae_budget
+from . import dae_encoder
+from . import dae_pool
+from . import dae_templates
+from . import export_tracker
+from . import file_cache
+from . import log
+from . import scene_extract
+from . import scene_ir
+from . import section_writer
 
 # According to collada spec, order matters
 S_ASSET = 0
@@ -48,24 +62,120 @@ S_ANIM_CLIPS = 10
 S_NODES = 11
 S_ANIM = 12
 
-CMP_EPSILON = 0.0001
-
-
-def snap_tup(tup):
-    ret = ()
-    for x in tup:
-        ret += (x - math.fmod(x, 0.0001), )
-
-    return tup
-
-
-def strmtx(mtx):
-    s = ""
-    for x in range(4):
-        for y in range(4):
-            s += "{} ".format(mtx[x][y])
-    s = " {} ".format(s)
-    return s
+# Characters replaced in ids made from names. "-" separates the ids of
+# elements from the ids derived from them, such as "<id>-positions".
+INVALID_ID_CHARS = re.compile(r"[^A-Za-z0-9_.]")
+
+# Section names in size reports
+SECTION_NAMES = {
+    S_ASSET: "asset",
+    S_IMGS: "images",
+    S_FX: "effects",
+    S_MATS: "materials",
+    S_GEOM: "geometries",
+    S_MORPH: "morph_controllers",
+    S_SKIN: "skin_controllers",
+    S_CONT: "controllers",
+    S_CAMS: "cameras",
+    S_LAMPS: "lights",
+    S_ANIM_CLIPS: "animation_clips",
+    S_NODES: "visual_scenes",
+    S_ANIM: "animations",
+}
+
+# Sections the geometry cache keeps the lines of a mesh from
+FRAGMENT_SECTIONS = (S_GEOM, S_MORPH, S_SKIN)
+# Stand-in for the n-th id of a cached fragment, "\0" is never written
+FRAGMENT_ID = re.compile("\0([0-9]+)\0")
+
+OUTPUT_EXTENSIONS = {
+    "DAE": ".dae",
+    "DAE_GZ": ".dae.gz",
+    "ZAE": ".zae",
+}
+
+SECTION_COMPRESSION = {
+    "DAE": None,
+    "DAE_GZ": section_writer.GZIP,
+    "ZAE": section_writer.DEFLATE,
+}
+
+
+def output_path(filepath, output_format):
+    """
+    Replaces the extension of filepath, if it is one of the output formats,
+    with the one of output_format
+    """
+    lower = filepath.lower()
+    for ext in sorted(OUTPUT_EXTENSIONS.values(), key=len, reverse=True):
+        if lower.endswith(ext):
+            filepath = filepath[:-len(ext)]
+            break
+    return filepath + OUTPUT_EXTENSIONS[output_format]
+
+
+def source_date_epoch():
+    """
+    The time written instead of the current one without timestamps:
+    SOURCE_DATE_EPOCH, as for reproducible builds, or else 0
+    """
+    try:
+        return int(os.environ.get("SOURCE_DATE_EPOCH", 0))
+    except ValueError:
+        return 0
+
+
+def track_name(track):
+    """
+    The bone, node or shape key a track animates, for size reports
+    """
+    if (track.kind == scene_ir.MORPH):
+        return "{}/{}".format(
+            track.target.name, track.target.morph_targets[track.index].name)
+    return track.target.name
+
+
+class GeometryFragment:
+    """
+    The lines a mesh wrote to the geometry, morph and skin sections, with
+    the (type, name, id) of the ids made for them and the largest rounding
+    errors of their arrays
+    """
+
+    __slots__ = ("ids", "lines", "errors")
+
+    def __init__(self):
+        self.ids = []
+        self.lines = []
+        self.errors = {}
+
+    def entry(self):
+        """
+        The fragment as JSON serializable values, with each id replaced by
+        its index. Waits for the arrays still being encoded.
+        """
+        lines = []
+        for section, parts in self.lines:
+            # Futures of the encoder pool resolve to UTF-8 text
+            text = "".join(
+                part if isinstance(part, str) else
+                part.result().decode("utf-8") for part in parts)
+            lines.append([section, text])
+
+        if self.ids:
+            index = {new_id: i
+                     for i, (t, name, new_id) in enumerate(self.ids)}
+            # Ids followed by "-" are the base of derived ids
+            pattern = re.compile(
+                "(?<![A-Za-z0-9_.-])({})(?![A-Za-z0-9_.])".format(
+                    "|".join(re.escape(i) for i in
+                             sorted(index, key=len, reverse=True))))
+            for line in lines:
+                line[1] = pattern.sub(
+                    lambda m: "\0{}\0".format(index[m.group(1)]), line[1])
+
+        return {"ids": [[t, name] for t, name, new_id in self.ids],
+                "lines": lines, "errors": self.errors}
 
 
 def numarr(a, mult=1.0):
@@ -86,12 +196,47 @@ def numarr_alpha(a, mult=1.0):
     return s
 
 
-def strarr(arr):
-    s = " "
-    for x in arr:
-        s += " {}".format(x)
-    s += " "
-    return s
+def peak_rss():
+    """
+    Returns the peak resident set size of the process in bytes, or None if
+    it can not be queried on this platform
+    """
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD),
+                        ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t),
+                        ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t),
+                        ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        try:
+            process = ctypes.windll.kernel32.GetCurrentProcess()
+            if not ctypes.windll.psapi.GetProcessMemoryInfo(
+                    process, ctypes.byref(counters), counters.cb):
+                return None
+        except (AttributeError, OSError):
+            return None
+        return counters.PeakWorkingSetSize
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform == "darwin":
+        return rss
+    return rss * 1024
 
 
 class DaeExporter:
@@ -101,69 +246,102 @@ class DaeExporter:
             return "z{}".format(d)
         return d
 
-    def new_id(self, t):
-        self.last_id += 1
-        return "id-{}-{}".format(t, self.last_id)
-
-    class Vertex:
-
-        def close_to(self, v):
-            if self.vertex - v.vertex.length() > CMP_EPSILON:
-                return False
-            if self.normal - v.normal.length() > CMP_EPSILON:
-                return False
-            if self.uv - v.uv.length() > CMP_EPSILON:
-                return False
-            if self.uv2 - v.uv2.length() > CMP_EPSILON:
-                return False
-
-            return True
-
-        def get_tup(self):
-            tup = (self.vertex.x, self.vertex.y, self.vertex.z, self.normal.x,
-                   self.normal.y, self.normal.z)
-            for t in self.uv:
-                tup = tup + (t.x, t.y)
-            if self.color is not None:
-                tup = tup + (self.color.x, self.color.y, self.color.z, self.color.w)
-            if self.tangent is not None:
-                tup = tup + (self.tangent.x, self.tangent.y, self.tangent.z)
-            if self.bitangent is not None:
-                tup = tup + (self.bitangent.x, self.bitangent.y,
-                             self.bitangent.z)
-            for t in self.bones:
-                tup = tup + (float(t), )
-            for t in self.weights:
-                tup = tup + (float(t), )
-
-            return tup
-
-        __slots__ = ("vertex", "normal", "tangent", "bitangent", "color", "uv",
-                     "uv2", "bones", "weights")
-
-        def __init__(self):
-            self.vertex = Vector((0.0, 0.0, 0.0))
-            self.normal = Vector((0.0, 0.0, 0.0))
-            self.tangent = None
-            self.bitangent = None
-            self.color = None
-            self.uv = []
-            self.uv2 = Vector((0.0, 0.0))
-            self.bones = []
-            self.weights = []
+    def new_id(self, t, name):
+        """
+        Returns a new id for an element of type t. With stable ids it is
+        made from name, so it doesn't depend on what was exported before.
+        """
+        if (self.used_ids is None):
+            self.last_id += 1
+            new_id = "id-{}-{}".format(t, self.last_id)
+            if (self.recording is not None):
+                self.recording.ids.append((t, name, new_id))
+            return new_id
+
+        base = "id-{}-{}".format(t, INVALID_ID_CHARS.sub("_", name))
+        new_id = base
+        while (new_id in self.used_ids):
+            self.used_ids[base] += 1
+            new_id = "{}.{}".format(base, self.used_ids[base])
+        self.used_ids[new_id] = 1
+        if (self.recording is not None):
+            self.recording.ids.append((t, name, new_id))
+        return new_id
 
     def writel(self, section, indent, text):
-        if (not (section in self.sections)):
-            self.sections[section] = []
-        line = "{}{}".format(indent * "\t", text)
-        self.sections[section].append(line)
+        line = indent * self.templates.tab + text
+        if (self.budget is not None):
+            self.budget.line(section, (line,))
+        if (self.recording is not None and section in FRAGMENT_SECTIONS):
+            self.recording.lines.append((section, [line]))
+        self.sections.write(section, line)
+
+    def write_parts(self, section, indent, parts):
+        """
+        Writes a line made of text and of futures from the encoder pool
+        """
+        if all(isinstance(part, str) for part in parts):
+            self.writel(section, indent, "".join(parts))
+        else:
+            parts = list(parts)
+            parts[0] = indent * self.templates.tab + parts[0]
+            if (self.budget is not None):
+                self.budget.line(section, parts)
+            if (self.recording is not None and section in FRAGMENT_SECTIONS):
+                self.recording.lines.append((section, parts))
+            self.sections.write_parts(section, parts)
+
+    def write_source(self, section, indent, source_id, values, count, stride,
+                     params, param_type="float", array="float_array"):
+        if isinstance(values, str):
+            self.writel(section, indent, self.templates.source(
+                indent, source_id, values, count, stride, params, param_type,
+                array))
+        else:
+            before, after = self.templates.source(
+                indent, source_id, "\0", count, stride, params, param_type,
+                array).split("\0")
+            self.write_parts(section, indent, [before, values, after])
+
+    def write_inputs(self, section, indent, inputs):
+        self.writel(section, indent, self.templates.inputs(indent, inputs))
+
+    def attribute(self, kind, a):
+        """
+        Encodes the floats of a dae_encoder kind (POSITION, NORMAL...) with
+        the precision of that kind, if set. Without one, weights are written
+        exactly, like matrices.
+        """
+        if (self.quantizer is None):
+            if (kind == dae_encoder.WEIGHT):
+                return self.encoder.exact(a)
+            return self.encoder.floats(a)
+        values, places, mode = self.quantizer.floats(kind, a)
+        return self.encoder.floats(values, places, mode)
+
+    def transforms(self, mtxs):
+        if (self.quantizer is None):
+            return self.encoder.matrices(mtxs)
+        values, digits = self.quantizer.matrices(mtxs)
+        return self.encoder.matrices(values, digits)
 
     def purge_empty_nodes(self):
-        sections = {}
-        for k, v in self.sections.items():
-            if not (len(v) == 2 and v[0][1:] == v[1][2:]):
-                sections[k] = v
-        self.sections = sections
+        purged = self.sections.purge_empty_nodes()
+        if (self.budget is not None):
+            self.budget.discard(purged)
+
+    def owner(self, kind, name, detail=None):
+        """
+        Charges the lines written in a with block to an owner of the size
+        report
+        """
+        if (self.budget is None):
+            return contextlib.nullcontext()
+        return self.budget.owner(kind, name, detail)
+
+    def count_attribute(self, name, count, values):
+        if (self.budget is not None):
+            self.budget.attribute(name, count, values)
 
     def export_image(self, image):
         img_id = self.image_cache.get(image)
@@ -171,11 +349,18 @@ class DaeExporter:
             return img_id
 
         imgpath = image.filepath
+        datablock = image.datablock
         if imgpath.startswith("//"):
             imgpath = bpy.path.abspath(imgpath)
-            print("exporting image path", imgpath)
-        if (self.config["use_copy_images"]):
-            basedir = os.path.join(os.path.dirname(self.path), "images")
+        archive = self.config["output_format"] == "ZAE"
+        if (self.config["use_copy_images"] or archive):
+            # Archived images are gathered in a temporary directory
+            if (archive):
+                if (self.image_dir is None):
+                    self.image_dir = tempfile.mkdtemp(prefix="zae-")
+                basedir = self.image_dir
+            else:
+                basedir = os.path.join(os.path.dirname(self.path), "images")
             if (not os.path.isdir(basedir)):
                 os.makedirs(basedir)
 
@@ -186,23 +371,27 @@ class DaeExporter:
                     shutil.copy(imgpath, dstfile)
                 imgpath = os.path.join("images", os.path.basename(imgpath))
             else:
-                img_tmp_path = image.filepath
+                img_tmp_path = datablock.filepath
                 if img_tmp_path.lower().endswith(
                     tuple(bpy.path.extensions_image)):
-                    image.filepath = os.path.join(
+                    datablock.filepath = os.path.join(
                         basedir, os.path.basename(img_tmp_path))
                 else:
-                    image.filepath = os.path.join(
+                    datablock.filepath = os.path.join(
                         basedir, "{}.png".format(image.name))
 
                 dstfile = os.path.join(
-                    basedir, os.path.basename(image.filepath))
+                    basedir, os.path.basename(datablock.filepath))
 
                 if not os.path.isfile(dstfile):
-                    image.save()
+                    datablock.save()
                 imgpath = os.path.join(
-                    "images", os.path.basename(image.filepath))
-                image.filepath = img_tmp_path
+                    "images", os.path.basename(datablock.filepath))
+                datablock.filepath = img_tmp_path
+
+            imgpath = imgpath.replace("\\", "/")
+            if (archive):
+                self.archive_images[imgpath] = dstfile
 
         
         else:
@@ -213,9 +402,9 @@ class DaeExporter:
                 # TODO: Review, not sure why it fails
                 pass
         
-        imgid = self.new_id("image")
+        imgid = self.new_id("image", image.name)
 
-        print("FOR: {}".format(imgpath))
+        log.material.debug("Image %s: %s", image.name, imgpath)
 
         self.writel(S_IMGS, 1, "<image id=\"{}\" name=\"{}\">".format(
             imgid, image.name))
@@ -224,12 +413,12 @@ class DaeExporter:
         self.image_cache[image] = imgid
         return imgid
 
-    def export_material(self, material, double_sided_hint=True):
+    def export_material(self, material):
         material_id = self.material_cache.get(material)
         if material_id:
             return material_id
 
-        fxid = self.new_id("fx")
+        fxid = self.new_id("fx", material.name)
         self.writel(S_FX, 1, "<effect id=\"{}\" name=\"{}-fx\">".format(
             fxid, material.name))
         self.writel(S_FX, 2, "<profile_COMMON>")
@@ -241,52 +430,42 @@ class DaeExporter:
         emission_tex = None
         normal_tex = None
         
-        #TODO, use Blender 2.8 principled shader and connected maps
-        mat_wrap = node_shader_utils.PrincipledBSDFWrapper(material) if material else None
-        
-        if mat_wrap:
-            textures_keys = ["base_color_texture", "specular_texture", "normalmap_texture"]
-            
-            for i, tkey in enumerate(textures_keys):
-                tex = getattr(mat_wrap, tkey, None)
-                if tex == None:
-                    continue
-                if tex.image == None:
-                    continue
-
-                # Image
-                imgid = self.export_image(tex.image)
-                
-                # Surface
-                surface_sid = self.new_id("fx_surf")
-                self.writel(S_FX, 3, "<newparam sid=\"{}\">".format(surface_sid))
-                self.writel(S_FX, 4, "<surface type=\"2D\">")
-                self.writel(S_FX, 5, "<init_from>{}</init_from>".format(imgid))
-                self.writel(S_FX, 5, "<format>A8R8G8B8</format>")
-                self.writel(S_FX, 4, "</surface>")
-                self.writel(S_FX, 3, "</newparam>")
-                
-                # Sampler
-                sampler_sid = self.new_id("fx_sampler")
-                self.writel(S_FX, 3, "<newparam sid=\"{}\">".format(sampler_sid))
-                self.writel(S_FX, 4, "<sampler2D>")
-                self.writel(S_FX, 5, "<source>{}</source>".format(surface_sid))
-                self.writel(S_FX, 4, "</sampler2D>")
-                self.writel(S_FX, 3, "</newparam>")
-                sampler_table[i] = sampler_sid
-                
-                if tkey == "base_color_texture" and diffuse_tex is None:
-                    diffuse_tex = sampler_sid
-                if tkey == "specular_texture" and specular_tex is None:
-                    specular_tex = sampler_sid
-                """
-                # TODO differently, no emission input in the principled shader
-                if ts.use_map_emit and emission_tex is None:
-                    emission_tex = sampler_sid
-                """
-                if tkey == "normalmap_texture" and normal_tex is None:
-                    normal_tex = sampler_sid
-        
+        for i, (tkey, image) in enumerate(material.textures):
+            # Image
+            imgid = self.export_image(image)
+
+            # Surface
+            surface_sid = self.new_id(
+                "fx_surf", "{}-{}".format(material.name, i))
+            self.writel(S_FX, 3, "<newparam sid=\"{}\">".format(surface_sid))
+            self.writel(S_FX, 4, "<surface type=\"2D\">")
+            self.writel(S_FX, 5, "<init_from>{}</init_from>".format(imgid))
+            self.writel(S_FX, 5, "<format>A8R8G8B8</format>")
+            self.writel(S_FX, 4, "</surface>")
+            self.writel(S_FX, 3, "</newparam>")
+
+            # Sampler
+            sampler_sid = self.new_id(
+                "fx_sampler", "{}-{}".format(material.name, i))
+            self.writel(S_FX, 3, "<newparam sid=\"{}\">".format(sampler_sid))
+            self.writel(S_FX, 4, "<sampler2D>")
+            self.writel(S_FX, 5, "<source>{}</source>".format(surface_sid))
+            self.writel(S_FX, 4, "</sampler2D>")
+            self.writel(S_FX, 3, "</newparam>")
+            sampler_table[i] = sampler_sid
+
+            if tkey == "base_color_texture" and diffuse_tex is None:
+                diffuse_tex = sampler_sid
+            if tkey == "specular_texture" and specular_tex is None:
+                specular_tex = sampler_sid
+            """
+            # TODO differently, no emission input in the principled shader
+            if ts.use_map_emit and emission_tex is None:
+                emission_tex = sampler_sid
+            """
+            if tkey == "normalmap_texture" and normal_tex is None:
+                normal_tex = sampler_sid
+
         """
         for i in range(len(material.texture_slots)):
             ts = material.texture_slots[i]
@@ -411,7 +590,7 @@ class DaeExporter:
         self.writel(S_FX, 5, "</technique>")
         self.writel(S_FX, 5, "<technique profile=\"GOOGLEEARTH\">")
         self.writel(S_FX, 6, "<double_sided>{}</double_sided>".format(
-            int(double_sided_hint)))
+            int(material.double_sided)))
         self.writel(S_FX, 5, "</technique>")
     
         """
@@ -427,7 +606,7 @@ class DaeExporter:
         self.writel(S_FX, 1, "</effect>")
 
         # Material (if active)
-        matid = self.new_id("material")
+        matid = self.new_id("material", material.name)
         self.writel(S_MATS, 1, "<material id=\"{}\" name=\"{}\">".format(
             matid, material.name))
         self.writel(S_MATS, 2, "<instance_effect url=\"#{}\"/>".format(fxid))
@@ -436,715 +615,351 @@ class DaeExporter:
         self.material_cache[material] = matid
         return matid
 
-    def export_mesh(self, node, armature=None, skeyindex=-1, skel_source=None,
-                    custom_name=None):
-        mesh = node.data
-        
-        if (node.data in self.mesh_cache):
-            return self.mesh_cache[mesh]
-
-        if (skeyindex == -1 and mesh.shape_keys is not None and len(
-                mesh.shape_keys.key_blocks) and self.config["use_shape_key_export"]):
-            values = []
-            morph_targets = []
-            md = None
-            for k in range(0, len(mesh.shape_keys.key_blocks)):
-                shape = node.data.shape_keys.key_blocks[k]
-                values += [shape.value]
-                shape.value = 0
-
-            mid = self.new_id("morph")
-
-            for k in range(0, len(mesh.shape_keys.key_blocks)):
-                shape = node.data.shape_keys.key_blocks[k]
-                node.show_only_shape_key = True
-                node.active_shape_key_index = k
-                shape.value = 1.0
-                mesh.update()
-                p = node.data
-                
-                armature_modifier = None            
-                armature_modifier_state = None
-                
-                if(self.config["use_exclude_armature_modifier"]):
-                    armature_modifiers = [i for i in node.modifiers if i.type == "ARMATURE"]
-                    armature_modifier = armature_modifiers[0]#node.modifiers.get("Armature")
-
-                if(armature_modifier):  
-                    # the armature modifier must be disabled too
-                    armature_modifier_state = armature_modifier.show_viewport
-                    armature_modifier.show_viewport = False         
-                
-                print(node)
-                v = node.to_mesh(preserve_all_data_layers=True, depsgraph=bpy.context.evaluated_depsgraph_get()) 
-                print(v)
-                # Warning, Blender 2.8 does not support anymore the "RENDER" argument to apply modifier
-                # with render state only...
-                
-                armature_modifier.show_viewport = armature_modifier_state
-                
-                self.temp_meshes.add(v)
-                deps = bpy.context.evaluated_depsgraph_get()
-                evaluated_node = node.evaluated_get(deps)
-                evaluated_node.data = v
-                evaluated_node.data.update()
-                if (armature and k == 0):                   
-                    md = self.export_mesh(evaluated_node, armature, k, mid, shape.name)
-                else:                   
-                    md = self.export_mesh(evaluated_node, None, k, None, shape.name)
-
-                node.data = p
-                node.data.update()
-                shape.value = 0.0
-                morph_targets.append(md)
-
-            node.show_only_shape_key = False
-            node.active_shape_key_index = 0
+    def export_geometry(self, meshid, name, vertex_count, sources, inputs,
+                        surfaces, prim_type, attribute_prefix=""):
+        """
+        Writes a <geometry> from already encoded vertex sources.
 
-            self.writel(
-                S_MORPH, 1, "<controller id=\"{}\" name=\"\">".format(mid))
-            self.writel(
-                S_MORPH, 2,
-                "<morph source=\"#{}\" method=\"NORMALIZED\">".format(
-                    morph_targets[0]["id"]))
+        sources is a list of (name, values, params) with positions first,
+        inputs a list of (semantic, source name, set or None) and surfaces a
+        list of (material symbol or None, primitive count, index lists,
+        index count). The size report counts the sources as attribute_prefix
+        followed by their name.
+        """
+        self.writel(
+            S_GEOM, 1, "<geometry id=\"{}\" name=\"{}\">".format(
+                meshid, name))
 
-            self.writel(
-                S_MORPH, 3, "<source id=\"{}-morph-targets\">".format(mid))
-            self.writel(
-                S_MORPH, 4,
-                "<IDREF_array id=\"{}-morph-targets-array\" "
-                "count=\"{}\">".format(mid, len(morph_targets) - 1))
-            marr = ""
-            warr = ""
-            for i in range(len(morph_targets)):
-                if (i == 0):
-                    continue
-                elif (i > 1):
-                    marr += " "
-
-                if ("skin_id" in morph_targets[i]):
-                    marr += morph_targets[i]["skin_id"]
-                else:
-                    marr += morph_targets[i]["id"]
+        self.writel(S_GEOM, 2, "<mesh>")
 
-                warr += " 0"
+        for source, values, params in sources:
+            self.write_source(
+                S_GEOM, 3, "{}-{}".format(meshid, source), values,
+                vertex_count, len(params), params)
+            self.count_attribute(
+                attribute_prefix + source, vertex_count * len(params), values)
 
-            self.writel(S_MORPH, 5, marr)
-            self.writel(S_MORPH, 4, "</IDREF_array>")
-            self.writel(S_MORPH, 4, "<technique_common>")
-            self.writel(
-                S_MORPH, 5, "<accessor source=\"#{}-morph-targets-array\" "
-                "count=\"{}\" stride=\"1\">".format(
-                    mid, len(morph_targets) - 1))
-            self.writel(
-                S_MORPH, 6, "<param name=\"MORPH_TARGET\" type=\"IDREF\"/>")
-            self.writel(S_MORPH, 5, "</accessor>")
-            self.writel(S_MORPH, 4, "</technique_common>")
-            self.writel(S_MORPH, 3, "</source>")
+        # Triangle Lists
+        self.writel(S_GEOM, 3, "<vertices id=\"{}-vertices\">".format(meshid))
+        self.write_inputs(S_GEOM, 4, [
+            ("POSITION", "{}-{}".format(meshid, sources[0][0]), None, None)])
+        self.writel(S_GEOM, 3, "</vertices>")
 
-            self.writel(
-                S_MORPH, 3, "<source id=\"{}-morph-weights\">".format(mid))
-            self.writel(
-                S_MORPH, 4,
-                "<float_array id=\"{}-morph-weights-array\" count=\"{}\" >"
-                .format(mid, len(morph_targets) - 1))
-            self.writel(S_MORPH, 5, warr)
-            self.writel(S_MORPH, 4, "</float_array>")
-            self.writel(S_MORPH, 4, "<technique_common>")
-            self.writel(
-                S_MORPH, 5,
-                "<accessor source=\"#{}-morph-weights-array\" "
-                "count=\"{}\" stride=\"1\">".format(
-                    mid, len(morph_targets) - 1))
-            self.writel(
-                S_MORPH, 6, "<param name=\"MORPH_WEIGHT\" type=\"float\"/>")
-            self.writel(S_MORPH, 5, "</accessor>")
-            self.writel(S_MORPH, 4, "</technique_common>")
-            self.writel(S_MORPH, 3, "</source>")
+        surface_inputs = [
+            ("VERTEX", "{}-vertices".format(meshid), 0, None)]
+        for semantic, source, input_set in inputs:
+            surface_inputs.append(
+                (semantic, "{}-{}".format(meshid, source), 0, input_set))
 
-            self.writel(S_MORPH, 3, "<targets>")
-            self.writel(
-                S_MORPH, 4, "<input semantic=\"MORPH_TARGET\" "
-                "source=\"#{}-morph-targets\"/>".format(mid))
-            self.writel(
-                S_MORPH, 4, "<input semantic=\"MORPH_WEIGHT\" "
-                "source=\"#{}-morph-weights\"/>".format(mid))
-            self.writel(S_MORPH, 3, "</targets>")
-            self.writel(S_MORPH, 2, "</morph>")
-            self.writel(S_MORPH, 1, "</controller>")
-            if armature is not None:
-
-                self.armature_for_morph[node] = armature
-
-            meshdata = {}
-            if (armature):
-                meshdata = morph_targets[0]
-                meshdata["morph_id"] = mid
+        for matref, count, indices, index_count in surfaces:
+            if (matref is not None):
+                self.writel(
+                    S_GEOM, 3, "<{} count=\"{}\" material=\"{}\">".format(
+                        prim_type, count, matref))
             else:
-                meshdata["id"] = morph_targets[0]["id"]
-                meshdata["morph_id"] = mid
-                meshdata["material_assign"] = morph_targets[
-                    0]["material_assign"]
-
-            self.mesh_cache[node.data] = meshdata
-            return meshdata
-
-
-        armature_modifier = None
-        armature_poses = None
-        armature_modifier_state = None
-        
-        if(self.config["use_exclude_armature_modifier"]):
-            armature_modifiers = [i for i in node.modifiers if i.type == "ARMATURE"]
-            if len(armature_modifiers) > 0:
-                print(node.name)            
-                armature_modifier = armature_modifiers[0]#node.modifiers.get("Armature")
-
-        # Set armature in rest pose
-        if(armature_modifier):  
-            # the armature modifier must be disabled too
-            armature_modifier_state = armature_modifier.show_viewport
-            armature_modifier.show_viewport = False         
-            #doing this per object is inefficient, should be improved, maybe?
-            armature_poses = [arm.pose_position for arm in bpy.data.armatures]
-            for arm in bpy.data.armatures:
-                arm.pose_position = "REST"
-
-        apply_modifiers = len(node.modifiers) and self.config[
-            "use_mesh_modifiers"]
-
-        name_to_use = mesh.name
-        if (custom_name is not None and custom_name != ""):
-            name_to_use = custom_name
-
-        mesh:bpy.types.Mesh = node.to_mesh(preserve_all_data_layers=False, depsgraph=bpy.context.evaluated_depsgraph_get()) 
-        # 2.8 update: warning, Blender does not support anymore the "RENDER" argument to apply modifier
-        # with render state, only current state
-        
-        # Restore armature and modifier state
-        if(armature_modifier):          
-            armature_modifier.show_viewport = armature_modifier_state           
-            for i,arm in enumerate(bpy.data.armatures):
-                arm.pose_position = armature_poses[i]
-                
-
-
-        self.temp_meshes.add(mesh)
-        triangulate = self.config["use_triangles"]
-        if (triangulate):
-            bm = bmesh.new()
-            bm.from_mesh(mesh)
-            bmesh.ops.triangulate(bm, faces=bm.faces)
-            bm.to_mesh(mesh)
-            bm.free()
-
-        #mesh.update(calc_tessface=True)# 2.79
-        #mesh.update(calc_edges=False, calc_edges_loose=False, calc_loop_triangles=True)# 2.80
-        mesh.update(calc_edges=False, calc_edges_loose=False)# 3.0.1
-        vertices = []
-        vertex_map = {}
-        surface_indices = {}
-        materials = {}
-
-        materials = {}
-
-        si = None
-        if armature is not None:
-            si = self.skeleton_info[armature]
-
-        # TODO: Implement automatic tangent detection
-        has_tangents = self.config["use_tangent_arrays"]
-
-        #has_colors = len(mesh.vertex_colors)
-        has_colors = len(mesh.color_attributes)
-        mat_assign = []
+                self.writel(S_GEOM, 3, "<{} count=\"{}\">".format(
+                    prim_type, count))
 
-        uv_layer_count = len(mesh.uv_layers)
-        if has_tangents and len(mesh.uv_layers):
-            try:
-                mesh.calc_tangents()
-            except:
-                self.operator.report(
-                    {"WARNING"},
-                    "CalcTangets failed for mesh \"{}\", no tangets will be "
-                    "exported.".format(mesh.name))
-                mesh.calc_normals_split()
-                has_tangents = False
+            self.write_inputs(S_GEOM, 4, surface_inputs)
 
-        else:
-            mesh.calc_normals_split()
-            has_tangents = False
-
-        for fi in range(len(mesh.polygons)):
-            f = mesh.polygons[fi]
-
-            if not (f.material_index in surface_indices):
-                surface_indices[f.material_index] = []
-
-                try:
-                    # TODO: Review, understand why it throws
-                    mat = mesh.materials[f.material_index]
-                except:
-                    mat = None
-                
-                if (mat is not None):               
-                    materials[f.material_index] = self.export_material(
-                        mat, True)#True = deprecated mesh.show_double_sided value, which is removed from Blender 2.8
-                else:
-                    materials[f.material_index] = None
-
-            indices = surface_indices[f.material_index]
-            vi = []
-
-            for lt in range(f.loop_total):
-                loop_index = f.loop_start + lt
-                ml:bpy.types.MeshLoop = mesh.loops[loop_index]
-                mv:bpy.types.MeshVertex = mesh.vertices[ml.vertex_index]
-
-                v = self.Vertex()
-                v.vertex = Vector(mv.co)
-
-                for xt in mesh.uv_layers:
-                    v.uv.append(Vector(xt.data[loop_index].uv))
-
-                if (has_colors):
-                    #v.color = Vector(mesh.vertex_colors[0].data[loop_index].color) # deprecated
-                    v.color = Vector(mesh.color_attributes[0].data[loop_index].color)
-
-                v.normal = Vector(ml.normal)
-
-                if (has_tangents):
-                    v.tangent = Vector(ml.tangent)
-                    v.bitangent = Vector(ml.bitangent)
-                    if (ml.bitangent_sign < 0): # flip bitangents back
-                        v.bitangent = v.bitangent * ml.bitangent_sign
-
-                if armature is not None:
-                    wsum = 0.0
-
-                    for vg in mv.groups:
-                        if vg.group >= len(node.vertex_groups):
-                            continue
-                        name = node.vertex_groups[vg.group].name
-
-                        if (name in si["bone_index"]):
-                            # TODO: Try using 0.0001 since Blender uses
-                            #       zero weight
-                            if (vg.weight > 0.001):
-                                v.bones.append(si["bone_index"][name])
-                                v.weights.append(vg.weight)
-                                wsum += vg.weight
-                    if (wsum == 0.0):
-                        if not self.wrongvtx_report:
-                            self.operator.report(
-                                {"WARNING"},
-                                "Mesh for object \"{}\" has unassigned "
-                                "weights. This may look wrong in exported "
-                                "model.".format(node.name))
-                            self.wrongvtx_report = True
-
-                        # TODO: Explore how to deal with zero-weight bones,
-                        #       which remain local
-                        v.bones.append(0)
-                        v.weights.append(1)
-
-                tup = v.get_tup()
-                idx = 0
-                # Do not optmize if using shapekeys
-                if (skeyindex == -1 and tup in vertex_map):
-                    idx = vertex_map[tup]
-                else:
-                    idx = len(vertices)
-                    vertices.append(v)
-                    vertex_map[tup] = idx
+            for p in indices:
+                self.write_parts(S_GEOM, 4, ["<p>", p, " </p>"])
+            self.count_attribute(
+                attribute_prefix + "indices", index_count, indices)
 
-                vi.append(idx)
+            self.writel(S_GEOM, 3, "</{}>".format(prim_type))
 
-            if (len(vi) > 2):  # Only triangles and above
-                indices.append(vi)
+        self.writel(S_GEOM, 2, "</mesh>")
+        self.writel(S_GEOM, 1, "</geometry>")
 
-        meshid = self.new_id("mesh")
-        self.writel(
-            S_GEOM, 1, "<geometry id=\"{}\" name=\"{}\">".format(
-                meshid, name_to_use))
+    def export_morph(self, mesh, mid, base_id, sources, inputs, surfaces):
+        """
+        Writes one morph target per shape key and the morph controller.
 
-        self.writel(S_GEOM, 2, "<mesh>")
+        Targets reuse the topology, index buffer and attributes of the base
+        mesh, only the positions and normals that differ are written again.
+        """
+        morph_targets = []
+
+        for target in mesh.morph_targets:
+            target_sources = list(sources)
+
+            if (target.positions is not None):
+                target_sources[0] = (
+                    "positions",
+                    self.attribute(dae_encoder.POSITION, target.positions),
+                    ("X", "Y", "Z"))
+            if (target.normals is not None):
+                target_sources[1] = (
+                    "normals",
+                    self.attribute(dae_encoder.NORMAL, target.normals),
+                    ("X", "Y", "Z"))
+
+            target_id = self.new_id(
+                "mesh", "{}-{}".format(mesh.name, target.name))
+            self.export_geometry(
+                target_id, target.name, mesh.vertex_count, target_sources,
+                inputs, surfaces, mesh.primitive, "morph-")
+            morph_targets.append(target_id)
 
-        # Vertex Array
-        self.writel(S_GEOM, 3, "<source id=\"{}-positions\">".format(meshid))
-        float_values = ""
-        for v in vertices:
-            float_values += " {:.8f} {:.8f} {:.8f}".format(
-                v.vertex.x, v.vertex.y, v.vertex.z)
-        self.writel(
-            S_GEOM, 4, "<float_array id=\"{}-positions-array\" "
-            "count=\"{}\">{}</float_array>".format(
-                meshid, len(vertices) * 3, float_values))
-        self.writel(S_GEOM, 4, "<technique_common>")
         self.writel(
-            S_GEOM, 4, "<accessor source=\"#{}-positions-array\" "
-            "count=\"{}\" stride=\"3\">".format(meshid, len(vertices)))
-        self.writel(S_GEOM, 5, "<param name=\"X\" type=\"float\"/>")
-        self.writel(S_GEOM, 5, "<param name=\"Y\" type=\"float\"/>")
-        self.writel(S_GEOM, 5, "<param name=\"Z\" type=\"float\"/>")
-        self.writel(S_GEOM, 4, "</accessor>")
-        self.writel(S_GEOM, 4, "</technique_common>")
-        self.writel(S_GEOM, 3, "</source>")
-
-        # Normals Array
-        self.writel(S_GEOM, 3, "<source id=\"{}-normals\">".format(meshid))
-        float_values = ""
-        for v in vertices:
-            float_values += " {:.8f} {:.8f} {:.8f}".format(
-                v.normal.x, v.normal.y, v.normal.z)
+            S_MORPH, 1, "<controller id=\"{}\" name=\"\">".format(mid))
         self.writel(
-            S_GEOM, 4, "<float_array id=\"{}-normals-array\" "
-            "count=\"{}\">{}</float_array>".format(
-                meshid, len(vertices) * 3, float_values))
-        self.writel(S_GEOM, 4, "<technique_common>")
-        self.writel(
-            S_GEOM, 4, "<accessor source=\"#{}-normals-array\" count=\"{}\" "
-            "stride=\"3\">".format(meshid, len(vertices)))
-        self.writel(S_GEOM, 5, "<param name=\"X\" type=\"float\"/>")
-        self.writel(S_GEOM, 5, "<param name=\"Y\" type=\"float\"/>")
-        self.writel(S_GEOM, 5, "<param name=\"Z\" type=\"float\"/>")
-        self.writel(S_GEOM, 4, "</accessor>")
-        self.writel(S_GEOM, 4, "</technique_common>")
-        self.writel(S_GEOM, 3, "</source>")
-
-        if (has_tangents):
-            self.writel(
-                S_GEOM, 3, "<source id=\"{}-tangents\">".format(meshid))
-            float_values = ""
-            for v in vertices:
-                float_values += " {:.8f} {:.8f} {:.8f}".format(
-                    v.tangent.x, v.tangent.y, v.tangent.z)
-            self.writel(
-                S_GEOM, 4, "<float_array id=\"{}-tangents-array\" "
-                "count=\"{}\">{}</float_array>".format(
-                    meshid, len(vertices) * 3, float_values))
-            self.writel(S_GEOM, 4, "<technique_common>")
-            self.writel(
-                S_GEOM, 4, "<accessor source=\"#{}-tangents-array\" "
-                "count=\"{}\" stride=\"3\">".format(meshid, len(vertices)))
-            self.writel(S_GEOM, 5, "<param name=\"X\" type=\"float\"/>")
-            self.writel(S_GEOM, 5, "<param name=\"Y\" type=\"float\"/>")
-            self.writel(S_GEOM, 5, "<param name=\"Z\" type=\"float\"/>")
-            self.writel(S_GEOM, 4, "</accessor>")
-            self.writel(S_GEOM, 4, "</technique_common>")
-            self.writel(S_GEOM, 3, "</source>")
-
-            self.writel(S_GEOM, 3, "<source id=\"{}-bitangents\">".format(
-                meshid))
-            float_values = ""
-            for v in vertices:
-                float_values += " {:.8f} {:.8f} {:.8f}".format(
-                    v.bitangent.x, v.bitangent.y, v.bitangent.z)
-            self.writel(
-                S_GEOM, 4, "<float_array id=\"{}-bitangents-array\" "
-                "count=\"{}\">{}</float_array>".format(
-                    meshid, len(vertices) * 3, float_values))
-            self.writel(S_GEOM, 4, "<technique_common>")
-            self.writel(
-                S_GEOM, 4, "<accessor source=\"#{}-bitangents-array\" "
-                "count=\"{}\" stride=\"3\">".format(meshid, len(vertices)))
-            self.writel(S_GEOM, 5, "<param name=\"X\" type=\"float\"/>")
-            self.writel(S_GEOM, 5, "<param name=\"Y\" type=\"float\"/>")
-            self.writel(S_GEOM, 5, "<param name=\"Z\" type=\"float\"/>")
-            self.writel(S_GEOM, 4, "</accessor>")
-            self.writel(S_GEOM, 4, "</technique_common>")
-            self.writel(S_GEOM, 3, "</source>")
-
-        # UV Arrays
-        for uvi in range(uv_layer_count):
-            self.writel(S_GEOM, 3, "<source id=\"{}-texcoord-{}\">".format(
-                meshid, uvi))
-            float_values = ""
-            for v in vertices:
-                try:
-                    float_values += " {:.8f} {:.8f}".format(v.uv[uvi].x, v.uv[uvi].y)
-                except:
-                    # TODO: Review, understand better the multi-uv-layer API
-                    float_values += " 0 0 "
+            S_MORPH, 2,
+            "<morph source=\"#{}\" method=\"NORMALIZED\">".format(base_id))
+
+        self.write_source(
+            S_MORPH, 3, "{}-morph-targets".format(mid),
+            "".join(" " + t for t in morph_targets), len(morph_targets), 1,
+            ["MORPH_TARGET"], "IDREF", "IDREF_array")
+        self.write_source(
+            S_MORPH, 3, "{}-morph-weights".format(mid),
+            " 0" * len(morph_targets), len(morph_targets), 1,
+            ["MORPH_WEIGHT"])
+
+        self.writel(S_MORPH, 3, "<targets>")
+        self.write_inputs(S_MORPH, 4, [
+            ("MORPH_TARGET", "{}-morph-targets".format(mid), None, None),
+            ("MORPH_WEIGHT", "{}-morph-weights".format(mid), None, None)])
+        self.writel(S_MORPH, 3, "</targets>")
+        self.writel(S_MORPH, 2, "</morph>")
+        self.writel(S_MORPH, 1, "</controller>")
+
+    def export_skin(self, skin, contid, source_id, vertex_count):
+        skeleton = skin.skeleton
+
+        self.writel(S_SKIN, 1, "<controller id=\"{}\">".format(contid))
+        self.writel(S_SKIN, 2, "<skin source=\"#{}\">".format(source_id))
 
-            self.writel(
-                S_GEOM, 4, "<float_array id=\"{}-texcoord-{}-array\" "
-                "count=\"{}\">{}</float_array>".format(
-                    meshid, uvi, len(vertices) * 2, float_values))
-            self.writel(S_GEOM, 4, "<technique_common>")
-            self.writel(
-                S_GEOM, 4, "<accessor source=\"#{}-texcoord-{}-array\" "
-                "count=\"{}\" stride=\"2\">".format(
-                    meshid, uvi, len(vertices)))
-            self.writel(S_GEOM, 5, "<param name=\"S\" type=\"float\"/>")
-            self.writel(S_GEOM, 5, "<param name=\"T\" type=\"float\"/>")
-            self.writel(S_GEOM, 4, "</accessor>")
-            self.writel(S_GEOM, 4, "</technique_common>")
-            self.writel(S_GEOM, 3, "</source>")
-
-        # Color Arrays
-        if (has_colors):
-            self.writel(S_GEOM, 3, "<source id=\"{}-colors\">".format(meshid))
-            float_values = ""
-            for v in vertices:
-                float_values += " {:.8f} {:.8f} {:.8f} {:.8f}".format(
-                    v.color.x, v.color.y, v.color.z, v.color.w)
-            self.writel(
-                S_GEOM, 4, "<float_array id=\"{}-colors-array\" "
-                "count=\"{}\">{}</float_array>".format(
-                    meshid, len(vertices) * 4, float_values))
-            self.writel(S_GEOM, 4, "<technique_common>")
-            self.writel(
-                S_GEOM, 4, "<accessor source=\"#{}-colors-array\" "
-                "count=\"{}\" stride=\"4\">".format(meshid, len(vertices)))
-            self.writel(S_GEOM, 5, "<param name=\"R\" type=\"float\"/>")
-            self.writel(S_GEOM, 5, "<param name=\"G\" type=\"float\"/>")
-            self.writel(S_GEOM, 5, "<param name=\"B\" type=\"float\"/>")
-            self.writel(S_GEOM, 5, "<param name=\"A\" type=\"float\"/>")
-            self.writel(S_GEOM, 4, "</accessor>")
-            self.writel(S_GEOM, 4, "</technique_common>")
-            self.writel(S_GEOM, 3, "</source>")
-
-        # Triangle Lists
-        self.writel(S_GEOM, 3, "<vertices id=\"{}-vertices\">".format(meshid))
         self.writel(
-            S_GEOM, 4,
-            "<input semantic=\"POSITION\" source=\"#{}-positions\"/>".format(
-                meshid))
-        self.writel(S_GEOM, 3, "</vertices>")
-
-        prim_type = ""
-        if (triangulate):
-            prim_type = "triangles"
-        else:
-            prim_type = "polygons"
+            S_SKIN, 3, "<bind_shape_matrix>{}</bind_shape_matrix>".format(
+                self.transforms([skin.bind_shape_matrix])))
+        # Joint Names
+        self.write_source(
+            S_SKIN, 3, "{}-joints".format(contid),
+            "".join(" " + b.name for b in skeleton.bones),
+            len(skeleton.bones), 1, ["JOINT"], "Name", "Name_array")
+        # Pose Matrices!
+        bind_poses = self.transforms([b.bind_pose for b in skeleton.bones])
+        self.write_source(
+            S_SKIN, 3, "{}-bind_poses".format(contid), bind_poses,
+            len(skeleton.bones), 16, ["TRANSFORM"], "float4x4")
+        self.count_attribute("bind_poses", len(skeleton.bones) * 16,
+                             bind_poses)
+        # Skin Weights!
+        influences = skin.bones >= 0
+        skin_weights_total = int(influences.sum())
+        weights = self.attribute(dae_encoder.WEIGHT, skin.weights[influences])
+        self.write_source(
+            S_SKIN, 3, "{}-skin_weights".format(contid), weights,
+            skin_weights_total, 1, ["WEIGHT"])
+        self.count_attribute("weights", skin_weights_total, weights)
+
+        self.writel(S_SKIN, 3, "<joints>")
+        self.write_inputs(S_SKIN, 4, [
+            ("JOINT", "{}-joints".format(contid), None, None),
+            ("INV_BIND_MATRIX", "{}-bind_poses".format(contid), None,
+             None)])
+        self.writel(S_SKIN, 3, "</joints>")
+        self.writel(
+            S_SKIN, 3, "<vertex_weights count=\"{}\">".format(
+                vertex_count))
+        self.write_inputs(S_SKIN, 4, [
+            ("JOINT", "{}-joints".format(contid), 0, None),
+            ("WEIGHT", "{}-skin_weights".format(contid), 1, None)])
+        vcounts = self.encoder.ints(influences.sum(axis=1))
+        vs = self.encoder.ints(np.column_stack((
+            skin.bones[influences], np.arange(skin_weights_total))))
+        self.write_parts(S_SKIN, 4, ["<vcount>", vcounts, "</vcount>"])
+        self.write_parts(S_SKIN, 4, ["<v>", vs, "</v>"])
+        self.count_attribute("joint_indices", vertex_count + 2 *
+                             skin_weights_total, [vcounts, vs])
+        self.writel(S_SKIN, 3, "</vertex_weights>")
+
+        self.writel(S_SKIN, 2, "</skin>")
+        self.writel(S_SKIN, 1, "</controller>")
+
+    def export_mesh(self, mesh):
+        if (mesh in self.mesh_cache):
+            return self.mesh_cache[mesh]
 
-        for m in surface_indices:
-            indices = surface_indices[m]
-            mat = materials[m]
+        mat_assign = []
 
+        # Materials are exported in the order they are first used
+        materials = []
+        for surface in mesh.surfaces:
+            if (surface.material is not None):
+                with self.owner(dae_budget.MATERIAL, surface.material.name):
+                    materials.append(self.export_material(surface.material))
+            else:
+                materials.append(None)
+
+        if (mesh.fragment is not None):
+            return self.replay_mesh(mesh, materials)
+
+        if (self.geometry_cache is not None and mesh.cache_key is not None):
+            self.begin_fragment()
+
+        meshid = self.new_id("mesh", mesh.name)
+        mid = None
+        if (mesh.morph_targets):
+            mid = self.new_id("morph", mesh.name)
+
+        # Vertex, normal, tangent, UV and color sources, in file order
+        sources = [
+            ("positions",
+             self.attribute(dae_encoder.POSITION, mesh.positions),
+             ("X", "Y", "Z")),
+            ("normals", self.attribute(dae_encoder.NORMAL, mesh.normals),
+             ("X", "Y", "Z"))]
+        inputs = [("NORMAL", "normals", None)]
+
+        if (mesh.tangents is not None):
+            sources.append((
+                "tangents",
+                self.attribute(dae_encoder.NORMAL, mesh.tangents),
+                ("X", "Y", "Z")))
+            sources.append((
+                "bitangents",
+                self.attribute(dae_encoder.NORMAL, mesh.bitangents),
+                ("X", "Y", "Z")))
+
+        for uvi, uv in enumerate(mesh.uvs):
+            sources.append((
+                "texcoord-{}".format(uvi),
+                self.attribute(dae_encoder.UV, uv),
+                ("S", "T")))
+            inputs.append(("TEXCOORD", "texcoord-{}".format(uvi), uvi))
+
+        if (mesh.colors is not None):
+            sources.append((
+                "colors", self.attribute(dae_encoder.COLOR, mesh.colors),
+                ("R", "G", "B", "A")))
+            inputs.append(("COLOR", "colors", None))
+
+        if (mesh.tangents is not None):
+            inputs.append(("TEXTANGENT", "tangents", None))
+            inputs.append(("TEXBINORMAL", "bitangents", None))
+
+        surfaces = []
+        for i, (surface, mat) in enumerate(zip(mesh.surfaces, materials)):
+            matref = None
             if (mat is not None):
-                matref = self.new_id("trimat")
-                self.writel(
-                    S_GEOM, 3, "<{} count=\"{}\" material=\"{}\">".format(
-                        prim_type,
-                        int(len(indices)), matref))  # TODO: Implement material
+                matref = self.new_id(
+                    "trimat", "{}-{}".format(mesh.name, i))
                 mat_assign.append((mat, matref))
-            else:
-                self.writel(S_GEOM, 3, "<{} count=\"{}\">".format(
-                    prim_type, int(len(indices))))  # TODO: Implement material
-
-            self.writel(
-                S_GEOM, 4, "<input semantic=\"VERTEX\" "
-                "source=\"#{}-vertices\" offset=\"0\"/>".format(meshid))
-            self.writel(
-                S_GEOM, 4, "<input semantic=\"NORMAL\" "
-                "source=\"#{}-normals\" offset=\"0\"/>".format(meshid))
 
-            for uvi in range(uv_layer_count):
-                self.writel(
-                    S_GEOM, 4,
-                    "<input semantic=\"TEXCOORD\" source=\"#{}-texcoord-{}\" "
-                    "offset=\"0\" set=\"{}\"/>".format(meshid, uvi, uvi))
-
-            if (has_colors):
-                self.writel(
-                    S_GEOM, 4, "<input semantic=\"COLOR\" "
-                    "source=\"#{}-colors\" offset=\"0\"/>".format(meshid))
-            if (has_tangents):
-                self.writel(
-                    S_GEOM, 4, "<input semantic=\"TEXTANGENT\" "
-                    "source=\"#{}-tangents\" offset=\"0\"/>".format(meshid))
-                self.writel(
-                    S_GEOM, 4, "<input semantic=\"TEXBINORMAL\" "
-                    "source=\"#{}-bitangents\" offset=\"0\"/>".format(meshid))
-
-            if (triangulate):
-                int_values = "<p>"
-                for p in indices:
-                    for i in p:
-                        int_values += " {}".format(i)
-                int_values += " </p>"
-                self.writel(S_GEOM, 4, int_values)
+            if (mesh.primitive == "triangles"):
+                indices = [self.encoder.ints(surface.indices)]
             else:
-                for p in indices:
-                    int_values = "<p>"
-                    for i in p:
-                        int_values += " {}".format(i)
-                    int_values += " </p>"
-                    self.writel(S_GEOM, 4, int_values)
-
-            self.writel(S_GEOM, 3, "</{}>".format(prim_type))
+                indices = [self.encoder.ints(p) for p in surface.faces()]
+            surfaces.append((matref, int(len(surface.sizes)), indices,
+                             int(len(surface.indices))))
 
-        self.writel(S_GEOM, 2, "</mesh>")
-        self.writel(S_GEOM, 1, "</geometry>")
+        self.export_geometry(meshid, mesh.name, mesh.vertex_count, sources,
+                             inputs, surfaces, mesh.primitive)
 
         meshdata = {}
         meshdata["id"] = meshid
         meshdata["material_assign"] = mat_assign
-        if (skeyindex == -1):
-            self.mesh_cache[node.data] = meshdata
+        self.mesh_cache[mesh] = meshdata
+
+        if (mid is not None):
+            self.export_morph(mesh, mid, meshid, sources, inputs, surfaces)
+            meshdata["morph_id"] = mid
 
         # Export armature data (if armature exists)
-        if (armature is not None and (
-                skel_source is not None or skeyindex == -1)):
-            contid = self.new_id("controller")
-
-            self.writel(S_SKIN, 1, "<controller id=\"{}\">".format(contid))
-            if (skel_source is not None):
-                self.writel(S_SKIN, 2, "<skin source=\"#{}\">".format(
-                    skel_source))
+        if (mesh.skin is not None):
+            contid = self.new_id("controller", mesh.name)
+            if (mid is not None):
+                self.export_skin(mesh.skin, contid, mid, mesh.vertex_count)
             else:
-                self.writel(S_SKIN, 2, "<skin source=\"#{}\">".format(meshid))
+                self.export_skin(mesh.skin, contid, meshid, mesh.vertex_count)
+            meshdata["skin_id"] = contid
 
-            self.writel(
-                S_SKIN, 3, "<bind_shape_matrix>{}</bind_shape_matrix>".format(
-                    strmtx(node.matrix_world)))
-            # Joint Names
-            self.writel(S_SKIN, 3, "<source id=\"{}-joints\">".format(contid))
-            name_values = ""
-            for v in si["bone_names"]:
-                name_values += " {}".format(v)
+        if (self.recording is not None):
+            self.end_fragment(mesh)
 
-            self.writel(
-                S_SKIN, 4, "<Name_array id=\"{}-joints-array\" "
-                "count=\"{}\">{}</Name_array>".format(
-                    contid, len(si["bone_names"]), name_values))
-            self.writel(S_SKIN, 4, "<technique_common>")
-            self.writel(
-                S_SKIN, 4, "<accessor source=\"#{}-joints-array\" "
-                "count=\"{}\" stride=\"1\">".format(
-                    contid, len(si["bone_names"])))
-            self.writel(S_SKIN, 5, "<param name=\"JOINT\" type=\"Name\"/>")
-            self.writel(S_SKIN, 4, "</accessor>")
-            self.writel(S_SKIN, 4, "</technique_common>")
-            self.writel(S_SKIN, 3, "</source>")
-            # Pose Matrices!
-            self.writel(S_SKIN, 3, "<source id=\"{}-bind_poses\">".format(
-                contid))
-            pose_values = ""
-            for v in si["bone_bind_poses"]:
-                pose_values += " {}".format(strmtx(v))
+        return meshdata
 
-            self.writel(
-                S_SKIN, 4, "<float_array id=\"{}-bind_poses-array\" "
-                "count=\"{}\">{}</float_array>".format(
-                    contid, len(si["bone_bind_poses"]) * 16, pose_values))
-            self.writel(S_SKIN, 4, "<technique_common>")
-            self.writel(
-                S_SKIN, 4, "<accessor source=\"#{}-bind_poses-array\" "
-                "count=\"{}\" stride=\"16\">".format(
-                    contid, len(si["bone_bind_poses"])))
-            self.writel(
-                S_SKIN, 5, "<param name=\"TRANSFORM\" type=\"float4x4\"/>")
-            self.writel(S_SKIN, 4, "</accessor>")
-            self.writel(S_SKIN, 4, "</technique_common>")
-            self.writel(S_SKIN, 3, "</source>")
-            # Skin Weights!
-            self.writel(S_SKIN, 3, "<source id=\"{}-skin_weights\">".format(
-                contid))
-            skin_weights = ""
-            skin_weights_total = 0
-            for v in vertices:
-                skin_weights_total += len(v.weights)
-                for w in v.weights:
-                    skin_weights += " {}".format(w)
+    def begin_fragment(self):
+        """
+        Starts keeping what a mesh writes for the geometry cache
+        """
+        self.recording = GeometryFragment()
+        if (self.quantizer is not None):
+            # The errors of the whole export wait in the fragment meanwhile
+            self.recording.errors = self.quantizer.errors
+            self.quantizer.errors = {}
+
+    def end_fragment(self, mesh):
+        fragment = self.recording
+        self.recording = None
+        if (self.quantizer is not None):
+            # Swap the errors of the mesh and of the whole export back
+            errors = fragment.errors
+            fragment.errors = self.quantizer.errors
+            self.quantizer.errors = errors
+            self.merge_errors(fragment.errors)
+        self.fragments.append((mesh, fragment))
+
+    def merge_errors(self, errors):
+        for kind, error in errors.items():
+            self.quantizer.errors[kind] = max(
+                self.quantizer.errors.get(kind, 0.0), error)
+
+    def replay_mesh(self, mesh, materials):
+        """
+        Writes the geometry, morph and skin of a mesh found in the geometry
+        cache, with new ids. The size report counts its lines but not its
+        attributes.
+        """
+        fragment = mesh.fragment
+        ids = [self.new_id(t, name) for t, name in fragment["ids"]]
 
-            self.writel(
-                S_SKIN, 4, "<float_array id=\"{}-skin_weights-array\" "
-                "count=\"{}\">{}</float_array>".format(
-                    contid, skin_weights_total, skin_weights))
-            self.writel(S_SKIN, 4, "<technique_common>")
-            self.writel(
-                S_SKIN, 4, "<accessor source=\"#{}-skin_weights-array\" "
-                "count=\"{}\" stride=\"1\">".format(
-                    contid, skin_weights_total))
-            self.writel(S_SKIN, 5, "<param name=\"WEIGHT\" type=\"float\"/>")
-            self.writel(S_SKIN, 4, "</accessor>")
-            self.writel(S_SKIN, 4, "</technique_common>")
-            self.writel(S_SKIN, 3, "</source>")
-
-            self.writel(S_SKIN, 3, "<joints>")
-            self.writel(
-                S_SKIN, 4,
-                "<input semantic=\"JOINT\" source=\"#{}-joints\"/>".format(
-                    contid))
-            self.writel(
-                S_SKIN, 4, "<input semantic=\"INV_BIND_MATRIX\" "
-                "source=\"#{}-bind_poses\"/>".format(contid))
-            self.writel(S_SKIN, 3, "</joints>")
-            self.writel(
-                S_SKIN, 3, "<vertex_weights count=\"{}\">".format(
-                    len(vertices)))
-            self.writel(
-                S_SKIN, 4, "<input semantic=\"JOINT\" "
-                "source=\"#{}-joints\" offset=\"0\"/>".format(contid))
-            self.writel(
-                S_SKIN, 4, "<input semantic=\"WEIGHT\" "
-                "source=\"#{}-skin_weights\" offset=\"1\"/>".format(contid))
-            vcounts = ""
-            vs = ""
-            vcount = 0
-            for v in vertices:
-                vcounts += " {}".format(len(v.weights))
-                for b in v.bones:
-                    vs += " {} {}".format(b, vcount)
-                    vcount += 1
-            self.writel(S_SKIN, 4, "<vcount>{}</vcount>".format(vcounts))
-            self.writel(S_SKIN, 4, "<v>{}</v>".format(vs))
-            self.writel(S_SKIN, 3, "</vertex_weights>")
-
-            self.writel(S_SKIN, 2, "</skin>")
-            self.writel(S_SKIN, 1, "</controller>")
-            meshdata["skin_id"] = contid
+        def restore_id(match):
+            return ids[int(match.group(1))]
 
+        for section, text in fragment["lines"]:
+            self.writel(section, 0, FRAGMENT_ID.sub(restore_id, text))
+
+        meshdata = {}
+        meshdata["material_assign"] = []
+        assigned = iter([mat for mat in materials if mat is not None])
+        for (t, name), new_id in zip(fragment["ids"], ids):
+            if (t == "mesh" and "id" not in meshdata):
+                meshdata["id"] = new_id
+            elif (t == "morph"):
+                meshdata["morph_id"] = new_id
+            elif (t == "controller"):
+                meshdata["skin_id"] = new_id
+            elif (t == "trimat"):
+                meshdata["material_assign"].append((next(assigned), new_id))
+
+        if (self.quantizer is not None):
+            self.merge_errors(fragment["errors"])
+        self.mesh_cache[mesh] = meshdata
         return meshdata
 
+    def store_fragments(self):
+        """
+        Adds the meshes that were written in full to the geometry cache
+        """
+        for mesh, fragment in self.fragments:
+            entry = fragment.entry()
+            entry["vertex_count"] = mesh.vertex_count
+            entry["primitive"] = mesh.primitive
+            entry["slots"] = [surface.slot for surface in mesh.surfaces]
+            entry["morph_targets"] = [t.name for t in mesh.morph_targets]
+            self.geometry_cache.put_json(mesh.cache_key, entry)
+        self.fragments = []
+
     def export_mesh_node(self, node, il):
         if (node.data is None):
             return
 
-        armature = None
-        armcount = 0
-        for n in node.modifiers:
-            if (n.type == "ARMATURE"):
-                if n.object:# make sure the armature modifier is not null
-                    armcount += 1
-
-        if (node.parent is not None):
-            if (node.parent.type == "ARMATURE"):
-                armature = node.parent
-                if (armcount > 1):
-                    self.operator.report(
-                        {"WARNING"}, "Object \"{}\" refers "
-                        "to more than one armature! "
-                        "This is unsupported.".format(node.name))
-                if (armcount == 0):
-                    self.operator.report(
-                        {"WARNING"}, "Object \"{}\" is child "
-                        "of an armature, but has no armature modifier.".format(
-                            node.name))
-
-        if (armcount > 0 and not armature):
-            self.operator.report(
-                {"WARNING"},
-                "Object \"{}\" has armature modifier, but is not a child of "
-                "an armature. This is unsupported.".format(node.name))
-
-        if (node.data.shape_keys is not None):
-            sk = node.data.shape_keys
-            if (sk.animation_data):
-                for d in sk.animation_data.drivers:
-                    if (d.driver):
-                        for v in d.driver.variables:
-                            for t in v.targets:
-                                if (t.id is not None and
-                                        t.id.name in self.scene.objects):
-                                    self.armature_for_morph[
-                                        node] = self.scene.objects[t.id.name]
-        
-    
-        meshdata = self.export_mesh(node, armature)
+        with self.owner(dae_budget.MESH, node.data.name):
+            meshdata = self.export_mesh(node.data)
         close_controller = False
 
         if ("skin_id" in meshdata):
@@ -1152,15 +967,16 @@ class DaeExporter:
             self.writel(
                 S_NODES, il, "<instance_controller url=\"#{}\">".format(
                     meshdata["skin_id"]))
-            for sn in self.skeleton_info[armature]["skeleton_nodes"]:
+            for sn in node.data.skin.skeleton.roots():
                 self.writel(
-                    S_NODES, il + 1, "<skeleton>#{}</skeleton>".format(sn))
+                    S_NODES, il + 1, "<skeleton>#{}</skeleton>".format(
+                        sn.name))
         elif ("morph_id" in meshdata):
             self.writel(
                 S_NODES, il, "<instance_controller url=\"#{}\">".format(
                     meshdata["morph_id"]))
             close_controller = True
-        elif (armature is None):
+        elif (node.skeleton is None):
             self.writel(S_NODES, il, "<instance_geometry url=\"#{}\">".format(
                 meshdata["id"]))
 
@@ -1181,97 +997,35 @@ class DaeExporter:
         else:
             self.writel(S_NODES, il, "</instance_geometry>")
 
-    def export_armature_bone(self, bone, il, si):
-        is_ctrl_bone = (
-            self.config["use_exclude_ctrl_bones"] and
-            (bone.name.startswith("ctrl") or bone.use_deform == False))
-        if (bone.parent is None and is_ctrl_bone is True):
-            self.operator.report(
-                {"WARNING"}, "Root bone cannot be a control bone:"+bone.name)
-            is_ctrl_bone = False
-
-        if (is_ctrl_bone is False):
-            boneid = bone.name
-            boneidx = si["bone_count"]
-            si["bone_count"] += 1
-            bonesid = bone.name
-            if (bone.name in self.used_bones):
-                if (self.config["use_anim_action_all"]):
-                    self.operator.report(
-                        {"WARNING"}, "Bone name \"{}\" used in more than one "
-                        "skeleton. Actions might export wrong.".format(
-                            bone.name))
-            else:
-                self.used_bones.append(bone.name)
-
-            si["bone_index"][bone.name] = boneidx
-            si["bone_ids"][bone] = boneid
-            si["bone_names"].append(bonesid)
-            self.writel(
-                S_NODES, il, "<node id=\"{}\" sid=\"{}\" name=\"{}\" "
-                "type=\"JOINT\">".format(boneid, bonesid, bone.name))
-
-        if (is_ctrl_bone is False):
-            il += 1
-
-        xform = bone.matrix_local
-        if (is_ctrl_bone is False):
-            si["bone_bind_poses"].append(
-                    (si["armature_xform"] @ xform).inverted_safe())
-
-        if (bone.parent is not None):
-            xform = bone.parent.matrix_local.inverted_safe() @ xform
-        else:
-            si["skeleton_nodes"].append(boneid)
+    def export_armature_bone(self, bone, il):
+        self.writel(
+            S_NODES, il, "<node id=\"{}\" sid=\"{}\" name=\"{}\" "
+            "type=\"JOINT\">".format(bone.name, bone.name, bone.name))
+        il += 1
 
-        if (is_ctrl_bone is False):
-            self.writel(
-                S_NODES, il, "<matrix sid=\"transform\">{}</matrix>".format(
-                    strmtx(xform)))
+        self.writel(
+            S_NODES, il, "<matrix sid=\"transform\">{}</matrix>".format(
+                self.transforms([bone.matrix])))
 
         for c in bone.children:
-            self.export_armature_bone(c, il, si)
+            self.export_armature_bone(c, il)
 
-        if (is_ctrl_bone is False):
-            il -= 1
-            self.writel(S_NODES, il, "</node>")
+        il -= 1
+        self.writel(S_NODES, il, "</node>")
 
     def export_armature_node(self, node, il):
         if (node.data is None):
             return
 
-        self.skeletons.append(node)
-
-        armature = node.data
-        self.skeleton_info[node] = {
-            "bone_count": 0,
-            "sid": node.name,
-            "name": node.name,
-            "bone_index": {},
-            "bone_ids": {},
-            "bone_names": [],
-            "bone_bind_poses": [],
-            "skeleton_nodes": [],
-            "armature_xform": node.matrix_world
-        }
-
-        for b in armature.bones:
-            if (b.parent is not None):
-                continue
-            self.export_armature_bone(b, il, self.skeleton_info[node])
-
-        if (node.pose):
-            for b in node.pose.bones:
-                for x in b.constraints:
-                    if (x.type == "ACTION"):
-                        self.action_constraints.append(x.action)
+        for b in node.data.roots():
+            self.export_armature_bone(b, il)
 
     def export_camera_node(self, node, il):
         if (node.data is None):
             return
 
         camera = node.data
-        camid = self.new_id("camera")
+        camid = self.new_id("camera", camera.name)
         self.writel(S_CAMS, 1, "<camera id=\"{}\" name=\"{}\">".format(
             camid, camera.name))
         self.writel(S_CAMS, 2, "<optics>")
@@ -1281,8 +1035,7 @@ class DaeExporter:
             self.writel(S_CAMS, 5, "<yfov>{}</yfov>".format(
                     math.degrees(camera.angle)))  # TODO: Review
             self.writel(S_CAMS, 5, "<aspect_ratio>{}</aspect_ratio>".format(
-                self.scene.render.resolution_x /
-                self.scene.render.resolution_y))
+                camera.aspect_ratio))
             self.writel(S_CAMS, 5, "<znear>{}</znear>".format(
                 camera.clip_start))
             self.writel(S_CAMS, 5, "<zfar>{}</zfar>".format(camera.clip_end))
@@ -1292,8 +1045,7 @@ class DaeExporter:
             self.writel(S_CAMS, 5, "<xmag>{}</xmag>".format(
                 camera.ortho_scale * 0.5))  # TODO: Review
             self.writel(S_CAMS, 5, "<aspect_ratio>{}</aspect_ratio>".format(
-                self.scene.render.resolution_x /
-                self.scene.render.resolution_y))
+                camera.aspect_ratio))
             self.writel(S_CAMS, 5, "<znear>{}</znear>".format(
                 camera.clip_start))
             self.writel(S_CAMS, 5, "<zfar>{}</zfar>".format(camera.clip_end))
@@ -1311,7 +1063,7 @@ class DaeExporter:
             return
 
         light = node.data
-        lightid = self.new_id("light")
+        lightid = self.new_id("light", light.name)
         self.writel(S_LAMPS, 1, "<light id=\"{}\" name=\"{}\">".format(
                 lightid, light.name))
         self.writel(S_LAMPS, 3, "<technique_common>")
@@ -1319,7 +1071,7 @@ class DaeExporter:
         if (light.type == "POINT"):
             self.writel(S_LAMPS, 4, "<point>")
             self.writel(S_LAMPS, 5, "<color>{}</color>".format(
-                strarr(light.color)))
+                self.encoder.floats(light.color)))
             # Convert to linear attenuation
             att_by_distance = 2.0 / light.distance
             self.writel(
@@ -1334,7 +1086,7 @@ class DaeExporter:
         elif (light.type == "SPOT"):
             self.writel(S_LAMPS, 4, "<spot>")
             self.writel(S_LAMPS, 5, "<color>{}</color>".format(
-                strarr(light.color)))
+                self.encoder.floats(light.color)))
             # Convert to linear attenuation
             att_by_distance = 2.0 / light.distance
             self.writel(
@@ -1349,7 +1101,7 @@ class DaeExporter:
         else:  # Write a sun lamp for everything else (not supported)
             self.writel(S_LAMPS, 4, "<directional>")
             self.writel(S_LAMPS, 5, "<color>{}</color>".format(
-                strarr(light.color)))
+                self.encoder.floats(light.color)))
             self.writel(S_LAMPS, 4, "</directional>")
 
         self.writel(S_LAMPS, 3, "</technique_common>")
@@ -1369,164 +1121,39 @@ class DaeExporter:
         self.writel(S_NODES, 4, "</extra>")
 
     def export_curve(self, curve):
-        splineid = self.new_id("spline")
+        splineid = self.new_id("spline", curve.name)
 
         self.writel(
             S_GEOM, 1, "<geometry id=\"{}\" name=\"{}\">".format(
                 splineid, curve.name))
         self.writel(S_GEOM, 2, "<spline closed=\"0\">")
 
-        points = []
-        interps = []
-        handles_in = []
-        handles_out = []
-        tilts = []
-
-        for cs in curve.splines:
-
-            if (cs.type == "BEZIER"):
-                for s in cs.bezier_points:
-                    points.append(s.co[0])
-                    points.append(s.co[1])
-                    points.append(s.co[2])
-
-                    handles_in.append(s.handle_left[0])
-                    handles_in.append(s.handle_left[1])
-                    handles_in.append(s.handle_left[2])
-
-                    handles_out.append(s.handle_right[0])
-                    handles_out.append(s.handle_right[1])
-                    handles_out.append(s.handle_right[2])
-
-                    tilts.append(s.tilt)
-                    interps.append("BEZIER")
-            else:
-
-                for s in cs.points:
-                    points.append(s.co[0])
-                    points.append(s.co[1])
-                    points.append(s.co[2])
-                    handles_in.append(s.co[0])
-                    handles_in.append(s.co[1])
-                    handles_in.append(s.co[2])
-                    handles_out.append(s.co[0])
-                    handles_out.append(s.co[1])
-                    handles_out.append(s.co[2])
-                    tilts.append(s.tilt)
-                    interps.append("LINEAR")
-
-        self.writel(S_GEOM, 3, "<source id=\"{}-positions\">".format(splineid))
-        position_values = ""
-        for x in points:
-            position_values += " {}".format(x)
-        self.writel(
-            S_GEOM, 4, "<float_array id=\"{}-positions-array\" "
-            "count=\"{}\">{}</float_array>".format(
-                splineid, len(points), position_values))
-        self.writel(S_GEOM, 4, "<technique_common>")
-        self.writel(
-            S_GEOM, 5, "<accessor source=\"#{}-positions-array\" "
-            "count=\"{}\" stride=\"3\">".format(splineid, len(points) / 3))
-        self.writel(S_GEOM, 6, "<param name=\"X\" type=\"float\"/>")
-        self.writel(S_GEOM, 6, "<param name=\"Y\" type=\"float\"/>")
-        self.writel(S_GEOM, 6, "<param name=\"Z\" type=\"float\"/>")
-        self.writel(S_GEOM, 5, "</accessor>")
-        self.writel(S_GEOM, 4, "</technique_common>")
-        self.writel(S_GEOM, 3, "</source>")
-
-        self.writel(
-            S_GEOM, 3, "<source id=\"{}-intangents\">".format(splineid))
-        intangent_values = ""
-        for x in handles_in:
-            intangent_values += " {}".format(x)
-        self.writel(
-            S_GEOM, 4, "<float_array id=\"{}-intangents-array\" "
-            "count=\"{}\">{}</float_array>".format(
-                splineid, len(points), intangent_values))
-        self.writel(S_GEOM, 4, "<technique_common>")
-        self.writel(
-            S_GEOM, 5, "<accessor source=\"#{}-intangents-array\" "
-            "count=\"{}\" stride=\"3\">".format(splineid, len(points) / 3))
-        self.writel(S_GEOM, 6, "<param name=\"X\" type=\"float\"/>")
-        self.writel(S_GEOM, 6, "<param name=\"Y\" type=\"float\"/>")
-        self.writel(S_GEOM, 6, "<param name=\"Z\" type=\"float\"/>")
-        self.writel(S_GEOM, 5, "</accessor>")
-        self.writel(S_GEOM, 4, "</technique_common>")
-        self.writel(S_GEOM, 3, "</source>")
-
-        self.writel(S_GEOM, 3, "<source id=\"{}-outtangents\">".format(
-            splineid))
-        outtangent_values = ""
-        for x in handles_out:
-            outtangent_values += " {}".format(x)
-        self.writel(
-            S_GEOM, 4, "<float_array id=\"{}-outtangents-array\" "
-            "count=\"{}\">{}</float_array>".format(
-                splineid, len(points), outtangent_values))
-        self.writel(S_GEOM, 4, "<technique_common>")
-        self.writel(
-            S_GEOM, 5, "<accessor source=\"#{}-outtangents-array\" "
-            "count=\"{}\" stride=\"3\">".format(splineid, len(points) / 3))
-        self.writel(S_GEOM, 6, "<param name=\"X\" type=\"float\"/>")
-        self.writel(S_GEOM, 6, "<param name=\"Y\" type=\"float\"/>")
-        self.writel(S_GEOM, 6, "<param name=\"Z\" type=\"float\"/>")
-        self.writel(S_GEOM, 5, "</accessor>")
-        self.writel(S_GEOM, 4, "</technique_common>")
-        self.writel(S_GEOM, 3, "</source>")
-
-        self.writel(
-            S_GEOM, 3, "<source id=\"{}-interpolations\">".format(splineid))
-        interpolation_values = ""
-        for x in interps:
-            interpolation_values += " {}".format(x)
-        self.writel(
-            S_GEOM, 4, "<Name_array id=\"{}-interpolations-array\" "
-            "count=\"{}\">{}</Name_array>"
-            .format(splineid, len(interps), interpolation_values))
-        self.writel(S_GEOM, 4, "<technique_common>")
-        self.writel(
-            S_GEOM, 5, "<accessor source=\"#{}-interpolations-array\" "
-            "count=\"{}\" stride=\"1\">".format(splineid, len(interps)))
-        self.writel(S_GEOM, 6, "<param name=\"INTERPOLATION\" type=\"name\"/>")
-        self.writel(S_GEOM, 5, "</accessor>")
-        self.writel(S_GEOM, 4, "</technique_common>")
-        self.writel(S_GEOM, 3, "</source>")
-
-        self.writel(S_GEOM, 3, "<source id=\"{}-tilts\">".format(splineid))
-        tilt_values = ""
-        for x in tilts:
-            tilt_values += " {}".format(x)
-        self.writel(
-            S_GEOM, 4,
-            "<float_array id=\"{}-tilts-array\" count=\"{}\">{}</float_array>"
-            .format(splineid, len(tilts), tilt_values))
-        self.writel(S_GEOM, 4, "<technique_common>")
-        self.writel(
-            S_GEOM, 5, "<accessor source=\"#{}-tilts-array\" "
-            "count=\"{}\" stride=\"1\">".format(splineid, len(tilts)))
-        self.writel(S_GEOM, 6, "<param name=\"TILT\" type=\"float\"/>")
-        self.writel(S_GEOM, 5, "</accessor>")
-        self.writel(S_GEOM, 4, "</technique_common>")
-        self.writel(S_GEOM, 3, "</source>")
+        point_count = len(curve.points)
+
+        for source, values in (("positions", curve.points),
+                               ("intangents", curve.handles_in),
+                               ("outtangents", curve.handles_out)):
+            self.write_source(
+                S_GEOM, 3, "{}-{}".format(splineid, source),
+                self.encoder.floats(values), point_count, 3,
+                ["X", "Y", "Z"])
+        self.write_source(
+            S_GEOM, 3, "{}-interpolations".format(splineid),
+            "".join((" " + name) * count
+                    for name, count in curve.interpolations),
+            point_count, 1, ["INTERPOLATION"], "name", "Name_array")
+        self.write_source(
+            S_GEOM, 3, "{}-tilts".format(splineid),
+            self.encoder.floats(curve.tilts), point_count, 1, ["TILT"])
 
         self.writel(S_GEOM, 3, "<control_vertices>")
-        self.writel(
-            S_GEOM, 4,
-            "<input semantic=\"POSITION\" source=\"#{}-positions\"/>"
-            .format(splineid))
-        self.writel(
-            S_GEOM, 4,
-            "<input semantic=\"IN_TANGENT\" source=\"#{}-intangents\"/>"
-            .format(splineid))
-        self.writel(
-            S_GEOM, 4, "<input semantic=\"OUT_TANGENT\" "
-            "source=\"#{}-outtangents\"/>".format(splineid))
-        self.writel(
-            S_GEOM, 4, "<input semantic=\"INTERPOLATION\" "
-            "source=\"#{}-interpolations\"/>".format(splineid))
-        self.writel(
-            S_GEOM, 4, "<input semantic=\"TILT\" source=\"#{}-tilts\"/>"
-            .format(splineid))
+        self.write_inputs(S_GEOM, 4, [
+            ("POSITION", "{}-positions".format(splineid), None, None),
+            ("IN_TANGENT", "{}-intangents".format(splineid), None, None),
+            ("OUT_TANGENT", "{}-outtangents".format(splineid), None, None),
+            ("INTERPOLATION", "{}-interpolations".format(splineid), None,
+             None),
+            ("TILT", "{}-tilts".format(splineid), None, None)])
         self.writel(S_GEOM, 3, "</control_vertices>")
 
         self.writel(S_GEOM, 2, "</spline>")
@@ -1544,86 +1171,44 @@ class DaeExporter:
             curveid))
         self.writel(S_NODES, il, "</instance_geometry>")
 
-    def export_node(self, node, il):        
-        if (node not in self.valid_nodes):
-            return
-
-        prev_node = bpy.context.view_layer.objects.active
-        bpy.context.view_layer.objects.active = node
-
-        self.writel(
-            S_NODES, il, "<node id=\"{}\" name=\"{}\" type=\"NODE\">".format(
-                self.validate_id(node.name), node.name))
-        il += 1
-
-        self.writel(
-            S_NODES, il, "<matrix sid=\"transform\">{}</matrix>".format(
-                strmtx(node.matrix_local)))
-        if (node.type == "MESH"):
-            self.export_mesh_node(node, il)
-        elif (node.type == "CURVE"):
-            self.export_curve_node(node, il)
-        elif (node.type == "ARMATURE"):
-            self.export_armature_node(node, il)
-        elif (node.type == "CAMERA"):
-            self.export_camera_node(node, il)
-        elif (node.type == "LAMP"):
-            self.export_lamp_node(node, il)
-        elif (node.type == "EMPTY"):
-            self.export_empty_node(node, il)
-
-        for x in sorted(node.children, key=lambda x: x.name):
-            self.export_node(x, il)
-
-        il -= 1
-        self.writel(S_NODES, il, "</node>")
-        bpy.context.view_layer.objects.active = prev_node
-
-    def is_node_valid(self, node):
-        if (node.type not in self.config["object_types"]):
-            return False
+    def export_node(self, node, il):
+        with self.owner(dae_budget.NODE, node.name):
+            self.writel(
+                S_NODES, il,
+                "<node id=\"{}\" name=\"{}\" type=\"NODE\">".format(
+                    self.validate_id(node.name), node.name))
+            il += 1
 
-        if (self.config["use_active_layers"]):
-            valid = True
-            """
-            for i in range(20):
-                if (node.layers[i] and self.scene.layers[i]):
-                    valid = True
-                    break
-            """
-            # use collections instead of layers
-            for col in node.users_collection:
-                if col.hide_viewport == True:
-                    valid = False
-                    break
-                    
-            if (not valid):
-                return False
-
-        if (self.config["use_export_selected"] and not node.select_get()):
-            return False
+            self.writel(
+                S_NODES, il, "<matrix sid=\"transform\">{}</matrix>".format(
+                    self.transforms([node.matrix])))
+            if (node.type == "MESH"):
+                self.export_mesh_node(node, il)
+            elif (node.type == "CURVE"):
+                self.export_curve_node(node, il)
+            elif (node.type == "ARMATURE"):
+                self.export_armature_node(node, il)
+            elif (node.type == "CAMERA"):
+                self.export_camera_node(node, il)
+            elif (node.type == "LAMP"):
+                self.export_lamp_node(node, il)
+            elif (node.type == "EMPTY"):
+                self.export_empty_node(node, il)
+
+            for x in node.children:
+                self.export_node(x, il)
 
-        return True
+            il -= 1
+            self.writel(S_NODES, il, "</node>")
 
-    def export_scene(self):
+    def export_scene(self, scene):
         self.writel(S_NODES, 0, "<library_visual_scenes>")
         self.writel(
             S_NODES, 1, "<visual_scene id=\"{}\" name=\"scene\">".format(
                 self.scene_name))
 
-        for obj in self.scene.objects:
-            if (obj in self.valid_nodes):
-                continue
-            if (self.is_node_valid(obj)):
-                n = obj
-                while (n is not None):
-                    if (n not in self.valid_nodes):
-                        self.valid_nodes.append(n)
-                    n = n.parent
-
-        for obj in sorted(self.scene.objects, key=lambda x: x.name):
-            if (obj in self.valid_nodes and obj.parent is None):                
-                self.export_node(obj, 2)
+        for node in scene.roots:
+            self.export_node(node, 2)
 
         self.writel(S_NODES, 1, "</visual_scene>")
         self.writel(S_NODES, 0, "</library_visual_scenes>")
@@ -1637,111 +1222,66 @@ class DaeExporter:
             S_ASSET, 2, "<authoring_tool>Collada Exporter for Blender 2.6+, "
             "by Juan Linietsky (juan@codenix.com)</authoring_tool>")
         self.writel(S_ASSET, 1, "</contributor>")
-        self.writel(S_ASSET, 1, "<created>{}</created>".format(
-            time.strftime("%Y-%m-%dT%H:%M:%SZ")))
-        self.writel(S_ASSET, 1, "<modified>{}</modified>".format(
-            time.strftime("%Y-%m-%dT%H:%M:%SZ")))
+        if (self.config["use_timestamps"]):
+            timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ")
+        else:
+            timestamp = time.strftime(
+                "%Y-%m-%dT%H:%M:%SZ", time.gmtime(source_date_epoch()))
+        self.writel(S_ASSET, 1, "<created>{}</created>".format(timestamp))
+        self.writel(S_ASSET, 1, "<modified>{}</modified>".format(timestamp))
         self.writel(S_ASSET, 1, "<unit meter=\"1.0\" name=\"meter\"/>")
         self.writel(S_ASSET, 1, "<up_axis>Z_UP</up_axis>")
         self.writel(S_ASSET, 0, "</asset>")
 
-    def export_animation_transform_channel(self, target, keys, matrices=True):
-        frame_total = len(keys)
-        anim_id = self.new_id("anim")
-        self.writel(S_ANIM, 1, "<animation id=\"{}\">".format(anim_id))
-        source_frames = ""
-        source_transforms = ""
-        source_interps = ""
-
-        for k in keys:
-            source_frames += " {}".format(k[0])
-            if (matrices):
-                source_transforms += " {}".format(strmtx(k[1]))
-            else:
-                source_transforms += " {}".format(k[1])
+    def export_track(self, track, name):
+        if (track.kind == scene_ir.NODE):
+            target = self.validate_id(track.target.name)
+        elif (track.kind == scene_ir.BONE):
+            target = track.target.name
+        else:
+            target = "{}-morph-weights({})".format(
+                self.mesh_cache[track.target]["morph_id"], track.index)
+        matrices = track.kind != scene_ir.MORPH
 
-            source_interps += " LINEAR"
+        frame_total = len(track.times)
+        anim_id = self.new_id("anim", name)
+        self.writel(S_ANIM, 1, "<animation id=\"{}\">".format(anim_id))
+        source_frames = self.encoder.floats(track.times)
+        if (matrices):
+            source_transforms = self.transforms(track.values)
+        else:
+            source_transforms = self.encoder.floats(track.values)
+        source_interps = " LINEAR" * frame_total
 
         # Time Source
-        self.writel(S_ANIM, 2, "<source id=\"{}-input\">".format(anim_id))
-        self.writel(
-            S_ANIM, 3, "<float_array id=\"{}-input-array\" "
-            "count=\"{}\">{}</float_array>".format(
-                anim_id, frame_total, source_frames))
-        self.writel(S_ANIM, 3, "<technique_common>")
-        self.writel(
-            S_ANIM, 4, "<accessor source=\"#{}-input-array\" "
-            "count=\"{}\" stride=\"1\">".format(anim_id, frame_total))
-        self.writel(S_ANIM, 5, "<param name=\"TIME\" type=\"float\"/>")
-        self.writel(S_ANIM, 4, "</accessor>")
-        self.writel(S_ANIM, 3, "</technique_common>")
-        self.writel(S_ANIM, 2, "</source>")
+        self.write_source(
+            S_ANIM, 2, "{}-input".format(anim_id), source_frames,
+            frame_total, 1, ["TIME"])
+        self.count_attribute("animation_times", frame_total, source_frames)
 
         if (matrices):
             # Transform Source
-            self.writel(
-                S_ANIM, 2, "<source id=\"{}-transform-output\">".format(
-                    anim_id))
-            self.writel(
-                S_ANIM, 3, "<float_array id=\"{}-transform-output-array\" "
-                "count=\"{}\">{}</float_array>".format(
-                    anim_id, frame_total * 16, source_transforms))
-            self.writel(S_ANIM, 3, "<technique_common>")
-            self.writel(
-                S_ANIM, 4,
-                "<accessor source=\"#{}-transform-output-array\" count=\"{}\" "
-                "stride=\"16\">".format(anim_id, frame_total))
-            self.writel(
-                S_ANIM, 5, "<param name=\"TRANSFORM\" type=\"float4x4\"/>")
-            self.writel(S_ANIM, 4, "</accessor>")
-            self.writel(S_ANIM, 3, "</technique_common>")
-            self.writel(S_ANIM, 2, "</source>")
+            self.write_source(
+                S_ANIM, 2, "{}-transform-output".format(anim_id),
+                source_transforms, frame_total, 16, ["TRANSFORM"],
+                "float4x4")
+            self.count_attribute("animation_matrices", frame_total * 16,
+                                 source_transforms)
         else:
             # Value Source
-            self.writel(
-                S_ANIM, 2,
-                "<source id=\"{}-transform-output\">".format(anim_id))
-            self.writel(
-                S_ANIM, 3, "<float_array id=\"{}-transform-output-array\" "
-                "count=\"{}\">{}</float_array>".format(
-                    anim_id, frame_total, source_transforms))
-            self.writel(S_ANIM, 3, "<technique_common>")
-            self.writel(
-                S_ANIM, 4, "<accessor source=\"#{}-transform-output-array\" "
-                "count=\"{}\" stride=\"1\">".format(anim_id, frame_total))
-            self.writel(S_ANIM, 5, "<param name=\"X\" type=\"float\"/>")
-            self.writel(S_ANIM, 4, "</accessor>")
-            self.writel(S_ANIM, 3, "</technique_common>")
-            self.writel(S_ANIM, 2, "</source>")
+            self.write_source(
+                S_ANIM, 2, "{}-transform-output".format(anim_id),
+                source_transforms, frame_total, 1, ["X"])
+            self.count_attribute("animation_weights", frame_total,
+                                 source_transforms)
 
         # Interpolation Source
-        self.writel(
-            S_ANIM, 2, "<source id=\"{}-interpolation-output\">".format(
-                anim_id))
-        self.writel(
-            S_ANIM, 3, "<Name_array id=\"{}-interpolation-output-array\" "
-            "count=\"{}\">{}</Name_array>".format(
-                anim_id, frame_total, source_interps))
-        self.writel(S_ANIM, 3, "<technique_common>")
-        self.writel(
-            S_ANIM, 4, "<accessor source=\"#{}-interpolation-output-array\" "
-            "count=\"{}\" stride=\"1\">".format(anim_id, frame_total))
-        self.writel(S_ANIM, 5, "<param name=\"INTERPOLATION\" type=\"Name\"/>")
-        self.writel(S_ANIM, 4, "</accessor>")
-        self.writel(S_ANIM, 3, "</technique_common>")
-        self.writel(S_ANIM, 2, "</source>")
-
-        self.writel(S_ANIM, 2, "<sampler id=\"{}-sampler\">".format(anim_id))
-        self.writel(
-            S_ANIM, 3,
-            "<input semantic=\"INPUT\" source=\"#{}-input\"/>".format(anim_id))
-        self.writel(
-            S_ANIM, 3, "<input semantic=\"OUTPUT\" "
-            "source=\"#{}-transform-output\"/>".format(anim_id))
-        self.writel(
-            S_ANIM, 3, "<input semantic=\"INTERPOLATION\" "
-            "source=\"#{}-interpolation-output\"/>".format(anim_id))
-        self.writel(S_ANIM, 2, "</sampler>")
+        self.write_source(
+            S_ANIM, 2, "{}-interpolation-output".format(anim_id),
+            source_interps, frame_total, 1, ["INTERPOLATION"], "Name",
+            "Name_array")
+
+        self.writel(S_ANIM, 2, self.templates.sampler(2, anim_id))
         if (matrices):
             self.writel(
                 S_ANIM, 2, "<channel source=\"#{}-sampler\" "
@@ -1752,223 +1292,44 @@ class DaeExporter:
                 "target=\"{}\"/>".format(anim_id, target))
         self.writel(S_ANIM, 1, "</animation>")
 
-        return [anim_id]
-
-    def export_animation(self, start, end, allowed=None):
-        # TODO: Blender -> Collada frames needs a little work
-        #       Collada starts from 0, blender usually from 1.
-        #       The last frame must be included also
-
-        frame_orig = self.scene.frame_current
-
-        frame_len = 1.0 / self.scene.render.fps
-        frame_sub = 0
-        if (start > 0):
-            frame_sub = start * frame_len
-
-        tcn = []
-        xform_cache = {}
-        blend_cache = {}
-
-        # Change frames first, export objects last, boosts performance
-        for t in range(start, end + 1):
-            self.scene.frame_set(t)
-            key = t * frame_len - frame_sub
-
-            for node in self.scene.objects:
-                if (node not in self.valid_nodes):
-                    continue
-                if (allowed is not None and not (node in allowed)):
-                    if (node.type == "MESH" and node.data is not None and
-                        (node in self.armature_for_morph) and (
-                            self.armature_for_morph[node] in allowed)):
-                        pass
-                    else:
-                        continue
-                if (node.type == "MESH" and node.data is not None and
-                    node.data.shape_keys is not None and (
-                        node.data in self.mesh_cache) and len(
-                            node.data.shape_keys.key_blocks) and self.config["use_shape_key_export"]):
-                    target = self.mesh_cache[node.data]["morph_id"]
-                    for i in range(len(node.data.shape_keys.key_blocks)):
-
-                        if (i == 0):
-                            continue
-
-                        name = "{}-morph-weights({})".format(target, i - 1)
-                        if (not (name in blend_cache)):
-                            blend_cache[name] = []
-
-                        blend_cache[name].append(
-                            (key, node.data.shape_keys.key_blocks[i].value))
-
-                if (node.type == "MESH" and node.parent and
-                        node.parent.type == "ARMATURE"):
-                    # In Collada, nodes that have skin modifier must not export
-                    # animation, animate the skin instead
-                    continue
-
-                if (len(node.constraints) > 0 or
-                        node.animation_data is not None):
-                    # If the node has constraints, or animation data, then
-                    # export a sampled animation track
-                    name = self.validate_id(node.name)
-                    if (not (name in xform_cache)):
-                        xform_cache[name] = []
-
-                    mtx = node.matrix_world.copy()
-                    if (node.parent):
-                        mtx = node.parent.matrix_world.inverted_safe() @ mtx
-
-                    xform_cache[name].append((key, mtx))
-
-                if (node.type == "ARMATURE"):
-                    # All bones exported for now
-                    for bone in node.data.bones:
-                        if((bone.name.startswith("ctrl") or
-                            bone.use_deform == False) and
-                                self.config["use_exclude_ctrl_bones"]):
-                            continue
-
-                        bone_name = self.skeleton_info[node]["bone_ids"][bone]
-
-                        if (not (bone_name in xform_cache)):
-                            xform_cache[bone_name] = []
-
-                        posebone = node.pose.bones[bone.name]
-                        parent_posebone = None
-
-                        mtx = posebone.matrix.copy()
-                        if (bone.parent):
-                            if (self.config["use_exclude_ctrl_bones"]):
-                                current_parent_posebone = bone.parent
-                                while ((current_parent_posebone.name
-                                        .startswith("ctrl") or
-                                        current_parent_posebone.use_deform
-                                        == False) and
-                                        current_parent_posebone.parent):
-                                    current_parent_posebone = (
-                                        current_parent_posebone.parent)
-                                parent_posebone = node.pose.bones[
-                                    current_parent_posebone.name]
-                            else:
-                                parent_posebone = node.pose.bones[
-                                    bone.parent.name]
-                            parent_invisible = False
-
-                            for i in range(3):
-                                if (parent_posebone.scale[i] == 0.0):
-                                    parent_invisible = True
-
-                            if (not parent_invisible):
-                                mtx = (
-                                    parent_posebone.matrix
-                                    .inverted_safe() @ mtx)
-
-                        xform_cache[bone_name].append((key, mtx))
-
-        self.scene.frame_set(frame_orig)
-
-        # Export animation XML
-        for nid in xform_cache:
-            tcn += self.export_animation_transform_channel(
-                nid, xform_cache[nid], True)
-        for nid in blend_cache:
-            tcn += self.export_animation_transform_channel(
-                nid, blend_cache[nid], False)
-
-        return tcn
-
-    def export_animations(self):
-        tmp_mat = []
-        for s in self.skeletons:
-            tmp_bone_mat = []
-            for bone in s.pose.bones:
-                tmp_bone_mat.append(Matrix(bone.matrix_basis))
-                bone.matrix_basis = Matrix()
-            tmp_mat.append([Matrix(s.matrix_local), tmp_bone_mat])
+        return anim_id
 
+    def export_animations(self, scene):
         self.writel(S_ANIM, 0, "<library_animations>")
 
-        if (self.config["use_anim_action_all"] and len(self.skeletons)):
-
-            cached_actions = {}
-
-            for s in self.skeletons:
-                if s.animation_data and s.animation_data.action:
-                    cached_actions[s] = s.animation_data.action.name
-
+        if (scene.clips is not None):
             self.writel(S_ANIM_CLIPS, 0, "<library_animation_clips>")
 
-            for x in bpy.data.actions[:]:
-                
-                if x.users == 0 or x in self.action_constraints:
-                    continue
-                if (self.config["use_anim_skip_noexp"] and
-                        x.name.endswith("-noexp")):
-                    continue
-                           
-                bones = []
-                # Find bones used
-                for p in x.fcurves:
-                    dp = p.data_path
-                    base = "pose.bones[\""
-                    if dp.startswith(base):
-                        dp = dp[len(base):]
-                        if (dp.find("\"") != -1):
-                            dp = dp[:dp.find("\"")]
-                            if (dp not in bones):
-                                bones.append(dp)
-
-                allowed_skeletons = []
-                for i, y in enumerate(self.skeletons):
-                    if (y.animation_data):
-                        for z in y.pose.bones:
-                            if (z.bone.name in bones):
-                                if (y not in allowed_skeletons):
-                                    allowed_skeletons.append(y)
-                        y.animation_data.action = x
-
-                        y.matrix_local = tmp_mat[i][0]
-                        for j, bone in enumerate(s.pose.bones):
-                            bone.matrix_basis = Matrix()
-
-                tcn = self.export_animation(int(x.frame_range[0]), int(
-                    x.frame_range[1] + 0.5), allowed_skeletons)
-                framelen = (1.0 / self.scene.render.fps)
-                start = x.frame_range[0] * framelen
-                end = x.frame_range[1] * framelen
+            for clip in scene.clips:
+                tcn = []
+                for track in clip.tracks:
+                    name = track_name(track)
+                    with self.owner(dae_budget.TRACK, clip.name, name):
+                        tcn.append(self.export_track(
+                            track, "{}-{}".format(clip.name, name)))
                 self.writel(
                     S_ANIM_CLIPS, 1, "<animation_clip name=\"{}\" "
-                    "start=\"{}\" end=\"{}\">".format(x.name, start, end))
+                    "start=\"{}\" end=\"{}\">".format(
+                        clip.name, clip.start, clip.end))
                 for z in tcn:
                     self.writel(S_ANIM_CLIPS, 2,
                                 "<instance_animation url=\"#{}\"/>".format(z))
                 self.writel(S_ANIM_CLIPS, 1, "</animation_clip>")
-                if (len(tcn) == 0):
-                    self.operator.report(
-                        {"WARNING"}, "Animation clip \"{}\" contains no "
-                        "tracks.".format(x.name))
 
             self.writel(S_ANIM_CLIPS, 0, "</library_animation_clips>")
 
-            for i, s in enumerate(self.skeletons):
-                if (s.animation_data is None):
-                    continue
-                if s in cached_actions:
-                    s.animation_data.action = bpy.data.actions[
-                        cached_actions[s]]
-                else:
-                    s.animation_data.action = None
-                    for j, bone in enumerate(s.pose.bones):
-                        bone.matrix_basis = tmp_mat[i][1][j]
-
         else:
-            self.export_animation(self.scene.frame_start, self.scene.frame_end)
+            for track in scene.tracks:
+                name = track_name(track)
+                with self.owner(dae_budget.TRACK, self.scene_name, name):
+                    self.export_track(track, name)
 
         self.writel(S_ANIM, 0, "</library_animations>")
 
-    def export(self):
+    def export(self, scene):
+        """
+        Writes the scene_ir.Scene scene to the output file
+        """
         self.writel(S_GEOM, 0, "<library_geometries>")
         self.writel(S_CONT, 0, "<library_controllers>")
         self.writel(S_CAMS, 0, "<library_cameras>")
@@ -1978,20 +1339,13 @@ class DaeExporter:
         self.writel(S_FX, 0, "<library_effects>")
 
         self.export_asset()
-        self.export_scene()
+        self.export_scene(scene)
 
         self.writel(S_GEOM, 0, "</library_geometries>")
 
         # Morphs always go before skin controllers
-        if S_MORPH in self.sections:
-            for l in self.sections[S_MORPH]:
-                self.writel(S_CONT, 0, l)
-            del self.sections[S_MORPH]
-
-        if S_SKIN in self.sections:
-            for l in self.sections[S_SKIN]:
-                self.writel(S_CONT, 0, l)
-            del self.sections[S_SKIN]
+        self.sections.move(S_MORPH, S_CONT)
+        self.sections.move(S_SKIN, S_CONT)
 
         self.writel(S_CONT, 0, "</library_controllers>")
         self.writel(S_CAMS, 0, "</library_cameras>")
@@ -2003,73 +1357,203 @@ class DaeExporter:
         self.purge_empty_nodes()
 
         if (self.config["use_anim"]):
-            self.export_animations()
+            self.export_animations(scene)
 
         try:
             f = open(self.path, "wb")
         except:
             return False
 
-        f.write(bytes("<?xml version=\"1.0\" encoding=\"utf-8\"?>\n", "UTF-8"))
-        f.write(bytes(
-            "<COLLADA xmlns=\"http://www.collada.org/2005/11/COLLADASchema\" "
-            "version=\"1.4.1\">\n", "UTF-8"))
-
-        s = []
-        for x in self.sections.keys():
-            s.append(x)
-        s.sort()
-        for x in s:
-            for l in self.sections[x]:
-                f.write(bytes(l + "\n", "UTF-8"))
-
-        f.write(bytes("<scene>\n", "UTF-8"))
-        f.write(bytes(
-            "\t<instance_visual_scene url=\"#{}\" />\n".format(
-                self.scene_name), "UTF-8"))
-        f.write(bytes("</scene>\n", "UTF-8"))
-        f.write(bytes("</COLLADA>\n", "UTF-8"))
+        with f:
+            if (self.config["output_format"] == "ZAE"):
+                self.write_archive(f)
+            else:
+                self.write_document(f)
+
+        if (self.fragments):
+            self.store_fragments()
+        if (self.budget is not None):
+            self.write_size_report()
         return True
 
-    __slots__ = ("operator", "scene", "last_id", "scene_name", "sections",
-                 "path", "mesh_cache", "curve_cache", "material_cache",
-                 "image_cache", "skeleton_info", "config", "valid_nodes",
-                 "armature_for_morph", "used_bones", "wrongvtx_report",
-                 "skeletons", "action_constraints", "temp_meshes")
+    def write_size_report(self):
+        """
+        Writes where the bytes of the document went next to the output file
+        """
+        report = {
+            "file": os.path.basename(self.path),
+            "file_bytes": os.path.getsize(self.path),
+            "document_bytes": self.document_size,
+        }
+        report.update(self.budget.report())
+        with open(self.path + ".size.json", "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+        self.size_report = report
 
-    def __init__(self, path, kwargs, operator):
+    def write_document(self, f):
+        """
+        Writes the whole document to f, compressed if the output format
+        compresses. Returns the CRC-32 and size of the uncompressed text.
+        """
+        header = (
+            "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
+            "<COLLADA xmlns=\"http://www.collada.org/2005/11/COLLADASchema\" "
+            "version=\"1.4.1\">\n")
+        footer = (
+            "<scene>\n"
+            "\t<instance_visual_scene url=\"#{}\" />\n"
+            "</scene>\n"
+            "</COLLADA>\n".format(self.scene_name))
+        crc, size = self.sections.assemble(
+            f, header.encode("utf-8"), footer.encode("utf-8"))
+        self.document_size = size
+        return crc, size
+
+    def write_archive(self, f):
+        """
+        Writes a .zae: a zip with the document, the images it uses and a
+        manifest pointing to the document
+        """
+        level = self.config["compression_level"]
+        name = os.path.splitext(os.path.basename(self.path))[0] + ".dae"
+        manifest = (
+            "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
+            "<dae_root>./{}</dae_root>\n".format(name))
+
+        archive = dae_archive.ZipWriter(f)
+        archive.add_bytes("manifest.xml", manifest.encode("utf-8"), level)
+        archive.add_stream(name, self.write_document)
+        for arcname, path in sorted(self.archive_images.items()):
+            archive.add_file(arcname, path, level)
+        archive.close()
+
+    __slots__ = ("operator", "last_id", "used_ids", "scene_name", "sections", "path",
+                 "mesh_cache", "material_cache", "image_cache", "config",
+                 "encoder", "quantizer", "templates", "document_size",
+                 "image_dir", "archive_images", "budget", "size_report",
+                 "geometry_cache", "recording", "fragments")
+
+    def __init__(self, path, kwargs, operator, geometry_cache=None):
         self.operator = operator
-        self.scene = bpy.context.scene
+        self.geometry_cache = geometry_cache
+        self.recording = None
+        self.fragments = []
         self.last_id = 0
-        self.scene_name = self.new_id("scene")
-        self.sections = {}
+        self.used_ids = None
+        if (kwargs["use_deterministic"]):
+            self.used_ids = {}
+        self.scene_name = self.new_id("scene", "scene")
+        self.templates = dae_templates.Templates(kwargs["use_compact_xml"])
+        self.sections = section_writer.SectionWriter(
+            newline=b"" if kwargs["use_compact_xml"] else b"\n",
+            compression=SECTION_COMPRESSION[kwargs["output_format"]],
+            level=kwargs["compression_level"])
+        self.document_size = 0
+        self.budget = None
+        self.size_report = None
+        if (kwargs["use_size_report"]):
+            self.budget = dae_budget.Budget(
+                SECTION_NAMES, b"" if kwargs["use_compact_xml"] else b"\n")
+        self.image_dir = None
+        self.archive_images = {}
         self.path = path
         self.mesh_cache = {}
-        self.temp_meshes = set()
-        self.curve_cache = {}
         self.material_cache = {}
         self.image_cache = {}
-        self.skeleton_info = {}
         self.config = kwargs
-        self.valid_nodes = []
-        self.armature_for_morph = {}
-        self.used_bones = []
-        self.wrongvtx_report = False
-        self.skeletons = []
-        self.action_constraints = []
+        self.encoder = dae_encoder.Encoder(
+            kwargs["float_format"], kwargs["float_precision"],
+            kwargs["use_fixed_width"])
+        # Large arrays are encoded by worker processes, as futures
+        if (kwargs["use_parallel_export"]):
+            self.encoder = dae_pool.EncoderPool(
+                self.encoder, kwargs["export_workers"])
+        self.quantizer = None
+        if (kwargs["use_attribute_precision"]):
+            self.quantizer = dae_encoder.Quantizer({
+                dae_encoder.POSITION: kwargs["position_precision"],
+                dae_encoder.NORMAL: kwargs["normal_precision"],
+                dae_encoder.UV: kwargs["uv_precision"],
+                dae_encoder.COLOR: kwargs["color_precision"],
+                dae_encoder.WEIGHT: kwargs["weight_precision"],
+            }, kwargs["matrix_digits"], kwargs["use_quantize_grid"])
 
     def __enter__(self):
         return self
 
-    def __exit__(self, *exc):
-        pass
-        """    
-        for mesh in self.temp_meshes:
-            bpy.data.meshes.remove(mesh)
-        """
+    def __exit__(self, exc_type, exc_value, traceback):
+        if (isinstance(self.encoder, dae_pool.EncoderPool)):
+            log.addon.info(
+                "%d arrays encoded by %d workers", self.encoder.submitted,
+                self.encoder.workers)
+            self.encoder.shutdown(cancel=exc_type is not None)
+        self.sections.close()
+        if (self.image_dir is not None):
+            shutil.rmtree(self.image_dir, ignore_errors=True)
 
 def save(operator, context, filepath="", use_selection=False, **kwargs):
-    with DaeExporter(filepath, kwargs, operator) as exp:
-        exp.export()
+    filepath = output_path(filepath, kwargs["output_format"])
+    geometry_cache = None
+    incremental = None
+    # Incremental exports reuse the geometry of unchanged objects from the
+    # geometry cache
+    if (kwargs["use_geometry_cache"] or kwargs["use_incremental"]):
+        geometry_cache = file_cache.addon_cache("geometry")
+    if (kwargs["use_incremental"]):
+        incremental = export_tracker.Incremental(filepath, kwargs)
+    start = time.perf_counter()
+    with scene_extract.SceneExtractor(
+            kwargs, operator, geometry_cache, incremental) as extractor:
+        scene = extractor.extract()
+    extracted = time.perf_counter()
+    with DaeExporter(filepath, kwargs, operator, geometry_cache) as exp:
+        exported = exp.export(scene)
+    end = time.perf_counter()
+    if (exported and incremental is not None):
+        incremental.finish(extractor)
+    log.addon.info(
+        "Extracted the scene in %.2f s, wrote it in %.2f s",
+        extracted - start, end - extracted)
+
+    if (kwargs["use_scene_dump"]):
+        with open(filepath + ".scene.json", "w", encoding="utf-8") as f:
+            json.dump(scene_ir.dump(scene), f, indent=1)
+
+    if exported and os.path.isfile(filepath):
+        size = os.path.getsize(filepath)
+        report = "Wrote {} ({:.1f} MiB) in {:.2f} s".format(
+            os.path.basename(filepath), size / 1048576.0, end - start)
+        if kwargs["output_format"] != "DAE" and exp.document_size:
+            report += ", {:.1f}% of the {:.1f} MiB document".format(
+                100.0 * size / exp.document_size,
+                exp.document_size / 1048576.0)
+        report += " (reading the scene {:.2f} s, writing {:.2f} s)".format(
+            extracted - start, end - extracted)
+        operator.report({"INFO"}, report)
+
+    if (geometry_cache is not None):
+        geometry_cache.evict()
+        log.addon.info("Geometry cache: %s", geometry_cache.summary())
+        operator.report(
+            {"INFO"}, "Geometry cache: " + geometry_cache.summary())
+
+    if (exp.size_report is not None):
+        operator.report(
+            {"INFO"}, "Size report: " + dae_budget.summary(exp.size_report))
+
+    if (exp.quantizer is not None and exp.quantizer.errors):
+        errors = ", ".join(
+            "{} {:.3g}".format(kind, error)
+            for kind, error in exp.quantizer.errors.items())
+        log.addon.info("Largest rounding errors: %s", errors)
+        operator.report({"INFO"}, "Largest rounding errors: " + errors)
+
+    rss = peak_rss()
+    if rss is not None:
+        operator.report(
+            {"INFO"},
+            "Peak memory usage: {:.1f} MiB, at most {} evaluated meshes "
+            "at once".format(rss / 1048576.0,
+                             extractor.evaluated_meshes.peak))
 
     return {"FINISHED"}
@@ -0,0 +1,711 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+This script is an exporter to binary glTF 2.0 (.glb) files.
+
+https://www.khronos.org/gltf/
+
+It writes the scene_ir.Scene extracted for the Collada exporter, so both
+formats export the same nodes, skeletons, materials and tracks. Vertex
+attributes, indices, skins and animations go to the binary chunk as they
+are. The output only depends on the scene: there are no timestamps, and
+everything is written in the order of the scene representation.
+
+Blender is Z up and glTF Y up, every matrix and vector is converted.
+"""
+
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
+import bpy
+import numpy as np
+from . import export_dae
+from . import log
+from . import scene_extract
+from . import scene_ir
+from . import section_writer
+
+# Accessor component types
+UNSIGNED_SHORT = 5123
+UNSIGNED_INT = 5125
+FLOAT = 5126
+
+# Buffer view targets
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+
+# Influences per vertex, the ones with the lowest weights are dropped
+MAX_INFLUENCES = 4
+
+# Z up to Y up: (x, y, z) -> (x, z, -y)
+Y_UP = np.array(((1.0, 0.0, 0.0, 0.0),
+                 (0.0, 0.0, 1.0, 0.0),
+                 (0.0, -1.0, 0.0, 0.0),
+                 (0.0, 0.0, 0.0, 1.0)))
+
+IMAGE_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+}
+
+# Collada options used when comparing with the Collada writer
+DAE_COMPARISON = {
+    "output_format": "DAE",
+    "compression_level": 6,
+    "float_format": "FIXED",
+    "float_precision": 8,
+    "use_fixed_width": False,
+    "use_attribute_precision": False,
+    "use_size_report": False,
+    "use_timestamps": False,
+    "use_compact_xml": False,
+    "use_parallel_export": False,
+    "export_workers": 0,
+    "use_copy_images": False,
+}
+
+
+def vectors(a):
+    """
+    Converts (n, 3) Blender vectors to glTF axes, as float32
+    """
+    a = np.asarray(a, dtype=np.float32)
+    return np.column_stack((a[:, 0], a[:, 2], -a[:, 1]))
+
+
+def quaternions(r):
+    """
+    Converts (n, 3, 3) rotation matrices to (n, 4) x, y, z, w quaternions
+    """
+    r00, r11, r22 = r[:, 0, 0], r[:, 1, 1], r[:, 2, 2]
+    trace = r00 + r11 + r22
+    q = np.empty((len(r), 4))
+
+    # Shepperd's method, from the largest of the four components
+    largest = np.argmax(np.column_stack((trace, r00, r11, r22)), axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for case, diagonal in enumerate((trace, r00 - r11 - r22,
+                                         r11 - r00 - r22, r22 - r00 - r11)):
+            m = largest == case
+            if not m.any():
+                continue
+            rm = r[m]
+            s = np.sqrt(np.maximum(1.0 + diagonal[m], 0.0)) * 2.0
+            if (case == 0):
+                q[m] = np.column_stack((
+                    (rm[:, 2, 1] - rm[:, 1, 2]) / s,
+                    (rm[:, 0, 2] - rm[:, 2, 0]) / s,
+                    (rm[:, 1, 0] - rm[:, 0, 1]) / s, s / 4.0))
+            elif (case == 1):
+                q[m] = np.column_stack((
+                    s / 4.0, (rm[:, 0, 1] + rm[:, 1, 0]) / s,
+                    (rm[:, 0, 2] + rm[:, 2, 0]) / s,
+                    (rm[:, 2, 1] - rm[:, 1, 2]) / s))
+            elif (case == 2):
+                q[m] = np.column_stack((
+                    (rm[:, 0, 1] + rm[:, 1, 0]) / s, s / 4.0,
+                    (rm[:, 1, 2] + rm[:, 2, 1]) / s,
+                    (rm[:, 0, 2] - rm[:, 2, 0]) / s))
+            else:
+                q[m] = np.column_stack((
+                    (rm[:, 0, 2] + rm[:, 2, 0]) / s,
+                    (rm[:, 1, 2] + rm[:, 2, 1]) / s, s / 4.0,
+                    (rm[:, 1, 0] - rm[:, 0, 1]) / s))
+    q /= np.linalg.norm(q, axis=1)[:, None]
+    return q
+
+
+def decompose(matrices):
+    """
+    Splits (n, 4, 4) matrices into translations, rotations and scales
+    """
+    matrices = np.asarray(matrices, dtype=np.float64)
+    translation = matrices[:, :3, 3]
+    basis = matrices[:, :3, :3]
+    scale = np.linalg.norm(basis, axis=1)
+    # A mirroring basis is a rotation with a negative scale
+    scale[np.linalg.det(basis) < 0.0, 0] *= -1.0
+    rotation = basis / np.where(scale == 0.0, 1.0, scale)[:, None, :]
+    return translation, quaternions(rotation), scale
+
+
+def continuous(q):
+    """
+    Flips the sign of quaternions so consecutive keys take the short way
+    """
+    if len(q) < 2:
+        return q
+    flips = np.where(np.sum(q[1:] * q[:-1], axis=1) < 0.0, -1.0, 1.0)
+    return q * np.concatenate(([1.0], np.cumprod(flips)))[:, None]
+
+
+def limit_influences(bones, weights, limit=MAX_INFLUENCES):
+    """
+    Keeps the limit largest influences of every vertex, renormalized.
+    Returns the (vertices, limit) joints and weights and how many vertices
+    lost influences.
+    """
+    used = bones >= 0
+    truncated = int((used.sum(axis=1) > limit).sum())
+    order = np.argsort(-np.where(used, weights, -1.0), axis=1,
+                       kind="stable")[:, :limit]
+    joints = np.take_along_axis(bones, order, axis=1)
+    kept = np.take_along_axis(weights, order, axis=1).astype(np.float32)
+    unused = joints < 0
+    joints[unused] = 0
+    kept[unused] = 0.0
+
+    if joints.shape[1] < limit:
+        pad = limit - joints.shape[1]
+        joints = np.pad(joints, ((0, 0), (0, pad)))
+        kept = np.pad(kept, ((0, 0), (0, pad)))
+
+    total = kept.sum(axis=1, keepdims=True)
+    np.divide(kept, total, out=kept, where=total > 0.0)
+    return joints, kept, truncated
+
+
+def fan_triangles(indices, sizes):
+    """
+    Splits faces of the given sizes into triangle fans
+    """
+    starts = np.cumsum(sizes) - sizes
+    triangles = sizes - 2
+    first = np.repeat(starts, triangles)
+    # Corner of each triangle within its face: 1 .. size - 2
+    corner = np.arange(int(triangles.sum())) - np.repeat(
+        np.cumsum(triangles) - triangles, triangles) + 1
+    return indices[np.column_stack(
+        (first, first + corner, first + corner + 1))].ravel()
+
+
+class GlbExporter:
+    """
+    Writes a scene_ir.Scene as a .glb file
+    """
+
+    __slots__ = ("operator", "path", "config", "buffer", "buffer_size",
+                 "gltf", "node_index", "bone_index", "node_fix",
+                 "mesh_cache", "mesh_nodes", "skin_cache", "skinned_nodes",
+                 "material_cache", "image_cache", "truncated")
+
+    def __init__(self, path, kwargs, operator):
+        self.operator = operator
+        self.path = path
+        self.config = kwargs
+        self.buffer = tempfile.SpooledTemporaryFile(
+            max_size=section_writer.SPOOL_THRESHOLD, mode="w+b")
+        self.buffer_size = 0
+        self.gltf = {
+            "asset": {"version": "2.0", "generator": "io_scene_pac"},
+            "scene": 0,
+            "scenes": [{"nodes": []}],
+            "nodes": [],
+            "meshes": [],
+            "skins": [],
+            "materials": [],
+            "textures": [],
+            "images": [],
+            "cameras": [],
+            "animations": [],
+            "accessors": [],
+            "bufferViews": [],
+        }
+        self.node_index = {}
+        self.bone_index = {}
+        self.node_fix = {}
+        self.mesh_cache = {}
+        self.mesh_nodes = {}
+        self.skin_cache = {}
+        self.skinned_nodes = []
+        self.material_cache = {}
+        self.image_cache = {}
+        self.truncated = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.buffer.close()
+
+    def add_view(self, data, target=None):
+        """
+        Appends bytes to the binary chunk, 4 byte aligned, and returns the
+        index of their buffer view
+        """
+        view = {"buffer": 0, "byteOffset": self.buffer_size,
+                "byteLength": len(data)}
+        if (target is not None):
+            view["target"] = target
+        self.buffer.write(data)
+        padding = -len(data) % 4
+        self.buffer.write(b"\0" * padding)
+        self.buffer_size += len(data) + padding
+
+        self.gltf["bufferViews"].append(view)
+        return len(self.gltf["bufferViews"]) - 1
+
+    def add_accessor(self, values, component_type, accessor_type,
+                     target=None, bounds=False):
+        dtype = {UNSIGNED_SHORT: "<u2", UNSIGNED_INT: "<u4",
+                 FLOAT: "<f4"}[component_type]
+        values = np.ascontiguousarray(values, dtype=dtype)
+        count = len(values)
+        accessor = {
+            "bufferView": self.add_view(values.tobytes(), target),
+            "componentType": component_type,
+            "count": count,
+            "type": accessor_type,
+        }
+        if (bounds):
+            columns = values.reshape(count, -1)
+            accessor["min"] = columns.min(axis=0).tolist()
+            accessor["max"] = columns.max(axis=0).tolist()
+        self.gltf["accessors"].append(accessor)
+        return len(self.gltf["accessors"]) - 1
+
+    def zero_accessor(self, count, accessor_type):
+        """
+        An accessor without buffer view, which reads as zeros
+        """
+        width = {"SCALAR": 1, "VEC3": 3}[accessor_type]
+        self.gltf["accessors"].append({
+            "componentType": FLOAT, "count": count, "type": accessor_type,
+            "min": [0.0] * width, "max": [0.0] * width})
+        return len(self.gltf["accessors"]) - 1
+
+    def export_image(self, image):
+        if (image in self.image_cache):
+            return self.image_cache[image]
+
+        imgpath = bpy.path.abspath(image.filepath)
+        mime_type = IMAGE_TYPES.get(os.path.splitext(imgpath)[1].lower())
+        if (mime_type is not None and os.path.isfile(imgpath)):
+            with open(imgpath, "rb") as f:
+                gltf_image = {"name": image.name,
+                              "bufferView": self.add_view(f.read()),
+                              "mimeType": mime_type}
+        else:
+            # Formats glTF doesn't support stay next to the file
+            try:
+                uri = os.path.relpath(imgpath, os.path.dirname(self.path))
+            except ValueError:
+                uri = imgpath
+            gltf_image = {"name": image.name, "uri": uri.replace("\\", "/")}
+        log.material.debug("Image %s: %s", image.name, imgpath)
+
+        self.gltf["images"].append(gltf_image)
+        self.gltf["textures"].append(
+            {"source": len(self.gltf["images"]) - 1})
+        self.image_cache[image] = len(self.gltf["textures"]) - 1
+        return self.image_cache[image]
+
+    def export_material(self, material):
+        if (material in self.material_cache):
+            return self.material_cache[material]
+
+        color = list(material.diffuse_color)
+        if (len(color) == 3):
+            color.append(1.0)
+        pbr = {"baseColorFactor": color, "metallicFactor": 0.0}
+        gltf_material = {"name": material.name,
+                         "pbrMetallicRoughness": pbr,
+                         "doubleSided": bool(material.double_sided)}
+
+        base_color = material.texture("base_color_texture")
+        if (base_color is not None):
+            pbr["baseColorTexture"] = {"index": self.export_image(base_color)}
+        normal = material.texture("normalmap_texture")
+        if (normal is not None):
+            gltf_material["normalTexture"] = {
+                "index": self.export_image(normal)}
+
+        self.gltf["materials"].append(gltf_material)
+        self.material_cache[material] = len(self.gltf["materials"]) - 1
+        return self.material_cache[material]
+
+    def export_mesh(self, mesh):
+        if (mesh in self.mesh_cache):
+            return self.mesh_cache[mesh]
+        if (mesh.vertex_count == 0):
+            self.mesh_cache[mesh] = None
+            return None
+
+        attributes = {
+            "POSITION": self.add_accessor(
+                vectors(mesh.positions), FLOAT, "VEC3", ARRAY_BUFFER, True),
+            "NORMAL": self.add_accessor(
+                vectors(mesh.normals), FLOAT, "VEC3", ARRAY_BUFFER),
+        }
+        if (mesh.tangents is not None):
+            # The bitangent is only needed for the handedness
+            handedness = np.where(np.einsum(
+                "ij,ij->i", np.cross(mesh.normals, mesh.tangents),
+                mesh.bitangents) < 0.0, -1.0, 1.0)
+            attributes["TANGENT"] = self.add_accessor(
+                np.column_stack((vectors(mesh.tangents), handedness)),
+                FLOAT, "VEC4", ARRAY_BUFFER)
+        for uvi, uv in enumerate(mesh.uvs):
+            # glTF UVs start at the top of the image
+            attributes["TEXCOORD_{}".format(uvi)] = self.add_accessor(
+                np.column_stack((uv[:, 0], 1.0 - uv[:, 1])), FLOAT, "VEC2",
+                ARRAY_BUFFER)
+        if (mesh.colors is not None):
+            attributes["COLOR_0"] = self.add_accessor(
+                mesh.colors, FLOAT, "VEC4", ARRAY_BUFFER)
+        if (mesh.skin is not None):
+            joints, weights, truncated = limit_influences(
+                mesh.skin.bones, mesh.skin.weights)
+            self.truncated += truncated
+            attributes["JOINTS_0"] = self.add_accessor(
+                joints, UNSIGNED_SHORT, "VEC4", ARRAY_BUFFER)
+            attributes["WEIGHTS_0"] = self.add_accessor(
+                weights, FLOAT, "VEC4", ARRAY_BUFFER)
+
+        # Morph targets are offsets from the base mesh
+        targets = []
+        use_normals = any(t.normals is not None for t in mesh.morph_targets)
+        for target in mesh.morph_targets:
+            gltf_target = {}
+            if (target.positions is not None):
+                gltf_target["POSITION"] = self.add_accessor(
+                    vectors(target.positions - mesh.positions), FLOAT,
+                    "VEC3", ARRAY_BUFFER, True)
+            else:
+                gltf_target["POSITION"] = self.zero_accessor(
+                    mesh.vertex_count, "VEC3")
+            if (target.normals is not None):
+                gltf_target["NORMAL"] = self.add_accessor(
+                    vectors(target.normals - mesh.normals), FLOAT, "VEC3",
+                    ARRAY_BUFFER)
+            elif (use_normals):
+                gltf_target["NORMAL"] = self.zero_accessor(
+                    mesh.vertex_count, "VEC3")
+            targets.append(gltf_target)
+
+        # 0xFFFF is reserved for primitive restart
+        index_type = UNSIGNED_SHORT
+        if (mesh.vertex_count >= 0xFFFF):
+            index_type = UNSIGNED_INT
+
+        primitives = []
+        for surface in mesh.surfaces:
+            indices = surface.indices
+            if (mesh.primitive != "triangles"):
+                indices = fan_triangles(indices, surface.sizes)
+            if (not len(indices)):
+                continue
+            primitive = {"attributes": attributes,
+                         "indices": self.add_accessor(
+                             indices, index_type, "SCALAR",
+                             ELEMENT_ARRAY_BUFFER)}
+            if (surface.material is not None):
+                primitive["material"] = self.export_material(surface.material)
+            if (targets):
+                primitive["targets"] = targets
+            primitives.append(primitive)
+
+        if (not primitives):
+            self.mesh_cache[mesh] = None
+            return None
+
+        gltf_mesh = {"name": mesh.name, "primitives": primitives}
+        if (targets):
+            gltf_mesh["weights"] = [0.0] * len(targets)
+            gltf_mesh["extras"] = {
+                "targetNames": [t.name for t in mesh.morph_targets]}
+        self.gltf["meshes"].append(gltf_mesh)
+        self.mesh_cache[mesh] = len(self.gltf["meshes"]) - 1
+        return self.mesh_cache[mesh]
+
+    def export_skin(self, skin):
+        if (skin in self.skin_cache):
+            return self.skin_cache[skin]
+
+        bones = skin.skeleton.bones
+        # Vertices are in mesh space, glTF has no bind shape matrix
+        inverse_binds = np.array([
+            self.to_y_up(b.bind_pose @ skin.bind_shape_matrix).T
+            for b in bones])
+        gltf_skin = {
+            "joints": [self.bone_index[b] for b in bones],
+            "inverseBindMatrices": self.add_accessor(
+                inverse_binds.reshape(-1, 16), FLOAT, "MAT4"),
+        }
+        self.gltf["skins"].append(gltf_skin)
+        self.skin_cache[skin] = len(self.gltf["skins"]) - 1
+        return self.skin_cache[skin]
+
+    def export_camera(self, camera):
+        if (camera.type == "PERSP"):
+            gltf_camera = {"type": "perspective", "perspective": {
+                "aspectRatio": camera.aspect_ratio, "yfov": camera.angle,
+                "znear": camera.clip_start, "zfar": camera.clip_end}}
+        else:
+            xmag = camera.ortho_scale * 0.5
+            gltf_camera = {"type": "orthographic", "orthographic": {
+                "xmag": xmag, "ymag": xmag / camera.aspect_ratio,
+                "znear": camera.clip_start, "zfar": camera.clip_end}}
+        gltf_camera["name"] = camera.name
+        self.gltf["cameras"].append(gltf_camera)
+        return len(self.gltf["cameras"]) - 1
+
+    def to_y_up(self, mtx):
+        return Y_UP @ mtx @ Y_UP.T
+
+    def node_matrices(self, node, matrices):
+        """
+        Converts (n, 4, 4) local matrices of a node to glTF
+        """
+        pre, post = self.node_fix[node]
+        return pre @ Y_UP @ matrices @ Y_UP.T @ post
+
+    def set_transform(self, gltf_node, matrix):
+        translation, rotation, scale = decompose(matrix[None])
+        if (translation[0].any()):
+            gltf_node["translation"] = translation[0].tolist()
+        if (not np.array_equal(rotation[0], (0.0, 0.0, 0.0, 1.0))):
+            gltf_node["rotation"] = rotation[0].tolist()
+        if (not np.array_equal(scale[0], (1.0, 1.0, 1.0))):
+            gltf_node["scale"] = scale[0].tolist()
+
+    def add_node(self, name, matrix):
+        gltf_node = {"name": name}
+        self.set_transform(gltf_node, matrix)
+        self.gltf["nodes"].append(gltf_node)
+        return len(self.gltf["nodes"]) - 1, gltf_node
+
+    def export_bone(self, bone):
+        # Relative to the closest exported ancestor, which may not be the
+        # Blender parent when control bones are excluded
+        if (bone.parent is None):
+            matrix = bone.matrix
+        else:
+            matrix = bone.parent.bind_pose @ np.linalg.inv(bone.bind_pose)
+        index, gltf_node = self.add_node(bone.name, self.to_y_up(matrix))
+        self.bone_index[bone] = index
+
+        children = [self.export_bone(c) for c in bone.children]
+        if (children):
+            gltf_node["children"] = children
+        return index
+
+    def export_node(self, node, parent=None):
+        # Cameras look down -Z in both, which is -Y once converted
+        pre = np.eye(4)
+        post = np.eye(4)
+        if (parent is not None and parent.type == "CAMERA"):
+            pre = Y_UP.T
+        if (node.type == "CAMERA"):
+            post = Y_UP
+        self.node_fix[node] = (pre, post)
+
+        index, gltf_node = self.add_node(
+            node.name, self.node_matrices(node, node.matrix))
+        self.node_index[node] = index
+        children = []
+
+        if (isinstance(node.data, scene_ir.Mesh)):
+            mesh = self.export_mesh(node.data)
+            if (mesh is not None):
+                gltf_node["mesh"] = mesh
+                self.mesh_nodes.setdefault(node.data, []).append(index)
+                if (node.data.skin is not None):
+                    self.skinned_nodes.append((gltf_node, node.data.skin))
+        elif (isinstance(node.data, scene_ir.Skeleton)):
+            children += [self.export_bone(b) for b in node.data.roots()]
+        elif (isinstance(node.data, scene_ir.Camera)):
+            gltf_node["camera"] = self.export_camera(node.data)
+
+        children += [self.export_node(c, node) for c in node.children]
+        if (children):
+            gltf_node["children"] = children
+        return index
+
+    def export_animation(self, name, tracks):
+        samplers = []
+        channels = []
+        inputs = {}
+
+        def sampler(times, values, accessor_type):
+            key = times.tobytes()
+            if (key not in inputs):
+                inputs[key] = self.add_accessor(
+                    times, FLOAT, "SCALAR", bounds=True)
+            samplers.append({"input": inputs[key], "interpolation": "LINEAR",
+                             "output": self.add_accessor(
+                                 values, FLOAT, accessor_type)})
+            return len(samplers) - 1
+
+        morphs = {}
+        for track in tracks:
+            if (track.kind == scene_ir.MORPH):
+                morphs.setdefault(track.target, []).append(track)
+                continue
+
+            if (track.kind == scene_ir.NODE):
+                node = self.node_index[track.target]
+                matrices = self.node_matrices(track.target, track.values)
+            else:
+                node = self.bone_index[track.target]
+                matrices = self.to_y_up(track.values)
+
+            translation, rotation, scale = decompose(matrices)
+            for path, values, accessor_type in (
+                    ("translation", translation, "VEC3"),
+                    ("rotation", continuous(rotation), "VEC4"),
+                    ("scale", scale, "VEC3")):
+                channels.append({
+                    "sampler": sampler(track.times, values, accessor_type),
+                    "target": {"node": node, "path": path}})
+
+        # glTF animates the weights of all targets of a mesh at once
+        for mesh, mesh_tracks in morphs.items():
+            if (mesh not in self.mesh_nodes):
+                continue
+            times = mesh_tracks[0].times
+            weights = np.zeros((len(times), len(mesh.morph_targets)))
+            for track in mesh_tracks:
+                if (len(track.times) == len(times)):
+                    weights[:, track.index] = track.values
+            output = sampler(times, weights.ravel(), "SCALAR")
+            for node in self.mesh_nodes[mesh]:
+                channels.append({"sampler": output,
+                                 "target": {"node": node, "path": "weights"}})
+
+        if (channels):
+            self.gltf["animations"].append(
+                {"name": name, "channels": channels, "samplers": samplers})
+
+    def export(self, scene):
+        """
+        Writes the scene_ir.Scene scene to the output file
+        """
+        for node in scene.roots:
+            self.gltf["scenes"][0]["nodes"].append(self.export_node(node))
+
+        # Skins need the nodes of all bones
+        for gltf_node, skin in self.skinned_nodes:
+            gltf_node["skin"] = self.export_skin(skin)
+
+        if (scene.clips is not None):
+            for clip in scene.clips:
+                self.export_animation(clip.name, clip.tracks)
+        else:
+            self.export_animation("Scene", scene.tracks)
+
+        if (self.truncated):
+            self.operator.report(
+                {"WARNING"},
+                "{} vertices have more than {} bone influences, the "
+                "smallest ones were dropped.".format(
+                    self.truncated, MAX_INFLUENCES))
+
+        gltf = {k: v for k, v in self.gltf.items() if v != []}
+        if (self.buffer_size):
+            gltf["buffers"] = [{"byteLength": self.buffer_size}]
+
+        document = json.dumps(
+            gltf, separators=(",", ":"), allow_nan=False).encode("utf-8")
+        document += b" " * (-len(document) % 4)
+
+        try:
+            f = open(self.path, "wb")
+        except:
+            return False
+
+        with f:
+            length = 12 + 8 + len(document)
+            if (self.buffer_size):
+                length += 8 + self.buffer_size
+            f.write(struct.pack("<4sII", b"glTF", 2, length))
+            f.write(struct.pack("<I4s", len(document), b"JSON"))
+            f.write(document)
+            if (self.buffer_size):
+                f.write(struct.pack("<I4s", self.buffer_size, b"BIN\0"))
+                self.buffer.seek(0)
+                shutil.copyfileobj(
+                    self.buffer, f, section_writer.COPY_BUFFER)
+        return True
+
+
+def compare_dae(operator, scene, filepath, kwargs):
+    """
+    Writes the same scene as Collada to a temporary file and returns the
+    time it took and the size of the file
+    """
+    config = dict(kwargs)
+    config.update(DAE_COMPARISON)
+    directory = tempfile.mkdtemp(prefix="glb-")
+    try:
+        path = os.path.join(directory, os.path.splitext(
+            os.path.basename(filepath))[0] + ".dae")
+        start = time.perf_counter()
+        with export_dae.DaeExporter(path, config, operator) as exp:
+            exp.export(scene)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(path) if os.path.isfile(path) else 0
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return elapsed, size
+
+
+def save(operator, context, filepath="", use_selection=False, **kwargs):
+    # glTF only has triangles, and the output only depends on the scene
+    kwargs["use_triangles"] = True
+    kwargs["use_deterministic"] = True
+
+    start = time.perf_counter()
+    with scene_extract.SceneExtractor(kwargs, operator) as extractor:
+        scene = extractor.extract()
+    extracted = time.perf_counter()
+    with GlbExporter(filepath, kwargs, operator) as exp:
+        exported = exp.export(scene)
+    end = time.perf_counter()
+    log.addon.info(
+        "Extracted the scene in %.2f s, wrote it in %.2f s",
+        extracted - start, end - extracted)
+
+    if (kwargs["use_scene_dump"]):
+        with open(filepath + ".scene.json", "w", encoding="utf-8") as f:
+            json.dump(scene_ir.dump(scene), f, indent=1)
+
+    if exported and os.path.isfile(filepath):
+        size = os.path.getsize(filepath)
+        operator.report(
+            {"INFO"},
+            "Wrote {} ({:.1f} MiB) in {:.2f} s (reading the scene {:.2f} s, "
+            "writing {:.2f} s)".format(
+                os.path.basename(filepath), size / 1048576.0, end - start,
+                extracted - start, end - extracted))
+
+        if (kwargs["use_compare_dae"]):
+            dae_time, dae_size = compare_dae(
+                operator, scene, filepath, kwargs)
+            operator.report(
+                {"INFO"},
+                "Same scene as Collada: writing {:.2f} s ({:.1f}x the glTF "
+                "time), {:.1f} MiB ({:.1f}x the glTF size)".format(
+                    dae_time, dae_time / max(end - extracted, 1e-9),
+                    dae_size / 1048576.0, dae_size / max(size, 1)))
+
+    return {"FINISHED"}
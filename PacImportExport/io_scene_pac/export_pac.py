@@ -3,8 +3,17 @@ import bpy
 import time
 import subprocess
 from . import export_dae
+from . import file_cache
+from . import log
 
-def exec(filepath, operator, context, **kwargs):
+# Bumped whenever what the build cache stores changes
+BUILD_CACHE_VERSION = 2
+PACTOOL_OPTIONS = "-r -replaceAllLOD -colorCoding"
+# Export PAC operator properties that are not options of exec
+IGNORED_PROPERTIES = ("axis_forward", "axis_up", "global_scale",
+                      "check_existing", "filter_glob", "xna_validate")
+
+def exec(filepath, operator, context, class_abbreviation=None, **kwargs):
     
     # Access the selected file's full filepath and filename
     full_pac_path = filepath
@@ -16,10 +25,27 @@ def exec(filepath, operator, context, **kwargs):
     # get the path of the generated DAE file
     full_path_to_dae = os.path.join(pac_dir_path, f"{pac_filename}_mesh00_lod0.dae")
     
+    build_cache = None
+    if kwargs["use_build_cache"]:
+        build_cache = file_cache.addon_cache("pac")
+        # The DAE is part of the build key, a timestamp would change it on
+        # every export
+        kwargs["use_timestamps"] = False
+    
     # execute the save dae file method
     save_dae_file(full_path_to_dae, operator, context, **kwargs)
     
-    return export_pac_file(full_pac_path, pac_filename, full_path_to_dae)
+    result = export_pac_file(
+        full_pac_path, pac_filename, full_path_to_dae, build_cache,
+        class_abbreviation)
+    
+    if build_cache is not None:
+        build_cache.evict()
+        log.pactool.info("Build cache: %s", build_cache.summary())
+        if build_cache.hits:
+            operator.report({"INFO"}, "PAC taken from the build cache, "
+                                      "PACtool was not run")
+    return result
 
 
 def save_dae_file(full_path_to_dae, operator, context, **kwargs):
@@ -27,41 +53,88 @@ def save_dae_file(full_path_to_dae, operator, context, **kwargs):
     Saves a scene in blender as a DAE file, 
     using the better collada exporter
     """
-    print(f'Saving DAE: {full_path_to_dae}')
+    log.pactool.info("Saving DAE: %s", full_path_to_dae)
+    # The PACtool only reads plain, uncompressed Collada
+    kwargs["output_format"] = "DAE"
+    kwargs["compression_level"] = 0
     export_dae.save(operator, context, filepath=full_path_to_dae, **kwargs)
 
-def export_pac_file(full_pac_path, pac_filename, full_path_to_dae):
+def export_pac_file(full_pac_path, pac_filename, full_path_to_dae, build_cache=None, class_abbreviation=None):
     """
     Converts an scene in blender (which was previously saved by the export_dae.save() function)
-    to an .pac file.
+    to an .pac file. Results found in build_cache are copied instead.
     """
-    print('Exporting PAC')
+    log.pactool.info("Exporting PAC: %s", full_pac_path)
     
     # Check if the full_pac_path variable doesn't end in ".pac"
     if not full_pac_path.endswith('.pac'):
         # Append ".pac" to the variable
         full_pac_path += '.pac'
     
-    # Get the first three letters of the pac-file-name
-    class_abbreviation = pac_filename[:3]
+    # Get the first three letters of the pac-file-name, unless given
+    if not class_abbreviation:
+        class_abbreviation = pac_filename[:3]
     
     if os.path.exists(full_path_to_dae):
         # execute the pactool
-        full_path_to_dae = run_pactool(full_pac_path, full_path_to_dae, class_abbreviation)
+        full_path_to_dae = run_pactool(full_pac_path, full_path_to_dae, class_abbreviation, build_cache)
     else:
-        print(f'ERROR: The DAE file does not exist: {full_path_to_dae}')
+        log.pactool.error("The DAE file does not exist: %s", full_path_to_dae)
         full_path_to_dae = ''
     
     # only export the pac, if it was set
     if full_path_to_dae is not None and full_path_to_dae != '':
-        print('DONE')
+        log.pactool.info("Done: %s", full_pac_path)
         return {'FINISHED'}
     
     return {'CANCELLED'}
 
-def run_pactool(full_pac_path, full_path_to_dae, class_abbreviation):
+def build_key(full_pac_path, full_path_to_dae, pactool_exe, pab_path):
     """
-    Executes the pactool to convert an DAE to a PAC file
+    Digest of everything a pactool run depends on: the DAE, the PAC it
+    replaces the LODs of, the skeleton, the pactool itself and its options
+    """
+    content = file_cache.file_digest_or_none
+    return file_cache.digest(
+        BUILD_CACHE_VERSION, PACTOOL_OPTIONS, os.path.basename(pab_path),
+        content(pactool_exe), content(full_path_to_dae),
+        content(full_pac_path), content(pab_path))
+
+
+def cached_pac(build_cache, key):
+    """
+    The PAC stored for a build key, as (digest, contents), or None
+    """
+    reference = build_cache.get_json(key)
+    if reference is None:
+        return None
+    data = build_cache.get(reference["pac"])
+    if data is None:
+        return None
+    return reference["pac"], data
+
+
+def store_pac(build_cache, key, full_pac_path, full_path_to_dae, pactool_exe, pab_path):
+    """
+    Stores the PAC pactool wrote under the key of its inputs. Build keys
+    only reference the contents, so the PAC is stored once.
+    """
+    with open(full_pac_path, "rb") as f:
+        data = f.read()
+    pac_digest = file_cache.file_digest(full_pac_path)
+    build_cache.put(pac_digest, data)
+    build_cache.put_json(key, {"pac": pac_digest})
+    # The PAC already holds the LODs of this DAE, so exporting the same DAE
+    # onto it again keeps it as it is. This is safe whether or not the
+    # pactool gives the same bytes twice: the key holds the digest of this
+    # very PAC, so a hit finds the PAC already in place and writes nothing.
+    alias = build_key(full_pac_path, full_path_to_dae, pactool_exe, pab_path)
+    build_cache.put_json(alias, {"pac": pac_digest, "contains_dae": True})
+
+
+def pactool_paths(class_abbreviation):
+    """
+    The paths of the pactool and of the skeleton of a class
     """
     
     # Get the directory of the Python script
@@ -73,17 +146,43 @@ def run_pactool(full_pac_path, full_path_to_dae, class_abbreviation):
     # Specify the path to the bones directory
     bones_directory = os.path.join(script_directory, 'bones')
     
+    return pactool_exe, os.path.join(bones_directory, f"{class_abbreviation}_01.pab")
+
+
+def run_pactool(full_pac_path, full_path_to_dae, class_abbreviation, build_cache=None):
+    """
+    Executes the pactool to convert an DAE to a PAC file
+    """
+    
+    pactool_exe, pab_path = pactool_paths(class_abbreviation)
+    bones_directory = os.path.dirname(pab_path)
+    
+    key = None
+    if build_cache is not None:
+        key = build_key(full_pac_path, full_path_to_dae, pactool_exe, pab_path)
+        cached = cached_pac(build_cache, key)
+        if cached is not None:
+            pac_digest, data = cached
+            log.pactool.info("PAC found in the build cache: %s", full_pac_path)
+            # The PAC may already be the result
+            if not os.path.isfile(full_pac_path) or file_cache.file_digest(full_pac_path) != pac_digest:
+                with open(full_pac_path, "wb") as f:
+                    f.write(data)
+            return full_path_to_dae
+    
     # Specify the command as a string
-    command = f"{pactool_exe} -r -replaceAllLOD -colorCoding {full_path_to_dae} {full_pac_path} {bones_directory}\{class_abbreviation}_01.pab"
+    command = f"{pactool_exe} {PACTOOL_OPTIONS} {full_path_to_dae} {full_pac_path} {bones_directory}\{class_abbreviation}_01.pab"
     
-    # print out the command string
-    print(f'Executing pactool: {command}')
+    log.pactool.info("Executing pactool: %s", command)
     
     # Run the pactool command
-    subprocess.call(command, shell=True)
+    returncode = subprocess.call(command, shell=True)
     
     # sleep for 2 seconds to give the pactool some time to execute
     time.sleep(2)
     
+    if key is not None and returncode == 0 and os.path.isfile(full_pac_path):
+        store_pac(build_cache, key, full_pac_path, full_path_to_dae, pactool_exe, pab_path)
+    
     return full_path_to_dae
 
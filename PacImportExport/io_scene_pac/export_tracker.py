@@ -0,0 +1,261 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+Tracks what changed in the blend file between exports.
+
+A depsgraph_update_post handler stamps every datablock the depsgraph
+updates with a generation number. Datablocks are known by their session
+uid, not their name, which can change or be reused. Each exported file
+remembers the generation it was written at and the geometry cache key of
+every mesh object, so exporting it again only reads and hashes the
+objects that changed since. Loading a file, undo and redo forget everything, as they
+replace datablocks without reporting all of them.
+
+Exports change the scene themselves (rest pose, shape key values, frames),
+the updates they cause are ignored.
+"""
+
+import os
+import bpy
+from bpy.app.handlers import persistent
+from . import file_cache
+from . import log
+
+
+class Target:
+    """
+    What an exported file was made from: the generation, a digest of the
+    export options and, for each mesh object, its geometry cache key and
+    the keys and names of its dependencies
+    """
+
+    __slots__ = ("generation", "options", "meshes")
+
+    def __init__(self, generation, options, meshes):
+        self.generation = generation
+        self.options = options
+        self.meshes = meshes
+
+
+class Tracker:
+    """
+    Generation at which every datablock last changed, by datablock_key
+    """
+
+    __slots__ = ("generation", "changed", "targets", "suspended")
+
+    def __init__(self):
+        self.generation = 0
+        self.changed = {}
+        self.targets = {}
+        self.suspended = 0
+
+    def reset(self):
+        self.changed = {}
+        self.targets = {}
+
+    def stamp(self, depsgraph):
+        if (self.suspended):
+            return
+        self.generation += 1
+        for update in depsgraph.updates:
+            self.changed[datablock_key(update.id.original)] = self.generation
+
+    def changed_since(self, generation, datablocks):
+        for datablock in datablocks:
+            if (self.changed.get(datablock_key(datablock), 0) > generation):
+                return True
+        return False
+
+
+TRACKER = Tracker()
+
+
+def datablock_key(datablock):
+    """
+    Identifies a datablock for the session, whatever it is called
+    """
+    uid = getattr(datablock, "session_uid", None)
+    if (uid is None):
+        return ("pointer", datablock.as_pointer())
+    return ("uid", uid)
+
+
+def direct_dependencies(datablock):
+    """
+    The datablocks datablock uses: its data and shape keys, parent,
+    modifier and constraint targets and the targets of its drivers
+    """
+    animated = [datablock]
+    data = getattr(datablock, "data", None)
+    if (data is not None):
+        yield data
+        animated.append(data)
+        shape_keys = getattr(data, "shape_keys", None)
+        if (shape_keys is not None):
+            yield shape_keys
+            animated.append(shape_keys)
+
+    parent = getattr(datablock, "parent", None)
+    if (parent is not None):
+        yield parent
+
+    targets = []
+    for modifier in getattr(datablock, "modifiers", ()):
+        targets.append(getattr(modifier, "object", None))
+        targets.append(getattr(modifier, "target", None))
+    for constraint in getattr(datablock, "constraints", ()):
+        targets.append(getattr(constraint, "target", None))
+        # Armature constraints have a list of targets
+        for sub in getattr(constraint, "targets", ()):
+            targets.append(sub.target)
+    for target in targets:
+        if isinstance(target, bpy.types.ID):
+            yield target
+
+    for owner in animated:
+        animation_data = owner.animation_data
+        if (animation_data is None):
+            continue
+        for fcurve in animation_data.drivers:
+            if (fcurve.driver is None):
+                continue
+            for variable in fcurve.driver.variables:
+                for target in variable.targets:
+                    if (target.id is not None):
+                        yield target.id
+
+
+def dependencies(node):
+    """
+    The datablocks the geometry of a mesh object is made from, directly or
+    through other datablocks
+    """
+    found = {}
+    pending = [node]
+    while pending:
+        datablock = pending.pop()
+        key = datablock_key(datablock)
+        if key not in found:
+            found[key] = datablock
+            pending.extend(direct_dependencies(datablock))
+    return list(found.values())
+
+
+def dependency_names(datablocks):
+    """
+    The keys and names of datablocks, which change when one is renamed or
+    replaced
+    """
+    return sorted((datablock_key(d), d.name) for d in datablocks)
+
+
+def options_digest(config):
+    return file_cache.digest(sorted(
+        (key, value) for key, value in config.items()
+        if isinstance(value, (bool, int, float, str))))
+
+
+class Incremental:
+    """
+    The previous export of filepath, when it was made with the same options
+    """
+
+    __slots__ = ("filepath", "options", "target", "reused")
+
+    def __init__(self, filepath, config):
+        self.filepath = os.path.abspath(filepath)
+        self.options = options_digest(config)
+        self.target = TRACKER.targets.get(self.filepath)
+        if (self.target is not None and self.target.options != self.options):
+            self.target = None
+        self.reused = 0
+
+    def clean_key(self, node):
+        """
+        The geometry cache key node had in the previous export, if nothing
+        it is made from changed since
+        """
+        if (self.target is None):
+            return None
+        previous = self.target.meshes.get(datablock_key(node))
+        if (previous is None):
+            return None
+        key, names = previous
+        datablocks = dependencies(node)
+        if (dependency_names(datablocks) != names or TRACKER.changed_since(
+                self.target.generation, datablocks)):
+            return None
+        return key
+
+    def finish(self, extractor):
+        """
+        Remembers the meshes of a successful export
+        """
+        meshes = {}
+        for node in extractor.valid_nodes:
+            ir_mesh = extractor.mesh_cache.get(node.data)
+            if (ir_mesh is not None and ir_mesh.cache_key is not None):
+                meshes[datablock_key(node)] = (
+                    ir_mesh.cache_key, dependency_names(dependencies(node)))
+        TRACKER.targets[self.filepath] = Target(
+            TRACKER.generation, self.options, meshes)
+        log.addon.info(
+            "Incremental export: %d of %d meshes unchanged", self.reused,
+            len(meshes))
+
+
+def suspend():
+    TRACKER.suspended += 1
+
+
+def resume():
+    """
+    Evaluates the changes an export restored before listening again
+    """
+    bpy.context.evaluated_depsgraph_get()
+    TRACKER.suspended -= 1
+
+
+@persistent
+def on_depsgraph_update(scene, depsgraph):
+    TRACKER.stamp(depsgraph)
+
+
+@persistent
+def on_reload(*args):
+    TRACKER.reset()
+
+
+RELOAD_HANDLERS = ("load_post", "undo_post", "redo_post")
+
+
+def register():
+    bpy.app.handlers.depsgraph_update_post.append(on_depsgraph_update)
+    for name in RELOAD_HANDLERS:
+        getattr(bpy.app.handlers, name).append(on_reload)
+
+
+def unregister():
+    handlers = bpy.app.handlers
+    if on_depsgraph_update in handlers.depsgraph_update_post:
+        handlers.depsgraph_update_post.remove(on_depsgraph_update)
+    for name in RELOAD_HANDLERS:
+        if on_reload in getattr(handlers, name):
+            getattr(handlers, name).remove(on_reload)
+    TRACKER.reset()
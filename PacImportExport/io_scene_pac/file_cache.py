@@ -0,0 +1,330 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+A content addressed cache of files on disk.
+
+Entries are named by a digest of everything they were made from, so they
+never need to be invalidated: a changed input simply has another key. The
+cache is kept under a size limit by removing the least recently used
+entries, reading an entry counts as using it.
+
+An entry is either compressed bytes or a directory of files, for tools that
+write several files that are used where they are.
+
+Caches can share their size limit: evicting from one removes the least
+recently used entries of them all.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import zlib
+import numpy as np
+
+DEFAULT_SIZE = 512  # MiB
+# The caches of the add-on, in the cache directory of its preferences
+CACHE_NAMES = ("geometry", "pac", "import")
+# Age after which a directory left by new_directory belongs to no export
+STALE_AGE = 3600  # seconds
+
+
+def _update(h, value):
+    if isinstance(value, np.ndarray):
+        h.update("a{}{}".format(value.dtype.str, value.shape).encode("ascii"))
+        h.update(np.ascontiguousarray(value).data)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        h.update(b"b%d:" % len(value))
+        h.update(value)
+    elif isinstance(value, str):
+        value = value.encode("utf-8")
+        h.update(b"s%d:" % len(value))
+        h.update(value)
+    elif isinstance(value, (list, tuple)):
+        h.update(b"l%d:" % len(value))
+        for item in value:
+            _update(h, item)
+    else:
+        # Numbers, booleans and None
+        h.update("r{!r};".format(value).encode("utf-8"))
+
+
+def digest(*parts):
+    """
+    Hex digest of strings, bytes, numbers, NumPy arrays and nested lists of
+    them. Arrays are hashed with their type and shape.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    _update(h, parts)
+    return h.hexdigest()
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Digest of the contents of a file
+    """
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_digest_or_none(path):
+    """
+    Digest of the contents of a file, or None if there is no such file
+    """
+    if os.path.isfile(path):
+        return file_digest(path)
+    return None
+
+
+def default_directory():
+    return os.path.join(tempfile.gettempdir(), "io_scene_pac_cache")
+
+
+class FileCache:
+    """
+    Compressed entries and directories in directory, at most max_size
+    bytes of them, with those of the caches in the shared directories, once
+    the cache is closed. Counts hits, misses and evicted entries.
+    """
+
+    __slots__ = ("directory", "shared", "max_size", "hits", "misses",
+                 "stored", "evicted")
+
+    def __init__(self, directory, max_size, shared=()):
+        self.directory = directory
+        self.shared = tuple(shared)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.evict()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """
+        The bytes stored under key, or None
+        """
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = zlib.decompress(f.read())
+            # The modification time orders entries for eviction
+            os.utime(path)
+        except (OSError, zlib.error):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key, data, level=1):
+        """
+        Stores bytes under key. The entry appears at once, complete, so
+        concurrent exports never read a partial entry.
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(zlib.compress(data, level))
+            os.replace(temp, path)
+        except OSError:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            return False
+        self.stored += 1
+        return True
+
+    def get_directory(self, key):
+        """
+        The path of the directory stored under key, or None
+        """
+        path = self.path(key)
+        if not os.path.isdir(path):
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return path
+
+    def new_directory(self):
+        """
+        A temporary directory to fill and put_directory, on the same file
+        system as the cache
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        return tempfile.mkdtemp(dir=self.directory, prefix="tmp-")
+
+    def put_directory(self, key, directory):
+        """
+        Moves a directory from new_directory into the cache, returns its
+        new path
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.replace(directory, path)
+        except OSError:
+            # Stored meanwhile by another export
+            shutil.rmtree(directory, ignore_errors=True)
+            if not os.path.isdir(path):
+                return None
+            return path
+        self.stored += 1
+        return path
+
+    def get_json(self, key):
+        data = self.get(key)
+        if (data is None):
+            return None
+        try:
+            return json.loads(data.decode("utf-8"))
+        except ValueError:
+            return None
+
+    def put_json(self, key, value):
+        return self.put(key, json.dumps(value).encode("utf-8"))
+
+    def directories(self):
+        """
+        The directories of this cache and of those sharing its size
+        """
+        return (self.directory,) + self.shared
+
+    def entries(self):
+        """
+        (modification time, size, path) of every entry, in this cache and
+        those sharing its size
+        """
+        result = []
+        for directory in self.directories():
+            result += _entries(directory)
+        return result
+
+    def size(self):
+        return sum(size for mtime, size, path in self.entries())
+
+    def remove_stale(self):
+        """
+        Removes the directories of new_directory that were neither put nor
+        removed, by exports that failed or were killed
+        """
+        deadline = time.time() - STALE_AGE
+        for directory in self.directories():
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stale = (name.startswith("tmp-") and
+                             os.path.isdir(path) and
+                             os.stat(path).st_mtime < deadline)
+                except OSError:
+                    continue
+                if stale:
+                    shutil.rmtree(path, ignore_errors=True)
+
+    def evict(self):
+        """
+        Removes stale directories, then the least recently used entries
+        until the caches sharing the size fit max_size
+        """
+        self.remove_stale()
+        entries = sorted(self.entries())
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if (total <= self.max_size):
+                break
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evicted += 1
+        return total
+
+    def summary(self):
+        return "{} hits, {} misses, {} stored, {} evicted".format(
+            self.hits, self.misses, self.stored, self.evicted)
+
+
+def _entries(directory):
+    """
+    (modification time, size, path) of every entry of the cache in
+    directory
+    """
+    result = []
+    if not os.path.isdir(directory):
+        return result
+    for prefix in os.listdir(directory):
+        folder = os.path.join(directory, prefix)
+        if len(prefix) != 2 or not os.path.isdir(folder):
+            continue
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            size = st.st_size
+            if os.path.isdir(path):
+                size = sum(
+                    os.path.getsize(os.path.join(root, f))
+                    for root, dirs, files in os.walk(path) for f in files)
+            result.append((st.st_mtime, size, path))
+    return result
+
+
+def addon_cache(name):
+    """
+    The cache called name, in the directory and with the size set in the
+    add-on preferences. The caches of the add-on share that size.
+    """
+    import bpy
+
+    directory = ""
+    size = DEFAULT_SIZE
+    addon = bpy.context.preferences.addons.get(__package__)
+    if addon is not None:
+        directory = bpy.path.abspath(addon.preferences.cache_directory)
+        size = addon.preferences.cache_size
+    if not directory:
+        directory = default_directory()
+    shared = [os.path.join(directory, other)
+              for other in CACHE_NAMES if other != name]
+    return FileCache(os.path.join(directory, name), size * 1048576, shared)
@@ -1,19 +1,50 @@
 import os
 import bpy
 import time
+import shutil
 import subprocess
+from . import file_cache
+from . import log
+from . import export_pac
 
+# Bumped whenever what the conversion cache stores changes
+CONVERSION_CACHE_VERSION = 1
+PACTOOL_OPTIONS = "-c -refAllBones"
 
-def exec(filepath):
+
+def exec(filepath, operator):
     """
     Called when the operator is executed
     """
-    return import_pac_file(filepath)
+    conversion_cache = file_cache.addon_cache("import")
+    result = import_pac_file(filepath, conversion_cache)
+    conversion_cache.evict()
+    
+    summary = "Conversion cache: " + conversion_cache.summary()
+    log.pactool.info(summary)
+    operator.report({"INFO"}, summary)
+    return result
+
+
+def conversion_key(full_pac_path, pactool_exe, pab_path):
+    """
+    Digest of everything a conversion depends on: the PAC, its name (the
+    DAE is named after it), the skeleton, the pactool and its options
+    """
+    content = file_cache.file_digest_or_none
+    return file_cache.digest(
+        CONVERSION_CACHE_VERSION, PACTOOL_OPTIONS,
+        os.path.basename(full_pac_path), os.path.basename(pab_path),
+        content(pactool_exe), content(full_pac_path), content(pab_path))
 
 
-def import_pac_file(filepath):
+def import_pac_file(filepath, conversion_cache):
     """
     Converts an .pac file into an DAE file, importable by blender.
+    
+    The pactool writes the DAE next to the PAC, so it converts a copy of
+    the PAC in a directory of conversion_cache, where the DAE stays for the
+    next import of the same PAC.
     """
     
     # Access the selected file's full filepath and filename
@@ -28,20 +59,53 @@ def import_pac_file(filepath):
     # Get the first three letters of the pac-file-name
     class_abbreviation = pac_filename[:3]
 
-    # get the directory of the pacfile
-    pac_dir_path = os.path.dirname(full_pac_path)
+    if not os.path.isfile(full_pac_path):
+        log.pactool.error("The PAC file does not exist: %s", full_pac_path)
+        return {'CANCELLED'}
+    
+    pactool_exe, pab_path = export_pac.pactool_paths(class_abbreviation)
+    key = conversion_key(full_pac_path, pactool_exe, pab_path)
     
-    # path and name of the mesh0_lod0 dae file
-    full_path_to_dae = os.path.join(pac_dir_path, f"{pac_filename}_mesh00_lod0.dae")
+    # name of the mesh0_lod0 dae file
+    dae_filename = f"{pac_filename}_mesh00_lod0.dae"
     
-    # check if the mesh0_lod0 dae file already exists, and if the pactool needs to execute
-    if not os.path.exists(full_path_to_dae):
-        # execute the pactool
-        full_path_to_dae = run_pactool(full_pac_path, full_path_to_dae, class_abbreviation)
+    # check if the pac was already converted, and if the pactool needs to execute
+    cache_dir_path = conversion_cache.get_directory(key)
+    if cache_dir_path is not None and os.path.exists(os.path.join(cache_dir_path, dae_filename)):
+        log.pactool.info("PAC found in the conversion cache: %s", full_pac_path)
+        full_path_to_dae = os.path.join(cache_dir_path, dae_filename)
+    else:
+        work_dir_path = conversion_cache.new_directory()
+        stored = False
+        try:
+            work_pac_path = os.path.join(work_dir_path, os.path.basename(full_pac_path))
+            shutil.copyfile(full_pac_path, work_pac_path)
+            
+            # execute the pactool
+            full_path_to_dae = run_pactool(
+                work_pac_path, os.path.join(work_dir_path, dae_filename), class_abbreviation)
+            
+            # keep what the pactool wrote, without the copy of the pac
+            try:
+                os.remove(work_pac_path)
+            except OSError:
+                # the pactool may still hold it, then the entry keeps it
+                log.pactool.warning("Could not remove %s", work_pac_path)
+            
+            if full_path_to_dae:
+                cache_dir_path = conversion_cache.put_directory(key, work_dir_path)
+                stored = True
+                full_path_to_dae = ''
+                if cache_dir_path is not None:
+                    full_path_to_dae = os.path.join(cache_dir_path, dae_filename)
+        finally:
+            # never leave a failed conversion in the cache directory
+            if not stored:
+                shutil.rmtree(work_dir_path, ignore_errors=True)
     
     # only import the dae, if it was set
     if full_path_to_dae is not None and full_path_to_dae != '':
-        print(f'Importing collada: {full_path_to_dae}')
+        log.pactool.info("Importing collada: %s", full_path_to_dae)
         # Run the Collada import operator with the full path to the DAE file
         bpy.ops.wm.collada_import(filepath=full_path_to_dae, filter_blender=False)
         return {'FINISHED'}
@@ -54,20 +118,13 @@ def run_pactool(full_pac_path, full_path_to_dae, class_abbreviation):
     Executes the pactool in conversion mode to convert an PAC to a DAE file
     """
     
-    # Get the directory of the Python script
-    script_directory = os.path.dirname(os.path.abspath(__file__))
-
-    # Specify the path to the pactool file (assuming it's in the same directory)
-    pactool_exe = os.path.join(script_directory, 'PACtool.exe')
-    
-    # Specify the path to the bones directory
-    bones_directory = os.path.join(script_directory, 'bones')
+    pactool_exe, pab_path = export_pac.pactool_paths(class_abbreviation)
+    bones_directory = os.path.dirname(pab_path)
     
     # Specify the command as a string
-    command = f"{pactool_exe} -c -refAllBones {full_pac_path} {bones_directory}\{class_abbreviation}_01.pab"
+    command = f"{pactool_exe} {PACTOOL_OPTIONS} {full_pac_path} {bones_directory}\{class_abbreviation}_01.pab"
     
-    # print out the command string
-    print(f'Executing pactool: {command}')
+    log.pactool.info("Executing pactool: %s", command)
     
     # Run the pactool command
     return_code = subprocess.call(command, shell=True)
@@ -85,8 +142,9 @@ def run_pactool(full_pac_path, full_path_to_dae, class_abbreviation):
                 return full_path_to_dae
         
         if elapsed_time >= 5:
-            print(f'ERROR: The file {full_path_to_dae} did not exist, '
-            'the PACtool did not complete within time')
+            log.pactool.error(
+                "The file %s did not exist, the PACtool did not complete "
+                "within time", full_path_to_dae)
             break
     
     return ''
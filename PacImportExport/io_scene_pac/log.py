@@ -0,0 +1,64 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+Loggers of the add-on, one per subsystem.
+
+All of them are children of a single add-on logger, which does not
+propagate to the root logger and defaults to WARNING. Messages below the
+configured level are dropped by the logger itself, before any formatting,
+so debug calls cost a level check while logging is off. Pass the values as
+arguments (log.mesh.debug("%s", name)) rather than formatting them first.
+"""
+
+import logging
+
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+
+addon = logging.getLogger(__package__)
+addon.setLevel(logging.WARNING)
+addon.propagate = False
+
+mesh = addon.getChild("mesh")
+material = addon.getChild("material")
+animation = addon.getChild("animation")
+pactool = addon.getChild("pactool")
+
+_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+def configure(level="WARNING", log_file=""):
+    """
+    Sets the level of every logger of the add-on and where messages go:
+    the console, and a file too if log_file is set
+    """
+    for handler in list(addon.handlers):
+        addon.removeHandler(handler)
+        handler.close()
+
+    formatter = logging.Formatter(_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        try:
+            handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+        except OSError as e:
+            addon.warning("Can't open log file %s: %s", log_file, e)
+
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        addon.addHandler(handler)
+    addon.setLevel(level)
@@ -0,0 +1,445 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+Bulk extraction of mesh attributes into NumPy arrays.
+
+Everything here reads Blender collections through foreach_get, so the cost
+of an export scales with the size of the arrays instead of the number of
+Python objects created per loop.
+"""
+
+import numpy as np
+
+
+def foreach_get(collection, attr, dtype, width=1):
+    """
+    Reads attr of every item of a bpy collection with a single call
+    """
+    arr = np.empty(len(collection) * width, dtype=dtype)
+    collection.foreach_get(attr, arr)
+    if width > 1:
+        return arr.reshape(-1, width)
+    return arr
+
+
+def poly_loops(loop_start, loop_total):
+    """
+    Returns the loop indices of the given polygons, concatenated in polygon
+    order
+    """
+    ends = np.cumsum(loop_total)
+    offsets = np.repeat(loop_start - (ends - loop_total), loop_total)
+    return offsets + np.arange(int(ends[-1]) if len(ends) else 0)
+
+
+class MeshArrays:
+    """
+    Per-loop attributes of an evaluated mesh
+    """
+
+    __slots__ = ("vertex_co", "loop_vertex", "positions", "normals",
+                 "tangents", "bitangents", "colors", "uvs", "face_loops",
+                 "face_sizes", "face_material", "face_smooth")
+
+    def __init__(self):
+        self.vertex_co = None
+        self.loop_vertex = None
+        self.positions = None
+        self.normals = None
+        self.tangents = None
+        self.bitangents = None
+        self.colors = None
+        self.uvs = []
+        self.face_loops = None
+        self.face_sizes = None
+        self.face_material = None
+        self.face_smooth = None
+
+    def packed(self):
+        """
+        Returns all float attributes as one (loops, columns) array, in the
+        order vertices are compared when welding
+        """
+        columns = [self.positions, self.normals]
+        columns += self.uvs
+        if self.colors is not None:
+            columns.append(self.colors)
+        if self.tangents is not None:
+            columns.append(self.tangents)
+            columns.append(self.bitangents)
+        return np.hstack(columns)
+
+    def packed_tolerances(self, position, normal, uv, tangent):
+        """
+        Returns the welding tolerance of every column of packed(). Colors
+        are always compared exactly.
+        """
+        columns = [[position] * 3, [normal] * 3]
+        columns += [[uv] * 2 for x in self.uvs]
+        if self.colors is not None:
+            columns.append([0.0] * 4)
+        if self.tangents is not None:
+            columns.append([tangent] * 6)
+        return np.array([t for c in columns for t in c], dtype=np.float32)
+
+
+def extract_mesh(mesh, use_tangents, use_colors, triangulate):
+    """
+    Reads the loops of a mesh in bulk. Split normals (and tangents, if
+    requested) must have been calculated beforehand.
+
+    Faces are the polygons of the mesh, or its loop triangles when
+    triangulating. Either way they reference the original loops, so no
+    triangulated copy of the mesh is needed.
+    """
+    ma = MeshArrays()
+
+    poly_material = foreach_get(mesh.polygons, "material_index", np.int32)
+    poly_smooth = foreach_get(mesh.polygons, "use_smooth", bool)
+    if triangulate:
+        mesh.calc_loop_triangles()
+        ma.face_loops = foreach_get(mesh.loop_triangles, "loops", np.int32, 3)
+        ma.face_loops = ma.face_loops.ravel()
+        ma.face_sizes = np.full(len(mesh.loop_triangles), 3, dtype=np.int32)
+        polygon = foreach_get(mesh.loop_triangles, "polygon_index", np.int32)
+        ma.face_material = poly_material[polygon]
+        ma.face_smooth = poly_smooth[polygon]
+    else:
+        loop_start = foreach_get(mesh.polygons, "loop_start", np.int32)
+        loop_total = foreach_get(mesh.polygons, "loop_total", np.int32)
+        ma.face_loops = poly_loops(loop_start, loop_total)
+        ma.face_sizes = loop_total
+        ma.face_material = poly_material
+        ma.face_smooth = poly_smooth
+
+    ma.loop_vertex = foreach_get(mesh.loops, "vertex_index", np.int32)
+    ma.vertex_co = foreach_get(mesh.vertices, "co", np.float32, 3)
+    ma.positions = ma.vertex_co[ma.loop_vertex]
+    ma.normals = foreach_get(mesh.loops, "normal", np.float32, 3)
+
+    for uv_layer in mesh.uv_layers:
+        ma.uvs.append(foreach_get(uv_layer.data, "uv", np.float32, 2))
+
+    if use_colors and len(mesh.color_attributes):
+        attr = mesh.color_attributes[0]
+        colors = foreach_get(attr.data, "color", np.float32, 4)
+        if attr.domain == "POINT":
+            colors = colors[ma.loop_vertex]
+        ma.colors = colors
+
+    if use_tangents:
+        ma.tangents = foreach_get(mesh.loops, "tangent", np.float32, 3)
+        sign = foreach_get(mesh.loops, "bitangent_sign", np.float32)
+        # Same as MeshLoop.bitangent, flipped back when the sign is negative
+        bitangents = np.cross(ma.normals, ma.tangents) * sign[:, None]
+        bitangents[sign < 0] *= sign[sign < 0, None]
+        ma.bitangents = bitangents.astype(np.float32)
+
+    return ma
+
+
+def vertex_groups(mesh):
+    """
+    The vertex group memberships of a mesh as flat vertex, group and
+    weight arrays, in vertex order
+    """
+    counts = [len(mv.groups) for mv in mesh.vertices]
+    vertex = np.repeat(np.arange(len(counts), dtype=np.int32), counts)
+    group = np.empty(len(vertex), dtype=np.int32)
+    weight = np.empty(len(vertex), dtype=np.float32)
+    i = 0
+    for mv in mesh.vertices:
+        for vg in mv.groups:
+            group[i] = vg.group
+            weight[i] = vg.weight
+            i += 1
+    return vertex, group, weight
+
+
+def skin_table(mesh, group_bones, min_weight=0.001, groups=None):
+    """
+    Resolves the bone influences of every vertex of a mesh once.
+
+    group_bones maps vertex group indices to bone indices (-1 for groups
+    that are not bones), groups the vertex_groups of the mesh if they were
+    already read. Returns dense (vertices, max_influences) bone and weight
+    arrays, padded with bone -1 and weight 0, and a mask of the vertices
+    that ended up without influences. Those get bone 0 with weight 1.
+    """
+    if groups is None:
+        groups = vertex_groups(mesh)
+    vertex, group, weight = groups
+    vertex_total = len(mesh.vertices)
+
+    bone = np.full(len(group), -1, dtype=np.int32)
+    known = group < len(group_bones)
+    bone[known] = group_bones[group[known]]
+
+    # TODO: Try using 0.0001 since Blender uses zero weight
+    keep = (bone >= 0) & (weight > min_weight)
+    vertex = vertex[keep]
+    bone = bone[keep]
+    weight = weight[keep]
+
+    # Influences keep the order of the vertex groups inside each vertex
+    influences = np.bincount(vertex, minlength=vertex_total)
+    unassigned = influences == 0
+    first = np.cumsum(influences) - influences
+    slot = np.arange(len(vertex)) - first[vertex]
+
+    width = max(int(influences.max()) if len(influences) else 0, 1)
+    bones = np.full((vertex_total, width), -1, dtype=np.int32)
+    weights = np.zeros((vertex_total, width), dtype=np.float32)
+    bones[vertex, slot] = bone
+    weights[vertex, slot] = weight
+
+    # TODO: Explore how to deal with zero-weight bones, which remain local
+    bones[unassigned, 0] = 0
+    weights[unassigned, 0] = 1.0
+    return bones, weights, unassigned
+
+
+def unique_rows(rows):
+    """
+    Finds the distinct rows of a 2D array with exact comparison.
+
+    Returns the index of the first occurrence of every distinct row, in order
+    of appearance, and for every row the index of its distinct row.
+    """
+    # Adding zero turns -0.0 into 0.0, which compare equal as floats
+    rows = np.ascontiguousarray(rows + rows.dtype.type(0))
+    keys = rows.view(
+        np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+    order = np.argsort(first)
+    remap = np.empty_like(order)
+    remap[order] = np.arange(len(order))
+    return first[order], remap[inverse.ravel()]
+
+
+# Cells along each axis of the weld grid at most, which keeps cell keys
+# exact in 64 bits
+MAX_GRID_CELLS = 1 << 20
+# The cell itself and half of its neighbours, the other half finds them
+NEIGHBOUR_CELLS = np.array(
+    [(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)
+     if (x, y, z) >= (0, 0, 0)], dtype=np.int64)
+
+
+def _grid_columns(rows, low, sizes, sample_size=4096):
+    """
+    The three columns whose grid cells tell the most rows apart, judged on
+    a sample of the rows
+    """
+    sample = rows[::max(1, len(rows) // sample_size)]
+    distinct = [
+        len(np.unique(np.floor((sample[:, i] - low[i]) / sizes[i])))
+        for i in range(rows.shape[1])]
+    # Positions first when all are alike
+    return np.argsort(-np.array(distinct), kind="stable")[:3]
+
+
+def _join(group, a, b):
+    """
+    Joins the groups of rows a and b. group holds the lowest row of the
+    group of every row, and still does afterwards.
+    """
+    while len(a):
+        # Hook both groups to the lower one, then point rows at it
+        lower = np.minimum(group[a], group[b])
+        np.minimum.at(group, group[a], lower)
+        np.minimum.at(group, group[b], lower)
+        while True:
+            parent = group[group]
+            if np.array_equal(parent, group):
+                break
+            group[:] = parent
+        apart = group[a] != group[b]
+        a = a[apart]
+        b = b[apart]
+
+
+def _weld_groups(rows, tolerances, block_size=1 << 20):
+    """
+    Returns the lowest row of the group every row is welded into. Close rows
+    are in neighbouring cells of a grid over any three columns with cells no
+    smaller than their tolerance, only those are compared, block_size
+    candidate pairs at a time.
+    """
+    group = np.arange(len(rows))
+    if not len(rows):
+        return group
+
+    values = rows.astype(np.float64)
+    low = values.min(axis=0)
+    # Cells may be larger than the tolerance, they are only coarser. At most
+    # MAX_GRID_CELLS of them along each column keeps the keys exact.
+    sizes = np.maximum(np.maximum(
+        tolerances, (values.max(axis=0) - low) / MAX_GRID_CELLS), 1e-12)
+    columns = _grid_columns(values, low, sizes)
+
+    # A border of empty cells, so neighbour keys never wrap
+    cells = np.floor((values[:, columns] - low[columns]) /
+                     sizes[columns]).astype(np.int64) + 1
+    dims = cells.max(axis=0) + 2
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+
+    order = np.argsort(keys, kind="stable")
+    cell_keys, first, size = np.unique(
+        keys[order], return_index=True, return_counts=True)
+
+    # Every pair of neighbouring cells, once
+    cell = []
+    other = []
+    for x, y, z in NEIGHBOUR_CELLS.tolist():
+        wanted = cell_keys + ((x * dims[1] + y) * dims[2] + z)
+        found = np.minimum(
+            np.searchsorted(cell_keys, wanted), len(cell_keys) - 1)
+        hit = np.flatnonzero(cell_keys[found] == wanted)
+        cell.append(hit)
+        other.append(found[hit])
+    cell = np.concatenate(cell)
+    other = np.concatenate(other)
+    total = size[cell] * size[other]
+    end = np.cumsum(total)
+
+    start = 0
+    while start < end[-1]:
+        # Skip pairs of cells whose rows all are in one group already, so
+        # crowded cells that weld together are not compared row by row
+        first_index = np.searchsorted(end, start, "right")
+        sorted_group = group[order]
+        lowest = np.minimum.reduceat(sorted_group, first)
+        alike = lowest == np.maximum.reduceat(sorted_group, first)
+        c = cell[first_index:]
+        o = other[first_index:]
+        todo = np.flatnonzero(
+            ~(alike[c] & alike[o] & (lowest[c] == lowest[o])))
+        if not len(todo):
+            break
+        if todo[0]:
+            skip_to = first_index + todo[0]
+            start = int(end[skip_to] - total[skip_to])
+        stop = min(start + block_size, int(end[-1]))
+
+        # Every row of a cell against every row of its neighbour, numbered
+        # across all pairs of cells
+        pair = np.arange(start, stop)
+        start = stop
+        index = np.searchsorted(end, pair, "right")
+        pair -= end[index] - total[index]
+        # The first rows of a crowded cell meet all others in the first block
+        width = size[cell[index]]
+        a = order[first[cell[index]] + pair % width]
+        b = order[first[other[index]] + pair // width]
+
+        # Rows already in the same group need no comparison
+        keep = (((b < a) | (cell[index] != other[index])) &
+                (group[a] != group[b]))
+        a = a[keep]
+        b = b[keep]
+
+        close = (np.abs(rows[a] - rows[b]) <= tolerances).all(axis=1)
+        _join(group, a[close], b[close])
+
+    return group
+
+
+def weld_rows(rows, tolerances):
+    """
+    Merges rows whose columns all differ by no more than the per-column
+    tolerances, using a grid over three of the columns so only corners in
+    neighbouring cells get compared. Rows are merged transitively: a chain
+    of close rows ends up as one.
+
+    The first row of every group is kept, so the result has the same shape
+    as unique_rows: the kept rows in order, and for every row the index of
+    the kept row it was merged into.
+    """
+    group = _weld_groups(rows, tolerances)
+    kept = np.flatnonzero(group == np.arange(len(rows)))
+    return kept, np.searchsorted(kept, group)
+
+
+def _normalized(v):
+    length = np.sqrt((v * v).sum(axis=1))
+    length[length == 0.0] = 1.0
+    return v / length[:, None]
+
+
+def _face_corners(ma):
+    """
+    Returns the face, vertex, next corner and previous corner of every
+    entry of ma.face_loops
+    """
+    sizes = ma.face_sizes
+    start = np.cumsum(sizes) - sizes
+    face = np.repeat(np.arange(len(sizes)), sizes)
+    corner = np.arange(len(face)) - start[face]
+    nxt = start[face] + (corner + 1) % sizes[face]
+    prv = start[face] + (corner - 1) % sizes[face]
+    return face, ma.loop_vertex[ma.face_loops], nxt, prv
+
+
+def corner_normals(ma, co):
+    """
+    Calculates loop normals of the faces of ma for the vertex positions co.
+
+    Smooth faces get angle weighted vertex normals and flat faces their face
+    normal. Sharp edges and custom normals are not taken into account.
+    """
+    face, vertex, nxt, prv = _face_corners(ma)
+    p = co[vertex].astype(np.float64)
+
+    # Newell's method, also valid for non planar polygons
+    face_normals = np.zeros((len(ma.face_sizes), 3))
+    np.add.at(face_normals, face, np.cross(p, p[nxt]))
+    face_normals = _normalized(face_normals)
+
+    e1 = _normalized(p[nxt] - p)
+    e2 = _normalized(p[prv] - p)
+    angle = np.arccos(np.clip((e1 * e2).sum(axis=1), -1.0, 1.0))
+    vertex_normals = np.zeros((len(co), 3))
+    np.add.at(vertex_normals, vertex, face_normals[face] * angle[:, None])
+    vertex_normals = _normalized(vertex_normals)
+
+    smooth = ma.face_smooth[face]
+    normals = ma.normals.copy()
+    normals[ma.face_loops[smooth]] = vertex_normals[vertex[smooth]]
+    normals[ma.face_loops[~smooth]] = face_normals[face[~smooth]]
+    return normals
+
+
+def affected_loops(ma, changed):
+    """
+    Returns a mask of the loops whose normal can change when the vertices
+    in the changed mask move.
+    """
+    face, vertex, nxt, prv = _face_corners(ma)
+
+    moved_faces = np.zeros(len(ma.face_sizes), dtype=bool)
+    moved_faces[face[changed[vertex]]] = True
+    moved_vertices = np.zeros(len(changed), dtype=bool)
+    moved_vertices[vertex[moved_faces[face]]] = True
+
+    smooth = ma.face_smooth[face]
+    corners = np.where(smooth, moved_vertices[vertex], moved_faces[face])
+    loops = np.zeros(len(ma.loop_vertex), dtype=bool)
+    loops[ma.face_loops[corners]] = True
+    return loops
@@ -0,0 +1,1051 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+Reads the Blender scene into a scene_ir.Scene.
+
+This is everything an export does with bpy: choosing the objects, putting
+the scene in its export state, reading meshes, skeletons and materials and
+sampling animations. Writers then only serialize the result.
+"""
+
+import bpy
+import bmesh
+import numpy as np
+from mathutils import Matrix
+from bpy_extras import node_shader_utils
+from . import export_tracker
+from . import file_cache
+from . import log
+from . import mesh_arrays
+from . import scene_ir
+
+# Principled BSDF textures exported with materials, in lookup order
+TEXTURE_KEYS = ("base_color_texture", "specular_texture", "normalmap_texture")
+
+# Bumped whenever the exported geometry of the same mesh changes
+GEOMETRY_CACHE_VERSION = 4
+# Options the geometry, morph and skin fragments of a mesh depend on
+GEOMETRY_OPTIONS = (
+    "use_triangles", "use_tangent_arrays", "use_shape_key_export",
+    "use_shape_key_normals", "use_shape_key_changed_only",
+    "use_weld_vertices", "weld_position_epsilon", "weld_normal_epsilon",
+    "weld_uv_epsilon", "weld_tangent_epsilon", "use_deterministic",
+    "float_format", "float_precision", "use_fixed_width", "use_compact_xml",
+    "use_attribute_precision", "use_quantize_grid", "position_precision",
+    "normal_precision", "uv_precision", "color_precision",
+    "weight_precision", "matrix_digits")
+
+
+def matrix_array(mtx):
+    """
+    A copy of a mathutils matrix as a 4x4 float64 array
+    """
+    return np.array(mtx, dtype=np.float64)
+
+
+def is_ctrl_bone(bone):
+    return bone.name.startswith("ctrl") or bone.use_deform == False
+
+
+class EvaluatedMeshes:
+    """
+    Owns the meshes created with Object.to_mesh during an export and frees
+    them with to_mesh_clear, so batch exports don't keep every evaluated
+    mesh alive. At most budget meshes exist at once, the oldest one is
+    released first when more are needed.
+    """
+
+    __slots__ = ("budget", "owners", "peak")
+
+    def __init__(self, budget):
+        self.budget = max(budget, 1)
+        self.owners = []
+        self.peak = 0
+
+    def acquire(self, node, depsgraph):
+        # An object owns a single evaluated mesh, asking again replaces it
+        self.release(node)
+        while len(self.owners) >= self.budget:
+            self.release(self.owners[0])
+
+        mesh = node.to_mesh(
+            preserve_all_data_layers=False, depsgraph=depsgraph)
+        self.owners.append(node)
+        self.peak = max(self.peak, len(self.owners))
+        return mesh
+
+    def release(self, node):
+        if node in self.owners:
+            self.owners.remove(node)
+            node.to_mesh_clear()
+
+    def clear(self):
+        while self.owners:
+            self.release(self.owners[-1])
+
+
+class SceneExtractor:
+    """
+    Builds the scene_ir.Scene of the current scene, with the export options
+    in config. Warnings are reported to operator. Meshes found in
+    geometry_cache, a file_cache.FileCache, are not read any further than
+    needed to hash them. With incremental, an export_tracker.Incremental,
+    unchanged objects are not even read.
+    """
+
+    __slots__ = ("operator", "scene", "config", "valid_nodes", "mesh_cache",
+                 "material_cache", "image_cache", "skeleton_info",
+                 "skeletons", "armature_for_morph", "used_bones",
+                 "wrongvtx_report", "action_constraints", "evaluated_meshes",
+                 "depsgraph", "evaluation_state", "node_map", "transforms",
+                 "geometry_cache", "incremental")
+
+    def __init__(self, config, operator, geometry_cache=None,
+                 incremental=None):
+        self.operator = operator
+        self.scene = bpy.context.scene
+        self.config = config
+        self.valid_nodes = []
+        self.mesh_cache = {}
+        self.material_cache = {}
+        self.image_cache = {}
+        self.skeleton_info = {}
+        self.skeletons = []
+        self.armature_for_morph = {}
+        self.used_bones = []
+        self.wrongvtx_report = False
+        self.action_constraints = []
+        self.evaluated_meshes = EvaluatedMeshes(config["max_evaluated_meshes"])
+        self.depsgraph = None
+        self.evaluation_state = []
+        self.node_map = {}
+        self.transforms = {}
+        self.geometry_cache = geometry_cache
+        self.incremental = incremental
+
+    def __enter__(self):
+        # The state changes of the export are not edits of the scene
+        export_tracker.suspend()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end_evaluation()
+        export_tracker.resume()
+
+    def extract_image(self, image):
+        ir_image = self.image_cache.get(image)
+        if ir_image is None:
+            ir_image = scene_ir.Image(image.name, image.filepath, image)
+            self.image_cache[image] = ir_image
+        return ir_image
+
+    def extract_material(self, material, double_sided_hint=True):
+        ir_material = self.material_cache.get(material)
+        if ir_material is not None:
+            return ir_material
+
+        ir_material = scene_ir.Material(material.name)
+        ir_material.diffuse_color = tuple(material.diffuse_color)
+        ir_material.specular_color = tuple(material.specular_color)
+        ir_material.specular_intensity = material.specular_intensity
+        ir_material.double_sided = double_sided_hint
+
+        #TODO, use Blender 2.8 principled shader and connected maps
+        mat_wrap = node_shader_utils.PrincipledBSDFWrapper(material)
+        for tkey in TEXTURE_KEYS:
+            tex = getattr(mat_wrap, tkey, None)
+            if tex == None:
+                continue
+            if tex.image == None:
+                continue
+            ir_material.textures.append(
+                (tkey, self.extract_image(tex.image)))
+
+        self.material_cache[material] = ir_material
+        return ir_material
+
+    def extract_morph_targets(self, node, ma, vertex_loops, ir_mesh):
+        """
+        Reads one morph target per shape key.
+
+        Targets reuse the topology, index buffer and attributes of the base
+        mesh, only positions (and optionally normals) are recalculated from
+        the coordinates stored in the key blocks.
+        """
+        key_blocks = node.data.shape_keys.key_blocks
+        vertex_index = ma.loop_vertex[vertex_loops]
+        key_co = {}
+
+        def shape_co(shape):
+            if shape.name not in key_co:
+                key_co[shape.name] = mesh_arrays.foreach_get(
+                    shape.data, "co", np.float32, 3)
+            return key_co[shape.name]
+
+        for shape in key_blocks[1:]:
+            # Relative keys add their offset on top of the evaluated base
+            delta = shape_co(shape) - shape_co(shape.relative_key)
+            changed = np.any(delta != 0.0, axis=1)
+            target = scene_ir.MorphTarget(shape.name)
+
+            if (changed.any()):
+                co = ma.vertex_co + delta
+                target.positions = co[vertex_index]
+
+                if (self.config["use_shape_key_normals"]):
+                    normals = mesh_arrays.corner_normals(ma, co)
+                    if (self.config["use_shape_key_changed_only"]):
+                        moved = mesh_arrays.affected_loops(ma, changed)
+                        normals[~moved] = ma.normals[~moved]
+                    target.normals = normals[vertex_loops]
+
+            ir_mesh.morph_targets.append(target)
+
+    def begin_evaluation(self):
+        """
+        Puts the scene in the state meshes are exported in and evaluates it
+        once. Every mesh is then read from that single depsgraph, instead of
+        changing state and re-evaluating the scene for each object.
+        """
+        self.evaluation_state = []
+        mesh_nodes = [n for n in self.valid_nodes if n.type == "MESH"]
+
+        def override(owner, attr, value):
+            self.evaluation_state.append((owner, attr, getattr(owner, attr)))
+            setattr(owner, attr, value)
+
+        if (self.config["use_exclude_armature_modifier"]):
+            skinned = False
+            for node in mesh_nodes:
+                for modifier in node.modifiers:
+                    if (modifier.type == "ARMATURE"):
+                        # the armature modifier must be disabled too
+                        override(modifier, "show_viewport", False)
+                        skinned = True
+
+            # Set armatures in rest pose
+            if (skinned):
+                for arm in bpy.data.armatures:
+                    override(arm, "pose_position", "REST")
+
+        # The base of the morph is the mesh without any shape key applied
+        if (self.config["use_shape_key_export"]):
+            for node in mesh_nodes:
+                shape_keys = node.data.shape_keys
+                if (shape_keys is None or len(shape_keys.key_blocks) < 2):
+                    continue
+                for shape in shape_keys.key_blocks:
+                    override(shape, "value", 0.0)
+                override(node, "show_only_shape_key", False)
+
+        self.depsgraph = bpy.context.evaluated_depsgraph_get()
+
+    def end_evaluation(self):
+        """
+        Restores everything begin_evaluation changed
+        """
+        for owner, attr, value in reversed(self.evaluation_state):
+            setattr(owner, attr, value)
+        self.evaluation_state = []
+        self.evaluated_meshes.clear()
+        self.depsgraph = None
+
+    def geometry_key(self, node, mesh, si, export_shape_keys):
+        """
+        Digest of everything the exported geometry of node is made from: the
+        evaluated mesh, its shape keys and skin, and the export options.
+
+        Returns it with the vertex groups of the mesh, which are read for
+        skinned meshes only and can be reused to build the skin.
+        """
+        parts = [GEOMETRY_CACHE_VERSION,
+                 [self.config[key] for key in GEOMETRY_OPTIONS],
+                 node.data.name, export_shape_keys,
+                 [(m.type, m.name, m.show_viewport) for m in node.modifiers],
+                 [m is not None for m in mesh.materials]]
+
+        mesh.calc_normals_split()
+        for collection, attr, dtype, width in (
+                (mesh.vertices, "co", np.float32, 3),
+                (mesh.loops, "vertex_index", np.int32, 1),
+                (mesh.loops, "normal", np.float32, 3),
+                (mesh.polygons, "loop_start", np.int32, 1),
+                (mesh.polygons, "loop_total", np.int32, 1),
+                (mesh.polygons, "material_index", np.int32, 1),
+                (mesh.polygons, "use_smooth", bool, 1)):
+            parts.append(
+                mesh_arrays.foreach_get(collection, attr, dtype, width))
+        for uv_layer in mesh.uv_layers:
+            parts.append(
+                mesh_arrays.foreach_get(uv_layer.data, "uv", np.float32, 2))
+        if len(mesh.color_attributes):
+            attr = mesh.color_attributes[0]
+            parts.append(attr.domain)
+            parts.append(
+                mesh_arrays.foreach_get(attr.data, "color", np.float32, 4))
+
+        if (export_shape_keys):
+            for shape in node.data.shape_keys.key_blocks:
+                parts.append((shape.name, shape.relative_key.name))
+                parts.append(mesh_arrays.foreach_get(
+                    shape.data, "co", np.float32, 3))
+
+        groups = None
+        if (si is not None):
+            groups = mesh_arrays.vertex_groups(mesh)
+            parts.append(list(groups))
+            parts.append([vg.name for vg in node.vertex_groups])
+            parts.append([(b.name, b.bind_pose) for b in si.bones])
+            parts.append(self.transforms[node][1])
+
+        return file_cache.digest(*parts), groups
+
+    def cached_mesh(self, node, ir_mesh, fragment, materials, armature):
+        """
+        Fills ir_mesh from its entry in the geometry cache. Only the
+        materials, indexed by slot, are still read from the scene.
+        """
+        log.mesh.debug("Mesh %s found in the geometry cache", ir_mesh.name)
+        ir_mesh.fragment = fragment
+        ir_mesh.vertex_count = fragment["vertex_count"]
+        ir_mesh.primitive = fragment["primitive"]
+        for slot in fragment["slots"]:
+            try:
+                mat = materials[slot]
+            except:
+                mat = None
+            if (mat is not None):
+                mat = self.extract_material(mat, True)
+            ir_mesh.surfaces.append(scene_ir.Surface(mat, None, None, slot))
+        for name in fragment["morph_targets"]:
+            ir_mesh.morph_targets.append(scene_ir.MorphTarget(name))
+
+        self.mesh_cache[node.data] = ir_mesh
+        if (armature is not None):
+            if (ir_mesh.morph_targets):
+                self.armature_for_morph[node] = armature
+            ir_mesh.skin = scene_ir.Skin(
+                self.skeleton_info[armature], self.transforms[node][1],
+                None, None)
+        return ir_mesh
+
+    def extract_mesh(self, node, armature=None):
+        mesh = node.data
+
+        if (node.data in self.mesh_cache):
+            return self.mesh_cache[mesh]
+
+        export_shape_keys = (
+            mesh.shape_keys is not None and
+            len(mesh.shape_keys.key_blocks) > 1 and
+            self.config["use_shape_key_export"])
+
+        ir_mesh = scene_ir.Mesh(mesh.name)
+
+        # Objects that did not change since the previous export of the same
+        # file are not even evaluated
+        if (self.incremental is not None):
+            ir_mesh.cache_key = self.incremental.clean_key(node)
+            if (ir_mesh.cache_key is not None):
+                fragment = self.geometry_cache.get_json(ir_mesh.cache_key)
+                if (fragment is not None):
+                    self.incremental.reused += 1
+                    return self.cached_mesh(
+                        node, ir_mesh, fragment,
+                        [slot.material for slot in node.material_slots],
+                        armature)
+
+        mesh = self.evaluated_meshes.acquire(node, self.depsgraph)
+        log.mesh.debug(
+            "Mesh %s (%s): %d vertices, %d polygons", node.name, ir_mesh.name,
+            len(mesh.vertices), len(mesh.polygons))
+        # 2.8 update: warning, Blender does not support anymore the "RENDER" argument to apply modifier
+        # with render state, only current state
+
+        if (export_shape_keys):
+            if (len(node.data.shape_keys.key_blocks[0].data) !=
+                    len(mesh.vertices)):
+                self.operator.report(
+                    {"WARNING"},
+                    "Modifiers change the vertex count of object \"{}\", "
+                    "its shape keys will not be exported.".format(node.name))
+                export_shape_keys = False
+
+        si = None
+        if armature is not None:
+            si = self.skeleton_info[armature]
+
+        groups = None
+        if (self.geometry_cache is not None):
+            ir_mesh.cache_key, groups = self.geometry_key(
+                node, mesh, si, export_shape_keys)
+            fragment = self.geometry_cache.get_json(ir_mesh.cache_key)
+            if (fragment is not None):
+                materials = list(mesh.materials)
+                self.evaluated_meshes.release(node)
+                return self.cached_mesh(
+                    node, ir_mesh, fragment, materials, armature)
+
+        triangulate = self.config["use_triangles"]
+        # Tangents can only be calculated on triangles and quads, so meshes
+        # with ngons still need the bmesh triangulation in that case
+        if (triangulate and self.config["use_tangent_arrays"] and
+                len(mesh.uv_layers) and len(mesh.polygons) and
+                mesh_arrays.foreach_get(
+                    mesh.polygons, "loop_total", np.int32).max() > 4):
+            bm = bmesh.new()
+            bm.from_mesh(mesh)
+            bmesh.ops.triangulate(bm, faces=bm.faces)
+            bm.to_mesh(mesh)
+            bm.free()
+
+        #mesh.update(calc_tessface=True)# 2.79
+        #mesh.update(calc_edges=False, calc_edges_loose=False, calc_loop_triangles=True)# 2.80
+        mesh.update(calc_edges=False, calc_edges_loose=False)# 3.0.1
+        surface_indices = {}
+        materials = {}
+
+        # TODO: Implement automatic tangent detection
+        has_tangents = self.config["use_tangent_arrays"]
+
+        #has_colors = len(mesh.vertex_colors)
+        has_colors = len(mesh.color_attributes)
+
+        if has_tangents and len(mesh.uv_layers):
+            try:
+                mesh.calc_tangents()
+            except:
+                self.operator.report(
+                    {"WARNING"},
+                    "CalcTangets failed for mesh \"{}\", no tangets will be "
+                    "exported.".format(mesh.name))
+                mesh.calc_normals_split()
+                has_tangents = False
+
+        else:
+            mesh.calc_normals_split()
+            has_tangents = False
+
+        ma = mesh_arrays.extract_mesh(
+            mesh, has_tangents, has_colors, triangulate)
+
+        # Only triangles and above
+        valid_faces = ma.face_sizes > 2
+        face_of_loop = np.repeat(np.arange(len(ma.face_sizes)), ma.face_sizes)
+        valid_loops = valid_faces[face_of_loop]
+
+        # Materials are exported in the order they are first used, or in
+        # slot order for deterministic output
+        mat_indices, first_face = np.unique(
+            ma.face_material, return_index=True)
+        if (not self.config["use_deterministic"]):
+            mat_indices = mat_indices[np.argsort(first_face)]
+        for m in mat_indices.tolist():
+            try:
+                # TODO: Review, understand why it throws
+                mat = mesh.materials[m]
+            except:
+                mat = None
+
+            if (mat is not None):
+                materials[m] = self.extract_material(
+                    mat, True)#True = deprecated mesh.show_double_sided value, which is removed from Blender 2.8
+            else:
+                materials[m] = None
+
+            face_mask = valid_faces & (ma.face_material == m)
+            surface_indices[m] = (ma.face_loops[face_mask[face_of_loop]],
+                                  ma.face_sizes[face_mask])
+
+        # Vertices are numbered in face order, loops shared by several
+        # triangles are only visited once
+        face_loops = ma.face_loops[valid_loops]
+        first_loop = np.unique(face_loops, return_index=True)[1]
+        loop_order = face_loops[np.sort(first_loop)]
+        rows = ma.packed()[loop_order]
+        tolerances = ma.packed_tolerances(
+            self.config["weld_position_epsilon"],
+            self.config["weld_normal_epsilon"],
+            self.config["weld_uv_epsilon"],
+            self.config["weld_tangent_epsilon"])
+        skin_bones = None
+        skin_weights = None
+
+        if armature is not None:
+            group_bones = np.array(
+                [si.bones_by_name[vg.name].index
+                 if vg.name in si.bones_by_name else -1
+                 for vg in node.vertex_groups], dtype=np.int32)
+            bones, weights, unassigned = mesh_arrays.skin_table(
+                mesh, group_bones, groups=groups)
+
+            if (unassigned[ma.loop_vertex[loop_order]].any()):
+                if not self.wrongvtx_report:
+                    self.operator.report(
+                        {"WARNING"},
+                        "Mesh for object \"{}\" has unassigned "
+                        "weights. This may look wrong in exported "
+                        "model.".format(node.name))
+                    self.wrongvtx_report = True
+
+            skin_bones = bones[ma.loop_vertex[loop_order]]
+            skin_weights = weights[ma.loop_vertex[loop_order]]
+            rows = np.hstack(
+                (rows, skin_bones.astype(np.float32), skin_weights))
+            # Influences must match exactly
+            tolerances = np.concatenate(
+                (tolerances, np.zeros(skin_bones.shape[1] * 2,
+                                      dtype=np.float32)))
+
+        # Everything needed from the evaluated mesh has been read
+        self.evaluated_meshes.release(node)
+        mesh = node.data
+
+        # Weld identical corners, but do not optmize if using shapekeys
+        if (not export_shape_keys and len(rows)):
+            vertex_rows, row_to_vertex = mesh_arrays.unique_rows(rows)
+        else:
+            vertex_rows = np.arange(len(rows))
+            row_to_vertex = vertex_rows
+
+        if (not export_shape_keys and len(vertex_rows) and
+                self.config["use_weld_vertices"]):
+            weld_rows, weld_map = mesh_arrays.weld_rows(
+                rows[vertex_rows], tolerances)
+            self.operator.report(
+                {"INFO"},
+                "Welded mesh for object \"{}\": {} -> {} vertices "
+                "({:.1f}% fewer).".format(
+                    node.name, len(vertex_rows), len(weld_rows),
+                    100.0 * (1.0 - len(weld_rows) / len(vertex_rows))))
+            vertex_rows = vertex_rows[weld_rows]
+            row_to_vertex = weld_map[row_to_vertex]
+
+        loop_to_vertex = np.zeros(len(ma.loop_vertex), dtype=np.int32)
+        loop_to_vertex[loop_order] = row_to_vertex
+        vertex_loops = loop_order[vertex_rows]
+
+        # Vertex, normal, tangent, UV and color attributes
+        ir_mesh.vertex_count = len(vertex_loops)
+        ir_mesh.positions = ma.positions[vertex_loops]
+        ir_mesh.normals = ma.normals[vertex_loops]
+        if (has_tangents):
+            ir_mesh.tangents = ma.tangents[vertex_loops]
+            ir_mesh.bitangents = ma.bitangents[vertex_loops]
+        ir_mesh.uvs = [uv[vertex_loops] for uv in ma.uvs]
+        if (has_colors):
+            ir_mesh.colors = ma.colors[vertex_loops]
+
+        if (triangulate):
+            ir_mesh.primitive = "triangles"
+        else:
+            ir_mesh.primitive = "polygons"
+
+        for m in surface_indices:
+            loops, sizes = surface_indices[m]
+            ir_mesh.surfaces.append(scene_ir.Surface(
+                materials[m], sizes, loop_to_vertex[loops], m))
+
+        self.mesh_cache[node.data] = ir_mesh
+
+        if (export_shape_keys):
+            self.extract_morph_targets(node, ma, vertex_loops, ir_mesh)
+            if armature is not None:
+                self.armature_for_morph[node] = armature
+
+        if (armature is not None):
+            ir_mesh.skin = scene_ir.Skin(
+                si, self.transforms[node][1],
+                skin_bones[vertex_rows], skin_weights[vertex_rows])
+
+        return ir_mesh
+
+    def extract_mesh_node(self, node, ir_node):
+        if (node.data is None):
+            return
+
+        armature = None
+        armcount = 0
+        for n in node.modifiers:
+            if (n.type == "ARMATURE"):
+                if n.object:# make sure the armature modifier is not null
+                    armcount += 1
+
+        if (node.parent is not None):
+            if (node.parent.type == "ARMATURE"):
+                armature = node.parent
+                if (armcount > 1):
+                    self.operator.report(
+                        {"WARNING"}, "Object \"{}\" refers "
+                        "to more than one armature! "
+                        "This is unsupported.".format(node.name))
+                if (armcount == 0):
+                    self.operator.report(
+                        {"WARNING"}, "Object \"{}\" is child "
+                        "of an armature, but has no armature modifier.".format(
+                            node.name))
+
+        if (armcount > 0 and not armature):
+            self.operator.report(
+                {"WARNING"},
+                "Object \"{}\" has armature modifier, but is not a child of "
+                "an armature. This is unsupported.".format(node.name))
+
+        if (node.data.shape_keys is not None):
+            sk = node.data.shape_keys
+            if (sk.animation_data):
+                for d in sk.animation_data.drivers:
+                    if (d.driver):
+                        for v in d.driver.variables:
+                            for t in v.targets:
+                                if (t.id is not None and
+                                        t.id.name in self.scene.objects):
+                                    self.armature_for_morph[
+                                        node] = self.scene.objects[t.id.name]
+
+        ir_node.data = self.extract_mesh(node, armature)
+        if (armature is not None):
+            ir_node.skeleton = self.skeleton_info[armature]
+
+    def extract_armature_bone(self, bone, si, parent):
+        is_ctrl = (self.config["use_exclude_ctrl_bones"] and
+                   is_ctrl_bone(bone))
+        if (bone.parent is None and is_ctrl is True):
+            self.operator.report(
+                {"WARNING"}, "Root bone cannot be a control bone:"+bone.name)
+            is_ctrl = False
+
+        if (is_ctrl is False):
+            if (bone.name in self.used_bones):
+                if (self.config["use_anim_action_all"]):
+                    self.operator.report(
+                        {"WARNING"}, "Bone name \"{}\" used in more than one "
+                        "skeleton. Actions might export wrong.".format(
+                            bone.name))
+            else:
+                self.used_bones.append(bone.name)
+
+            xform = bone.matrix_local
+            bind_pose = (Matrix(si.matrix) @ xform).inverted_safe()
+            if (bone.parent is not None):
+                xform = bone.parent.matrix_local.inverted_safe() @ xform
+
+            ir_bone = scene_ir.Bone(
+                bone.name, len(si.bones), parent, matrix_array(xform),
+                matrix_array(bind_pose))
+            si.bones.append(ir_bone)
+            si.bones_by_name[bone.name] = ir_bone
+            if (parent is not None):
+                parent.children.append(ir_bone)
+            parent = ir_bone
+
+        for c in bone.children:
+            self.extract_armature_bone(c, si, parent)
+
+    def extract_armature_node(self, node, ir_node):
+        if (node.data is None):
+            return
+
+        self.skeletons.append(node)
+
+        armature = node.data
+        si = scene_ir.Skeleton(node.name, self.transforms[node][1])
+        self.skeleton_info[node] = si
+
+        for b in armature.bones:
+            if (b.parent is not None):
+                continue
+            self.extract_armature_bone(b, si, None)
+
+        if (node.pose):
+            for b in node.pose.bones:
+                for x in b.constraints:
+                    if (x.type == "ACTION"):
+                        self.action_constraints.append(x.action)
+
+        ir_node.data = si
+
+    def extract_camera_node(self, node, ir_node):
+        if (node.data is None):
+            return
+
+        camera = node.data
+        ir_camera = scene_ir.Camera(camera.name)
+        ir_camera.type = camera.type
+        ir_camera.angle = camera.angle
+        ir_camera.ortho_scale = camera.ortho_scale
+        ir_camera.aspect_ratio = (
+            self.scene.render.resolution_x / self.scene.render.resolution_y)
+        ir_camera.clip_start = camera.clip_start
+        ir_camera.clip_end = camera.clip_end
+        ir_node.data = ir_camera
+
+    def extract_lamp_node(self, node, ir_node):
+        if (node.data is None):
+            return
+
+        light = node.data
+        ir_light = scene_ir.Light(light.name)
+        ir_light.type = light.type
+        ir_light.color = tuple(light.color)
+        if (light.type in ("POINT", "SPOT")):
+            ir_light.distance = light.distance
+        if (light.type == "POINT"):
+            ir_light.use_sphere = light.use_sphere
+        elif (light.type == "SPOT"):
+            ir_light.spot_size = light.spot_size
+        ir_node.data = ir_light
+
+    def extract_curve(self, curve):
+        ir_curve = scene_ir.Curve(curve.name)
+        points = []
+        handles_in = []
+        handles_out = []
+        tilts = []
+
+        for cs in curve.splines:
+
+            if (cs.type == "BEZIER"):
+                bezier_points = cs.bezier_points
+                co = mesh_arrays.foreach_get(
+                    bezier_points, "co", np.float32, 3)
+                points.append(co)
+                handles_in.append(mesh_arrays.foreach_get(
+                    bezier_points, "handle_left", np.float32, 3))
+                handles_out.append(mesh_arrays.foreach_get(
+                    bezier_points, "handle_right", np.float32, 3))
+                tilts.append(mesh_arrays.foreach_get(
+                    bezier_points, "tilt", np.float32))
+                ir_curve.interpolations.append(("BEZIER", len(bezier_points)))
+            else:
+                # Poly and NURBS points are homogeneous, without handles
+                co = mesh_arrays.foreach_get(
+                    cs.points, "co", np.float32, 4)[:, :3]
+                points.append(co)
+                handles_in.append(co)
+                handles_out.append(co)
+                tilts.append(mesh_arrays.foreach_get(
+                    cs.points, "tilt", np.float32))
+                ir_curve.interpolations.append(("LINEAR", len(cs.points)))
+
+        if (len(points)):
+            ir_curve.points = np.concatenate(points)
+            ir_curve.handles_in = np.concatenate(handles_in)
+            ir_curve.handles_out = np.concatenate(handles_out)
+            ir_curve.tilts = np.concatenate(tilts)
+        return ir_curve
+
+    def extract_node(self, node):
+        prev_node = bpy.context.view_layer.objects.active
+        bpy.context.view_layer.objects.active = node
+
+        ir_node = scene_ir.Node(
+            node.name, node.type, self.transforms[node][0])
+        self.node_map[node] = ir_node
+
+        if (node.type == "MESH"):
+            self.extract_mesh_node(node, ir_node)
+        elif (node.type == "CURVE"):
+            if (node.data is not None):
+                ir_node.data = self.extract_curve(node.data)
+        elif (node.type == "ARMATURE"):
+            self.extract_armature_node(node, ir_node)
+        elif (node.type == "CAMERA"):
+            self.extract_camera_node(node, ir_node)
+        elif (node.type == "LAMP"):
+            self.extract_lamp_node(node, ir_node)
+        elif (node.type == "EMPTY"):
+            ir_node.empty_display_type = node.empty_display_type
+
+        for x in sorted(node.children, key=lambda x: x.name):
+            if (x in self.valid_nodes):
+                ir_node.children.append(self.extract_node(x))
+
+        bpy.context.view_layer.objects.active = prev_node
+        return ir_node
+
+    def is_node_valid(self, node):
+        if (node.type not in self.config["object_types"]):
+            return False
+
+        if (self.config["use_active_layers"]):
+            valid = True
+            """
+            for i in range(20):
+                if (node.layers[i] and self.scene.layers[i]):
+                    valid = True
+                    break
+            """
+            # use collections instead of layers
+            for col in node.users_collection:
+                if col.hide_viewport == True:
+                    valid = False
+                    break
+
+            if (not valid):
+                return False
+
+        if (self.config["use_export_selected"] and not node.select_get()):
+            return False
+
+        return True
+
+    def objects(self):
+        """
+        The objects of the scene, sorted by name for deterministic output
+        """
+        if (self.config["use_deterministic"]):
+            return sorted(self.scene.objects, key=lambda x: x.name)
+        return list(self.scene.objects)
+
+    def find_valid_nodes(self):
+        for obj in self.scene.objects:
+            if (obj in self.valid_nodes):
+                continue
+            if (self.is_node_valid(obj)):
+                n = obj
+                while (n is not None):
+                    if (n not in self.valid_nodes):
+                        self.valid_nodes.append(n)
+                    n = n.parent
+
+    def sample_animation(self, start, end, allowed=None):
+        """
+        Samples the frames from start to end, both included. Returns the
+        transform tracks of animated nodes and bones, followed by the weight
+        tracks of morph targets.
+        """
+        # TODO: Blender -> Collada frames needs a little work
+        #       Collada starts from 0, blender usually from 1.
+        #       The last frame must be included also
+
+        frame_orig = self.scene.frame_current
+        log.animation.debug("Sampling frames %d to %d", start, end)
+
+        frame_len = 1.0 / self.scene.render.fps
+        frame_sub = 0
+        if (start > 0):
+            frame_sub = start * frame_len
+
+        xform_cache = {}
+        blend_cache = {}
+
+        def add_key(cache, kind, target, index, key, value):
+            track = cache.get((target, index))
+            if track is None:
+                track = cache[(target, index)] = scene_ir.Track(
+                    kind, target, [], [], index)
+            track.times.append(key)
+            track.values.append(value)
+
+        objects = self.objects()
+
+        # Change frames first, export objects last, boosts performance
+        for t in range(start, end + 1):
+            self.scene.frame_set(t)
+            key = t * frame_len - frame_sub
+
+            for node in objects:
+                if (node not in self.valid_nodes):
+                    continue
+                if (allowed is not None and not (node in allowed)):
+                    if (node.type == "MESH" and node.data is not None and
+                        (node in self.armature_for_morph) and (
+                            self.armature_for_morph[node] in allowed)):
+                        pass
+                    else:
+                        continue
+                if (node.type == "MESH" and node.data is not None and
+                    node.data.shape_keys is not None and (
+                        node.data in self.mesh_cache) and (
+                            self.mesh_cache[node.data].morph_targets)):
+                    ir_mesh = self.mesh_cache[node.data]
+                    key_blocks = node.data.shape_keys.key_blocks
+                    for i in range(1, len(key_blocks)):
+                        add_key(blend_cache, scene_ir.MORPH, ir_mesh, i - 1,
+                                key, key_blocks[i].value)
+
+                if (node.type == "MESH" and node.parent and
+                        node.parent.type == "ARMATURE"):
+                    # In Collada, nodes that have skin modifier must not export
+                    # animation, animate the skin instead
+                    continue
+
+                if (len(node.constraints) > 0 or
+                        node.animation_data is not None):
+                    # If the node has constraints, or animation data, then
+                    # export a sampled animation track
+                    mtx = node.matrix_world.copy()
+                    if (node.parent):
+                        mtx = node.parent.matrix_world.inverted_safe() @ mtx
+
+                    add_key(xform_cache, scene_ir.NODE, self.node_map[node],
+                            None, key, matrix_array(mtx))
+
+                if (node.type == "ARMATURE"):
+                    si = self.skeleton_info[node]
+                    # All bones exported for now
+                    for bone in node.data.bones:
+                        if(is_ctrl_bone(bone) and
+                                self.config["use_exclude_ctrl_bones"]):
+                            continue
+
+                        posebone = node.pose.bones[bone.name]
+                        parent_posebone = None
+
+                        mtx = posebone.matrix.copy()
+                        if (bone.parent):
+                            if (self.config["use_exclude_ctrl_bones"]):
+                                current_parent_posebone = bone.parent
+                                while (is_ctrl_bone(current_parent_posebone)
+                                        and current_parent_posebone.parent):
+                                    current_parent_posebone = (
+                                        current_parent_posebone.parent)
+                                parent_posebone = node.pose.bones[
+                                    current_parent_posebone.name]
+                            else:
+                                parent_posebone = node.pose.bones[
+                                    bone.parent.name]
+                            parent_invisible = False
+
+                            for i in range(3):
+                                if (parent_posebone.scale[i] == 0.0):
+                                    parent_invisible = True
+
+                            if (not parent_invisible):
+                                mtx = (
+                                    parent_posebone.matrix
+                                    .inverted_safe() @ mtx)
+
+                        add_key(xform_cache, scene_ir.BONE,
+                                si.bones_by_name[bone.name], None, key,
+                                matrix_array(mtx))
+
+        self.scene.frame_set(frame_orig)
+
+        tracks = list(xform_cache.values()) + list(blend_cache.values())
+        for track in tracks:
+            track.times = np.array(track.times, dtype=np.float64)
+            track.values = np.array(track.values, dtype=np.float64)
+        return tracks
+
+    def extract_animations(self, ir_scene):
+        tmp_mat = []
+        for s in self.skeletons:
+            tmp_bone_mat = []
+            for bone in s.pose.bones:
+                tmp_bone_mat.append(Matrix(bone.matrix_basis))
+                bone.matrix_basis = Matrix()
+            tmp_mat.append([Matrix(s.matrix_local), tmp_bone_mat])
+
+        if (self.config["use_anim_action_all"] and len(self.skeletons)):
+
+            cached_actions = {}
+            ir_scene.clips = []
+
+            for s in self.skeletons:
+                if s.animation_data and s.animation_data.action:
+                    cached_actions[s] = s.animation_data.action.name
+
+            actions = bpy.data.actions[:]
+            if (self.config["use_deterministic"]):
+                actions.sort(key=lambda x: x.name)
+
+            for x in actions:
+
+                if x.users == 0 or x in self.action_constraints:
+                    continue
+                if (self.config["use_anim_skip_noexp"] and
+                        x.name.endswith("-noexp")):
+                    continue
+
+                bones = []
+                # Find bones used
+                for p in x.fcurves:
+                    dp = p.data_path
+                    base = "pose.bones[\""
+                    if dp.startswith(base):
+                        dp = dp[len(base):]
+                        if (dp.find("\"") != -1):
+                            dp = dp[:dp.find("\"")]
+                            if (dp not in bones):
+                                bones.append(dp)
+
+                allowed_skeletons = []
+                for i, y in enumerate(self.skeletons):
+                    if (y.animation_data):
+                        for z in y.pose.bones:
+                            if (z.bone.name in bones):
+                                if (y not in allowed_skeletons):
+                                    allowed_skeletons.append(y)
+                        y.animation_data.action = x
+
+                        y.matrix_local = tmp_mat[i][0]
+                        for j, bone in enumerate(s.pose.bones):
+                            bone.matrix_basis = Matrix()
+
+                log.animation.debug("Animation clip %s", x.name)
+                tracks = self.sample_animation(int(x.frame_range[0]), int(
+                    x.frame_range[1] + 0.5), allowed_skeletons)
+                framelen = (1.0 / self.scene.render.fps)
+                start = x.frame_range[0] * framelen
+                end = x.frame_range[1] * framelen
+                ir_scene.clips.append(
+                    scene_ir.Clip(x.name, start, end, tracks))
+                if (len(tracks) == 0):
+                    self.operator.report(
+                        {"WARNING"}, "Animation clip \"{}\" contains no "
+                        "tracks.".format(x.name))
+
+            for i, s in enumerate(self.skeletons):
+                if (s.animation_data is None):
+                    continue
+                if s in cached_actions:
+                    s.animation_data.action = bpy.data.actions[
+                        cached_actions[s]]
+                else:
+                    s.animation_data.action = None
+                    for j, bone in enumerate(s.pose.bones):
+                        bone.matrix_basis = tmp_mat[i][1][j]
+
+        else:
+            ir_scene.tracks = self.sample_animation(
+                self.scene.frame_start, self.scene.frame_end)
+
+    def extract(self):
+        """
+        Returns the scene_ir.Scene of the scene
+        """
+        ir_scene = scene_ir.Scene()
+        self.find_valid_nodes()
+        # Transforms are read as posed, before armatures are put in rest
+        # pose and shape keys are cleared for the meshes
+        for node in self.valid_nodes:
+            self.transforms[node] = (matrix_array(node.matrix_local),
+                                     matrix_array(node.matrix_world))
+        self.begin_evaluation()
+        try:
+            for obj in sorted(self.scene.objects, key=lambda x: x.name):
+                if (obj in self.valid_nodes and obj.parent is None):
+                    ir_scene.roots.append(self.extract_node(obj))
+        finally:
+            self.end_evaluation()
+
+        if (self.config["use_anim"]):
+            self.extract_animations(ir_scene)
+        return ir_scene
@@ -0,0 +1,414 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+Intermediate representation of an exported scene.
+
+scene_extract reads the Blender scene into these classes in one pass, file
+writers such as export_dae only read them. Geometry, skins and animation
+tracks are NumPy arrays and matrices are 4x4 float64 arrays, copied from
+Blender, so the representation stays valid after the scene changes.
+
+Nothing here has a file format id: writers name things as they need.
+Objects are shared by reference, a Mesh used by two nodes is one Mesh.
+"""
+
+import numpy as np
+
+
+class Image:
+    """
+    An image used by a material. filepath is as set in Blender (possibly
+    relative to the .blend), datablock the bpy image, for writers that need
+    to save generated or packed images.
+    """
+
+    __slots__ = ("name", "filepath", "datablock")
+
+    def __init__(self, name, filepath, datablock=None):
+        self.name = name
+        self.filepath = filepath
+        self.datablock = datablock
+
+
+class Material:
+    """
+    Colors of a material and its textures, as a list of (Principled BSDF
+    texture, Image) in the order they are looked up
+    """
+
+    __slots__ = ("name", "diffuse_color", "specular_color",
+                 "specular_intensity", "textures", "double_sided")
+
+    def __init__(self, name):
+        self.name = name
+        self.diffuse_color = (0.8, 0.8, 0.8, 1.0)
+        self.specular_color = (1.0, 1.0, 1.0)
+        self.specular_intensity = 0.5
+        self.textures = []
+        self.double_sided = True
+
+    def texture(self, key):
+        """
+        The first Image of the given texture, or None
+        """
+        for tkey, image in self.textures:
+            if (tkey == key):
+                return image
+        return None
+
+
+class Surface:
+    """
+    The faces of a mesh using one material (or None). indices are vertex
+    indices, sizes the number of vertices of each face, slot the material
+    slot of the faces.
+    """
+
+    __slots__ = ("material", "sizes", "indices", "slot")
+
+    def __init__(self, material, sizes, indices, slot=None):
+        self.material = material
+        self.sizes = sizes
+        self.indices = indices
+        self.slot = slot
+
+    def faces(self):
+        """
+        The vertex indices of every face, as a list of arrays
+        """
+        return np.split(self.indices, np.cumsum(self.sizes)[:-1])
+
+
+class MorphTarget:
+    """
+    A shape key. positions and normals are None where they are the same as
+    the ones of the base mesh.
+    """
+
+    __slots__ = ("name", "positions", "normals")
+
+    def __init__(self, name, positions=None, normals=None):
+        self.name = name
+        self.positions = positions
+        self.normals = normals
+
+
+class Skin:
+    """
+    Bone influences of the vertices of a mesh. bones is a (vertices,
+    influences) array of bone indices into the skeleton, -1 where unused,
+    weights the matching weights.
+    """
+
+    __slots__ = ("skeleton", "bind_shape_matrix", "bones", "weights")
+
+    def __init__(self, skeleton, bind_shape_matrix, bones, weights):
+        self.skeleton = skeleton
+        self.bind_shape_matrix = bind_shape_matrix
+        self.bones = bones
+        self.weights = weights
+
+
+class Mesh:
+    """
+    Welded vertex attributes, one row per vertex, and the surfaces indexing
+    them. primitive is "triangles" or "polygons".
+
+    cache_key names the mesh in the geometry cache. fragment is the cached
+    geometry when the mesh was found there, the arrays are None then.
+    """
+
+    __slots__ = ("name", "vertex_count", "positions", "normals", "tangents",
+                 "bitangents", "uvs", "colors", "primitive", "surfaces",
+                 "morph_targets", "skin", "cache_key", "fragment")
+
+    def __init__(self, name):
+        self.name = name
+        self.vertex_count = 0
+        self.positions = None
+        self.normals = None
+        self.tangents = None
+        self.bitangents = None
+        self.uvs = []
+        self.colors = None
+        self.primitive = "triangles"
+        self.surfaces = []
+        self.morph_targets = []
+        self.skin = None
+        self.cache_key = None
+        self.fragment = None
+
+
+class Curve:
+    """
+    The control points of all splines of a curve, concatenated.
+    interpolations is a list of (interpolation, point count) runs.
+    """
+
+    __slots__ = ("name", "points", "handles_in", "handles_out", "tilts",
+                 "interpolations")
+
+    def __init__(self, name):
+        self.name = name
+        self.points = np.zeros((0, 3), dtype=np.float32)
+        self.handles_in = self.points
+        self.handles_out = self.points
+        self.tilts = np.zeros(0, dtype=np.float32)
+        self.interpolations = []
+
+
+class Camera:
+
+    __slots__ = ("name", "type", "angle", "ortho_scale", "aspect_ratio",
+                 "clip_start", "clip_end")
+
+    def __init__(self, name):
+        self.name = name
+        self.type = "PERSP"
+        self.angle = 0.0
+        self.ortho_scale = 0.0
+        self.aspect_ratio = 1.0
+        self.clip_start = 0.0
+        self.clip_end = 0.0
+
+
+class Light:
+
+    __slots__ = ("name", "type", "color", "distance", "use_sphere",
+                 "spot_size")
+
+    def __init__(self, name):
+        self.name = name
+        self.type = "POINT"
+        self.color = (1.0, 1.0, 1.0)
+        self.distance = 0.0
+        self.use_sphere = False
+        self.spot_size = 0.0
+
+
+class Bone:
+    """
+    A deforming bone. parent is the closest exported ancestor, matrix the
+    transform relative to the Blender parent bone and bind_pose the inverse
+    of the bone in armature space.
+    """
+
+    __slots__ = ("name", "index", "parent", "children", "matrix",
+                 "bind_pose")
+
+    def __init__(self, name, index, parent, matrix, bind_pose):
+        self.name = name
+        self.index = index
+        self.parent = parent
+        self.children = []
+        self.matrix = matrix
+        self.bind_pose = bind_pose
+
+
+class Skeleton:
+    """
+    The exported bones of an armature, parents first
+    """
+
+    __slots__ = ("name", "matrix", "bones", "bones_by_name")
+
+    def __init__(self, name, matrix):
+        self.name = name
+        self.matrix = matrix
+        self.bones = []
+        self.bones_by_name = {}
+
+    def roots(self):
+        return [b for b in self.bones if b.parent is None]
+
+
+class Node:
+    """
+    An object of the scene. data is the Mesh, Curve, Camera, Light or
+    Skeleton of the object, if any. skeleton is the armature deforming a
+    mesh.
+    """
+
+    __slots__ = ("name", "type", "matrix", "children", "data", "skeleton",
+                 "empty_display_type")
+
+    def __init__(self, name, node_type, matrix):
+        self.name = name
+        self.type = node_type
+        self.matrix = matrix
+        self.children = []
+        self.data = None
+        self.skeleton = None
+        self.empty_display_type = None
+
+
+# Track targets
+NODE = "NODE"
+BONE = "BONE"
+MORPH = "MORPH"
+
+
+class Track:
+    """
+    A sampled animation channel. target is a Node or Bone, whose values are
+    (keys, 4, 4) local transforms, or a Mesh, whose values are the weights
+    of its morph target number index. times are in seconds.
+    """
+
+    __slots__ = ("kind", "target", "index", "times", "values")
+
+    def __init__(self, kind, target, times, values, index=None):
+        self.kind = kind
+        self.target = target
+        self.index = index
+        self.times = times
+        self.values = values
+
+
+class Clip:
+    """
+    The tracks of one action, start and end in seconds
+    """
+
+    __slots__ = ("name", "start", "end", "tracks")
+
+    def __init__(self, name, start, end, tracks):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.tracks = tracks
+
+
+class Scene:
+    """
+    The root nodes of the scene, sorted by name. tracks is the animation of
+    the scene timeline, clips the animation of every action (None unless
+    exporting all actions).
+    """
+
+    __slots__ = ("roots", "tracks", "clips")
+
+    def __init__(self):
+        self.roots = []
+        self.tracks = []
+        self.clips = None
+
+    def nodes(self):
+        """
+        All nodes, parents first
+        """
+        stack = list(reversed(self.roots))
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+
+def _array(a):
+    if a is None:
+        return None
+    a = np.asarray(a)
+    info = {"dtype": str(a.dtype), "shape": list(a.shape)}
+    if a.size and a.dtype.kind in "fiu":
+        info["min"] = float(a.min())
+        info["max"] = float(a.max())
+    return info
+
+
+def _track(track):
+    if (track.kind == MORPH):
+        target = "{}[{}]".format(track.target.name, track.index)
+    else:
+        target = track.target.name
+    return {"kind": track.kind, "target": target,
+            "times": _array(track.times), "values": _array(track.values)}
+
+
+def dump(scene):
+    """
+    Returns a summary of the scene for debugging, as JSON serializable
+    values: every node and what it holds, with the shape and range of the
+    arrays instead of their contents
+    """
+    meshes = {}
+    materials = {}
+    skeletons = {}
+
+    def mesh_info(mesh):
+        if mesh.name in meshes:
+            return
+        surfaces = []
+        for s in mesh.surfaces:
+            material = None
+            if (s.material is not None):
+                material = s.material.name
+                materials[material] = {
+                    "diffuse_color": list(s.material.diffuse_color),
+                    "textures": [[k, i.name, i.filepath]
+                                 for k, i in s.material.textures]}
+            surfaces.append({
+                "material": material,
+                "faces": None if s.sizes is None else len(s.sizes),
+                "indices": _array(s.indices)})
+        info = {
+            "vertices": mesh.vertex_count,
+            "primitive": mesh.primitive,
+            "positions": _array(mesh.positions),
+            "normals": _array(mesh.normals),
+            "tangents": _array(mesh.tangents),
+            "uvs": [_array(uv) for uv in mesh.uvs],
+            "colors": _array(mesh.colors),
+            "surfaces": surfaces,
+            "morph_targets": [t.name for t in mesh.morph_targets],
+            "cached": mesh.fragment is not None,
+        }
+        if (mesh.skin is not None):
+            info["skin"] = {"skeleton": mesh.skin.skeleton.name,
+                            "bones": _array(mesh.skin.bones),
+                            "weights": _array(mesh.skin.weights)}
+        meshes[mesh.name] = info
+
+    def node_info(node):
+        info = {"name": node.name, "type": node.type,
+                "matrix": np.asarray(node.matrix).tolist()}
+        if isinstance(node.data, Mesh):
+            mesh_info(node.data)
+            info["mesh"] = node.data.name
+        elif isinstance(node.data, Skeleton):
+            skeletons[node.data.name] = [
+                [b.name, b.parent.name if b.parent else None]
+                for b in node.data.bones]
+            info["skeleton"] = node.data.name
+        elif (node.data is not None):
+            info["data"] = node.data.name
+        if (node.children):
+            info["children"] = [node_info(c) for c in node.children]
+        return info
+
+    result = {
+        "nodes": [node_info(n) for n in scene.roots],
+        "meshes": meshes,
+        "materials": materials,
+        "skeletons": skeletons,
+        "tracks": [_track(t) for t in scene.tracks],
+    }
+    if (scene.clips is not None):
+        result["clips"] = [
+            {"name": c.name, "start": c.start, "end": c.end,
+             "tracks": [_track(t) for t in c.tracks]} for c in scene.clips]
+    return result
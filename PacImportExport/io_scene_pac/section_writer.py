@@ -0,0 +1,310 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+Streams the sections of a Collada document into temporary buffers.
+
+Each section is written to its own spooled file, which stays in memory
+while small and moves to disk once it grows past SPOOL_THRESHOLD. The
+document is put together at the end by copying the buffers in section
+order, so memory use doesn't grow with the size of the file.
+
+Sections can also be compressed while they are written. With GZIP every
+section becomes one or more gzip members, which concatenated are a valid
+.gz file. With DEFLATE sections are raw deflate data flushed to a byte
+boundary, which concatenated are a single deflate stream, as stored in
+zip archives.
+
+Lines can contain parts that are still being produced elsewhere, as
+concurrent.futures futures resolving to bytes. Such a line, and every
+line written after it, waits in memory until its futures are done, so the
+document keeps the order lines were written in.
+"""
+
+import collections
+import shutil
+import tempfile
+import zlib
+
+# Bytes a section keeps in memory before spilling to a temporary file
+SPOOL_THRESHOLD = 16 * 1024 * 1024
+
+# Size of the blocks sections are copied with
+COPY_BUFFER = 1024 * 1024
+
+GZIP = "GZIP"
+DEFLATE = "DEFLATE"
+
+_WBITS = {GZIP: 31, DEFLATE: -15}
+
+
+def _gf2_times(matrix, vector):
+    result = 0
+    i = 0
+    while vector:
+        if vector & 1:
+            result ^= matrix[i]
+        vector >>= 1
+        i += 1
+    return result
+
+
+def _gf2_square(matrix):
+    return [_gf2_times(matrix, matrix[n]) for n in range(32)]
+
+
+def crc32_combine(crc1, crc2, length2):
+    """
+    Returns the CRC-32 of two concatenated blocks of data from the CRC-32
+    of each and the length of the second one, like zlib's crc32_combine
+    """
+    if length2 <= 0:
+        return crc1
+
+    # Operator for one zero bit, then squared into two and four bits
+    odd = [0xedb88320] + [1 << n for n in range(31)]
+    even = _gf2_square(odd)
+    odd = _gf2_square(even)
+
+    # Apply length2 zero bytes to crc1
+    while True:
+        even = _gf2_square(odd)
+        if length2 & 1:
+            crc1 = _gf2_times(even, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+        odd = _gf2_square(even)
+        if length2 & 1:
+            crc1 = _gf2_times(odd, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+    return crc1 ^ crc2
+
+
+class Section:
+    """
+    A buffer of UTF-8 encoded lines. Only the line count and the first two
+    lines are kept, which is all purging empty sections needs.
+
+    size and crc are the length and CRC-32 of the uncompressed text (the
+    CRC is only calculated for DEFLATE, which needs it for zip entries).
+    """
+
+    __slots__ = ("buffer", "lines", "head", "newline", "compression",
+                 "level", "compressor", "size", "crc", "pending")
+
+    def __init__(self, threshold, newline=b"\n", compression=None, level=6):
+        self.buffer = tempfile.SpooledTemporaryFile(
+            max_size=threshold, mode="w+b")
+        self.lines = 0
+        self.head = []
+        self.newline = newline
+        self.compression = compression
+        self.level = level
+        self.compressor = None
+        self.size = 0
+        self.crc = 0
+        self.pending = collections.deque()
+
+    def write(self, line):
+        if self.lines < 2:
+            self.head.append(line)
+        self.lines += 1
+        data = line.encode("utf-8") + self.newline
+        if self.pending:
+            self.pending.append(data)
+            self.flush_pending()
+        else:
+            self.write_bytes(data)
+
+    def write_parts(self, parts):
+        """
+        Writes a line made of strings and futures
+        """
+        if self.lines < 2:
+            self.head.append("")
+        self.lines += 1
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode("utf-8")
+            self.pending.append(part)
+        self.pending.append(self.newline)
+        self.flush_pending()
+
+    def flush_pending(self, wait=False):
+        """
+        Writes the pending parts whose futures are done, in order. With
+        wait, waits for all of them.
+        """
+        pending = self.pending
+        while pending:
+            part = pending[0]
+            if not isinstance(part, bytes):
+                if not wait and not part.done():
+                    return
+                part = part.result()
+            pending.popleft()
+            self.write_bytes(part)
+
+    def write_bytes(self, data):
+        self.size += len(data)
+        if self.compression is None:
+            self.buffer.write(data)
+            return
+
+        if self.compressor is None:
+            self.compressor = zlib.compressobj(
+                self.level, zlib.DEFLATED, _WBITS[self.compression])
+        if self.compression == DEFLATE:
+            self.crc = zlib.crc32(data, self.crc)
+        self.buffer.write(self.compressor.compress(data))
+
+    def end_segment(self, final=False):
+        """
+        Completes the compressed data written so far, so it can be followed
+        by the data of another section. final ends the deflate stream.
+        """
+        self.flush_pending(wait=True)
+        if self.compressor is None:
+            return
+        if self.compression == GZIP or final:
+            self.buffer.write(self.compressor.flush(zlib.Z_FINISH))
+        else:
+            self.buffer.write(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+        self.compressor = None
+
+    def extend(self, other):
+        """
+        Appends all lines of another section
+        """
+        for line in other.head[:2 - self.lines]:
+            self.head.append(line)
+        self.lines += other.lines
+
+        self.end_segment()
+        other.end_segment()
+        self.crc = crc32_combine(self.crc, other.crc, other.size)
+        self.size += other.size
+        other.buffer.seek(0)
+        shutil.copyfileobj(other.buffer, self.buffer, COPY_BUFFER)
+
+    def is_empty_node(self):
+        """
+        Whether the section is only an opening and a closing tag, such as
+        "<library_lights>" followed by "</library_lights>"
+        """
+        return self.lines == 2 and self.head[0][1:] == self.head[1][2:]
+
+    def copy_to(self, f):
+        self.end_segment()
+        self.buffer.seek(0)
+        shutil.copyfileobj(self.buffer, f, COPY_BUFFER)
+
+    def close(self):
+        self.buffer.close()
+
+
+class SectionWriter:
+    """
+    The sections of a document, by section number. Lines are ended with
+    newline, which is empty for compact output. compression is None, GZIP
+    or DEFLATE, with a zlib compression level.
+    """
+
+    __slots__ = ("sections", "threshold", "newline", "compression", "level")
+
+    def __init__(self, threshold=SPOOL_THRESHOLD, newline=b"\n",
+                 compression=None, level=6):
+        self.sections = {}
+        self.threshold = threshold
+        self.newline = newline
+        self.compression = compression
+        self.level = level
+
+    def new_section(self):
+        return Section(
+            self.threshold, self.newline, self.compression, self.level)
+
+    def __contains__(self, section):
+        return section in self.sections
+
+    def write(self, section, line):
+        if section not in self.sections:
+            self.sections[section] = self.new_section()
+        self.sections[section].write(line)
+
+    def write_parts(self, section, parts):
+        if section not in self.sections:
+            self.sections[section] = self.new_section()
+        self.sections[section].write_parts(parts)
+
+    def move(self, source, destination):
+        """
+        Appends a section to the end of another one and removes it
+        """
+        if source not in self.sections:
+            return
+        section = self.sections.pop(source)
+        if destination not in self.sections:
+            self.sections[destination] = self.new_section()
+        self.sections[destination].extend(section)
+        section.close()
+
+    def purge_empty_nodes(self):
+        """
+        Removes the sections that are only an empty element, returns their
+        keys
+        """
+        keys = [k for k, v in self.sections.items() if v.is_empty_node()]
+        for key in keys:
+            self.sections.pop(key).close()
+        return keys
+
+    def assemble(self, f, header, footer):
+        """
+        Writes header, all sections in section order and footer to the
+        binary file f. Returns the CRC-32 and size of the uncompressed
+        document (the CRC is 0 unless compressing with DEFLATE).
+        """
+        head = self.new_section()
+        head.write_bytes(header)
+        tail = self.new_section()
+        tail.write_bytes(footer)
+        # The end of the document ends the deflate stream too
+        tail.end_segment(final=True)
+
+        parts = [head]
+        parts += [self.sections[key] for key in sorted(self.sections)]
+        parts.append(tail)
+
+        crc = 0
+        size = 0
+        for part in parts:
+            part.copy_to(f)
+            crc = crc32_combine(crc, part.crc, part.size)
+            size += part.size
+
+        head.close()
+        tail.close()
+        return crc, size
+
+    def close(self):
+        for section in self.sections.values():
+            section.close()
+        self.sections = {}